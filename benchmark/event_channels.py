@@ -0,0 +1,230 @@
+# -*- coding:utf-8 -*-
+
+"""
+消费通道压力测试，使用本地模拟的RabbitMQ(协议、通道、队列)，大量推送 Orderbook 消息的同时推送 EventOrder / EventConfig 消息，
+对比所有交换机共享一个消费通道和每个交换机独立消费通道时，每个通道的投递、确认吞吐量以及委托单、配置消息的投递延迟
+
+运行: python -m benchmark.event_channels [订单薄消息数量] [委托单/配置消息数量]
+
+Author: HuangTao
+Date:   2019/06/10
+"""
+
+import sys
+import json
+import asyncio
+import collections
+
+from quant.config import config
+from quant.event import Event, EventCenter, EventOrderbook
+
+
+# 模拟的网络往返时间(秒)，确认消息之后经过这个时间消息窗口才释放
+ACK_RTT = 0.0005
+
+Envelope = collections.namedtuple("Envelope", ["exchange_name", "routing_key", "delivery_tag"])
+Properties = collections.namedtuple("Properties", ["app_id", "content_type"])
+
+
+class FakeBroker:
+    """ 模拟的RabbitMQ服务，只支持routing_key完全匹配的绑定
+    """
+
+    def __init__(self):
+        self.queues = {}  # 队列里的消息 {queue_name: deque([(exchange, routing_key, body), ...])}
+        self.bindings = collections.defaultdict(set)  # 绑定关系 {(exchange, routing_key): {queue_name, ...}}
+        self.channels = []
+        self._queue_id = 0
+
+    def declare(self, queue_name=None):
+        if not queue_name:
+            self._queue_id += 1
+            queue_name = "amq.gen-{}".format(self._queue_id)
+        self.queues.setdefault(queue_name, collections.deque())
+        return queue_name
+
+    def publish(self, exchange, routing_key, body):
+        for queue_name in self.bindings.get((exchange, routing_key), ()):
+            self.queues[queue_name].append((exchange, routing_key, body))
+        for channel in self.channels:
+            channel.wakeup()
+
+
+class FakeChannel:
+    """ 模拟的消费通道，按照消息窗口(prefetch)大小投递消息，轮流从本通道消费的队列里取消息
+    """
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._prefetch = 0
+        self._consumers = []  # [(queue_name, callback), ...]
+        self._unacked = collections.OrderedDict()  # 未确认的消息 {delivery_tag: queue_name}
+        self._delivery_tag = 0
+        self._next = 0  # 下一个取消息的消费者
+        self._event = asyncio.Event()
+        self._task = None
+        self.is_open = True
+        self.delivered = 0
+        self.acked = 0
+        broker.channels.append(self)
+
+    def wakeup(self):
+        self._event.set()
+
+    async def exchange_declare(self, exchange_name, type_name):
+        pass
+
+    async def basic_qos(self, prefetch_count):
+        self._prefetch = prefetch_count
+
+    async def queue_declare(self, queue_name=None, exclusive=False):
+        return {"queue": self._broker.declare(queue_name)}
+
+    async def queue_bind(self, queue_name, exchange_name, routing_key):
+        self._broker.bindings[(exchange_name, routing_key)].add(queue_name)
+
+    async def basic_consume(self, callback, queue_name):
+        self._consumers.append((queue_name, callback))
+        if not self._task:
+            self._task = asyncio.get_event_loop().create_task(self._deliver())
+
+    def close(self):
+        self.is_open = False
+        if self._task:
+            self._task.cancel()
+
+    async def basic_client_ack(self, delivery_tag, multiple=False):
+        await asyncio.sleep(ACK_RTT)
+        tags = [tag for tag in self._unacked if tag <= delivery_tag] if multiple else [delivery_tag]
+        for tag in tags:
+            self._unacked.pop(tag, None)
+        self.acked += len(tags)
+        self.wakeup()
+
+    async def _deliver(self):
+        """ 消息窗口未满时，轮流从每个队列取一条消息投递
+        """
+        while True:
+            message = None
+            if not self._prefetch or len(self._unacked) < self._prefetch:
+                for _ in range(len(self._consumers)):
+                    queue_name, callback = self._consumers[self._next % len(self._consumers)]
+                    self._next += 1
+                    if self._broker.queues[queue_name]:
+                        message = self._broker.queues[queue_name].popleft()
+                        break
+            if not message:
+                self._event.clear()
+                await self._event.wait()
+                continue
+            exchange, routing_key, body = message
+            self._delivery_tag += 1
+            self._unacked[self._delivery_tag] = queue_name
+            self.delivered += 1
+            envelope = Envelope(exchange, routing_key, self._delivery_tag)
+            properties = Properties(None, "application/json")
+            asyncio.get_event_loop().create_task(callback(self, body, envelope, properties))
+            await asyncio.sleep(0)
+
+
+class FakeProtocol:
+    """ 模拟的AMQP连接
+    """
+
+    def __init__(self, broker):
+        self._broker = broker
+
+    async def channel(self):
+        return FakeChannel(self._broker)
+
+    async def close(self):
+        pass
+
+
+class Recorder:
+    """ 记录消息投递延迟
+    """
+
+    def __init__(self):
+        self.latencies = []
+
+    async def on_event(self, event):
+        self.latencies.append(asyncio.get_event_loop().time() - event["ts"])
+
+
+def make_event(name, exchange, routing_key, prefetch_count, data=None):
+    return Event(name=name, exchange=exchange, routing_key=routing_key, pre_fetch_count=prefetch_count, data=data)
+
+
+async def run(mode, orderbook_count, order_count):
+    """ 执行一次压力测试
+    @param mode shared 所有交换机共享一个消费通道 / sharded 每个交换机独立消费通道
+    @param orderbook_count 订单薄消息数量
+    @param order_count 委托单、配置消息数量
+    """
+    shards = {"Orderbook": "all", "order": "all", "config": "all"} if mode == "shared" else {}
+    config.update({"RABBITMQ": {"channel_shards": shards, "prefetch": {"Orderbook": 50, "all": 50}}})
+    loop = asyncio.get_event_loop()
+    broker = FakeBroker()
+    center = EventCenter()
+    center._protocol = FakeProtocol(broker)
+    center._channel = await center._protocol.channel()
+    center._connected = True
+
+    # 订阅事件，订单薄消息使用真实的解码和解析
+    orderbook = EventOrderbook("binance", "BTC/USDT", array=True)
+    orderbook._callback = lambda o: asyncio.sleep(0)
+    recorders = {}
+    await center.subscribe(orderbook, orderbook.callback)
+    for name, exchange, routing_key in (("ORDER", "order", "binance.BTC/USDT"), ("EVENT_CONFIG", "config", "server")):
+        event = make_event(name, exchange, routing_key, 1)
+        event.parse = lambda event=event: event.data
+        recorders[exchange] = Recorder()
+        event._callback = recorders[exchange].on_event
+        await center.subscribe(event, event.callback)
+    center._bind_and_consume()
+    await asyncio.sleep(0.1)
+
+    # 一次性推送大量订单薄消息，然后均匀推送委托单和配置消息
+    asks = [["%.8f" % (8680.7 + i * 0.1), "%.8f" % (0.002 + i)] for i in range(20)]
+    bids = [["%.8f" % (8680.6 - i * 0.1), "%.8f" % (2.826 + i)] for i in range(20)]
+    body = EventOrderbook("binance", "BTC/USDT", asks, bids, 1558949307370).dumps()
+    start = loop.time()
+    for _ in range(orderbook_count):
+        broker.publish("Orderbook", orderbook.routing_key, body)
+    for i in range(order_count):
+        for exchange, routing_key in (("order", "binance.BTC/USDT"), ("config", "server")):
+            broker.publish(exchange, routing_key, json.dumps({"n": exchange, "d": {"ts": loop.time(), "i": i}}))
+        await asyncio.sleep(0.001)
+
+    # 等待所有消息投递并确认
+    total = orderbook_count + order_count * 2
+    while sum([c.acked for c in center._consume_channels.values()]) < total:
+        await asyncio.sleep(0.01)
+    duration = loop.time() - start
+
+    print("mode: %s  duration: %.3fs" % (mode, duration))
+    print("  %-10s %8s %10s %10s %14s" % ("channel", "prefetch", "delivered", "acked", "acked(msg/s)"))
+    for shard, channel in center._consume_channels.items():
+        print("  %-10s %8d %10d %10d %14.0f" % (shard, channel._prefetch, channel.delivered, channel.acked,
+                                                 channel.acked / duration))
+    for exchange, recorder in recorders.items():
+        latencies = sorted(recorder.latencies)
+        print("  %-10s latency avg: %.2fms  p99: %.2fms  max: %.2fms" % (
+            exchange, sum(latencies) / len(latencies) * 1000, latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            latencies[-1] * 1000))
+
+    for channel in broker.channels:
+        channel.close()
+    await asyncio.sleep(0)
+
+
+def main():
+    orderbook_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    order_count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    for mode in ("shared", "sharded"):
+        asyncio.get_event_loop().run_until_complete(run(mode, orderbook_count, order_count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+# -*- coding:utf-8 -*-
+
+"""
+事件编解码性能测试，对比各个编解码器对 EventOrderbook / EventTrade / EventKline 的编码、解码吞吐量
+
+运行: python -m benchmark.event_codec [次数]
+
+Author: HuangTao
+Date:   2019/06/03
+"""
+
+import sys
+import timeit
+
+from quant.utils import codec
+from quant.event import EventOrderbook, EventTrade, EventKline
+
+
+def make_events():
+    """ 构造测试事件
+    """
+    asks = [["%.8f" % (8680.7 + i * 0.1), "%.8f" % (0.002 + i)] for i in range(20)]
+    bids = [["%.8f" % (8680.6 - i * 0.1), "%.8f" % (2.826 + i)] for i in range(20)]
+    events = [
+        EventOrderbook("binance", "BTC/USDT", asks, bids, 1558949307370),
+        EventTrade("binance", "BTC/USDT", "SELL", "8686.40000000", "0.00200000", 1558949571111),
+        EventKline("binance", "BTC/USDT", "8665.50000000", "8668.40000000", "8660.00000000", "8660.00000000",
+                   "73.14728136", 1558946340000)
+    ]
+    return events
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    codecs = []
+    for name in ("json", "msgpack"):
+        try:
+            codecs.append(codec.get_codec(name))
+        except ImportError:
+            print("codec %s not available, skip." % name)
+
+    print("%-16s %-8s %8s %14s %14s" % ("event", "codec", "bytes", "encode(op/s)", "decode(op/s)"))
+    for event in make_events():
+        for c in codecs:
+            payload = event.dumps(c)
+            t_encode = timeit.timeit(lambda: event.dumps(c), number=number)
+            t_decode = timeit.timeit(lambda: event.loads(payload, c), number=number)
+            print("%-16s %-8s %8d %14.0f %14.0f" % (event.name, c.NAME, len(payload), number / t_encode,
+                                                    number / t_decode))
+
+
+if __name__ == "__main__":
+    main()
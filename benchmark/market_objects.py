@@ -0,0 +1,80 @@
+# -*- coding:utf-8 -*-
+
+"""
+行情对象性能测试，对比使用 __dict__ 的普通对象与使用 __slots__ 的对象的内存占用、创建耗时和 data 序列化耗时
+
+运行: python -m benchmark.market_objects [对象数量]
+
+Author: HuangTao
+Date:   2019/06/21
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from quant.market import Orderbook, Trade, Kline
+
+
+def make_dict_class(cls):
+    """ 构造与cls属性相同、使用 __dict__ 的普通对象类，与改为 __slots__ 之前的实现一致
+    """
+    keys = cls.__slots__
+
+    def data(self):
+        return {key: getattr(self, key) for key in keys}
+
+    return type("Dict" + cls.__name__, (), {"__init__": cls.__init__, "data": cls.__dict__.get("data", property(data))})
+
+
+def make_args(cls, i):
+    """ 构造对象的参数
+    """
+    if cls is Orderbook:
+        return ("binance", "BTC/USDT", [["8680.7", "0.002"]], [["8680.6", "2.82"]], 1558949307370 + i), {}
+    if cls is Trade:
+        return ("binance", "BTC/USDT", "BUY", "8686.4", "0.002", 1558949571111 + i), {}
+    return ("binance", "BTC/USDT", "8665.5", "8668.4", "8660.0", "8660.0", "73.1", 1558946340000 + i), {}
+
+
+def timed(func):
+    """ 执行函数并返回耗时(秒)
+    """
+    begin = time.perf_counter()
+    func()
+    return time.perf_counter() - begin
+
+
+def measure(cls, number, args_cls):
+    """ 测试对象的内存占用(字节/个)、创建耗时(微秒/个)、data序列化耗时(微秒/个)
+    @param cls 测试的对象类
+    @param number 对象数量
+    @param args_cls 构造参数对应的行情对象类
+    """
+    args = [make_args(args_cls, i) for i in range(number)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [cls(*a, **kw) for a, kw in args]
+    memory = (tracemalloc.get_traced_memory()[0] - before) / number
+    tracemalloc.stop()
+
+    gc.disable()
+    create = min([timed(lambda: [cls(*a, **kw) for a, kw in args]) for _ in range(5)]) / number * 1e6
+    data = min([timed(lambda: [obj.data for obj in objects]) for _ in range(5)]) / number * 1e6
+    gc.enable()
+    return memory, create, data
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print("%-12s %-8s %12s %12s %12s" % ("object", "layout", "bytes/obj", "create us", "data us"))
+    for cls in (Orderbook, Trade, Kline):
+        for layout, c in (("dict", make_dict_class(cls)), ("slots", cls)):
+            memory, create, data = measure(c, number, cls)
+            print("%-12s %-8s %12.1f %12.3f %12.3f" % (cls.__name__, layout, memory, create, data))
+
+
+if __name__ == "__main__":
+    main()
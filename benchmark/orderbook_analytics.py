@@ -0,0 +1,110 @@
+# -*- coding:utf-8 -*-
+
+"""
+订单薄分析指标性能测试，对比逐个订单薄遍历档位列表的计算方式与 quant.analytics 批量向量化计算的每个订单薄耗时
+
+运行: python -m benchmark.orderbook_analytics [订单薄数量]
+
+Author: HuangTao
+Date:   2019/06/18
+"""
+
+import sys
+import time
+import random
+
+from quant import analytics
+from quant.market import Orderbook, ArrayOrderbook
+
+
+DEPTH = 20
+LEVELS = 5
+SIZE = 3
+
+
+def make_orderbooks(number):
+    """ 构造测试订单薄，档位价格和数量为字符串，与行情推送的格式一致
+    """
+    orderbooks = []
+    for _ in range(number):
+        mid = random.uniform(100, 10000)
+        asks = [["%.8f" % (mid + 0.1 * (i + 1)), "%.8f" % random.uniform(0.1, 2)] for i in range(DEPTH)]
+        bids = [["%.8f" % (mid - 0.1 * (i + 1)), "%.8f" % random.uniform(0.1, 2)] for i in range(DEPTH)]
+        orderbooks.append(Orderbook("binance", "BTC/USDT", asks, bids, 1558949307370))
+    return orderbooks
+
+
+def naive_average_price(levels, size):
+    """ 遍历档位列表计算吃掉size数量的平均成交价格
+    """
+    remain, cost = size, 0
+    for price, quantity in levels:
+        price, quantity = float(price), float(quantity)
+        fill = min(remain, quantity)
+        cost += price * fill
+        remain -= fill
+        if remain <= 0:
+            return cost / size
+    return None
+
+
+def naive_analyze(orderbook):
+    """ 遍历档位列表计算指标
+    """
+    asks, bids = orderbook.asks, orderbook.bids
+    ask_price, ask_quantity = float(asks[0][0]), float(asks[0][1])
+    bid_price, bid_quantity = float(bids[0][0]), float(bids[0][1])
+    ask_total = sum([float(q) for _, q in asks[:LEVELS]])
+    bid_total = sum([float(q) for _, q in bids[:LEVELS]])
+    result = {
+        "mid_price": (ask_price + bid_price) / 2,
+        "spread": ask_price - bid_price,
+        "ask_vwap": sum([float(p) * float(q) for p, q in asks[:LEVELS]]) / ask_total,
+        "bid_vwap": sum([float(p) * float(q) for p, q in bids[:LEVELS]]) / bid_total,
+        "imbalance": (bid_total - ask_total) / (bid_total + ask_total),
+        "microprice": (ask_price * bid_quantity + bid_price * ask_quantity) / (ask_quantity + bid_quantity),
+        "buy_slippage": naive_average_price(asks, SIZE) - ask_price,
+        "sell_slippage": bid_price - naive_average_price(bids, SIZE)
+    }
+    return result
+
+
+def timed(func, *args):
+    """ 执行函数并返回耗时(秒)
+    """
+    begin = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - begin
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    orderbooks = make_orderbooks(number)
+    array_orderbooks = [ArrayOrderbook(o.platform, o.symbol, o.asks, o.bids, o.timestamp) for o in orderbooks]
+
+    # 校验计算结果一致
+    expected = naive_analyze(orderbooks[0])
+    result = analytics.analyze(orderbooks[:1], DEPTH, LEVELS, SIZE)
+    for key, value in expected.items():
+        assert abs(result[key][0] - value) < 1e-6, key
+
+    cases = [
+        ("naive list walk", lambda: [naive_analyze(o) for o in orderbooks]),
+        ("vectorized Orderbook", lambda: analytics.analyze(orderbooks, DEPTH, LEVELS, SIZE)),
+        ("vectorized ArrayOrderbook", lambda: analytics.analyze(array_orderbooks, DEPTH, LEVELS, SIZE)),
+    ]
+    ap, aq, bp, bq = analytics.to_arrays(orderbooks, DEPTH)
+    cases.append(("vectorized arrays only", lambda: (analytics.vwap(ap, aq, LEVELS), analytics.vwap(bp, bq, LEVELS),
+                                                      analytics.imbalance(aq, bq, LEVELS),
+                                                      analytics.microprice(ap, aq, bp, bq),
+                                                      analytics.slippage(ap, aq, SIZE),
+                                                      analytics.slippage(bp, bq, SIZE))))
+
+    print("%-28s %14s" % ("case", "us/book"))
+    for name, func in cases:
+        cost = min([timed(func) for _ in range(3)])
+        print("%-28s %14.2f" % (name, cost / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
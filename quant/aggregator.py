@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+
+"""
+K线聚合
+订阅1分钟K线(Kline)或者成交(Trade)行情，增量合成任意周期的K线，每个周期只保存当前正在合成的一根K线。
+
+1. 使用1分钟K线合成时，收到K线周期内最后一分钟的K线之后，当前K线立即完成；
+2. 使用成交合成时，收到下一个周期的第一笔成交之后，当前K线完成；周期内没有成交时不会生成K线；
+3. 5分钟、15分钟、1小时的K线完成之后发布 EventKline5Min / EventKline15Min / EventKline1Hour 事件，
+   同一进程内的订阅者直接收到事件，不经过RabbitMQ；
+4. 同一根1分钟K线的多次更新，使用最新的数据替换上一次合并的数据，成交量不会重复累加；
+5. 早于正在合成的K线开始时间的行情(延迟到达)将被忽略；
+
+Author: HuangTao
+Date:   2019/06/19
+Update: 2019/06/29  1. K线周期错误时抛出ValueError；忽略早于正在合成的K线的行情；同一根1分钟K线的重复更新不再重复累加成交量；
+"""
+
+from quant import const
+from quant.utils import logger
+from quant.market import Market, Kline
+from quant.tasks import SingleTask
+
+
+__all__ = ("KlineAggregator", )
+
+
+class KlineAggregator:
+    """ K线聚合
+    """
+
+    def __init__(self, platform, symbol, intervals=None, source=const.MARKET_TYPE_KLINE, callback=None,
+                 update_callback=None, publish=True, publish_updates=False):
+        """ 初始化
+        @param platform 交易平台
+        @param symbol 交易对
+        @param intervals K线周期列表(秒)，必须是60的整数倍，默认 [300, 900, 3600]
+        @param source 合成K线使用的行情 MARKET_TYPE_KLINE 1分钟K线 / MARKET_TYPE_TRADE 成交
+        @param callback K线完成回调函数 async def callback(interval, kline)
+        @param update_callback 正在合成的K线更新回调函数 async def update_callback(interval, kline)
+        @param publish 是否发布已完成的5分钟、15分钟、1小时K线事件
+        @param publish_updates 是否发布正在合成的K线，正在合成的K线与完成的K线时间戳相同，订阅者按照时间戳覆盖即可
+        """
+        from quant.event import EventKline5Min, EventKline15Min, EventKline1Hour
+
+        self._platform = platform
+        self._symbol = symbol
+        self._intervals = intervals or [300, 900, 3600]
+        self._callback = callback
+        self._update_callback = update_callback
+        self._publish = publish
+        self._publish_updates = publish_updates
+        self._events = {300: EventKline5Min, 900: EventKline15Min, 3600: EventKline1Hour}  # 可以发布的K线事件
+        self._bars = {interval: None for interval in self._intervals}  # 正在合成的K线 [start, open, high, low, close, volume]
+        self._closed = {interval: None for interval in self._intervals}  # 最后一根已完成K线的开始时间戳(毫秒)
+        # 最后合并的1分钟K线 (timestamp, high, low, volume)，high/low/volume为合并这根1分钟K线之前正在合成的K线的数据，
+        # 同一根1分钟K线再次更新时，先恢复到合并之前的数据再合并；周期内第一根1分钟K线时 high/low 为None
+        self._minutes = {interval: None for interval in self._intervals}
+
+        for interval in self._intervals:
+            if interval <= 0 or interval % 60 != 0:
+                raise ValueError("kline interval error: {}".format(interval))
+
+        if source == const.MARKET_TYPE_KLINE:
+            Market(const.MARKET_TYPE_KLINE, platform, symbol, self.on_event_kline_update)
+        elif source == const.MARKET_TYPE_TRADE:
+            Market(const.MARKET_TYPE_TRADE, platform, symbol, self.on_event_trade_update)
+        else:
+            logger.error("source error:", source, caller=self)
+
+    async def on_event_kline_update(self, kline):
+        """ 1分钟K线更新
+        """
+        ts = int(kline.timestamp)
+        o, h, l, c, v = float(kline.open), float(kline.high), float(kline.low), float(kline.close), float(kline.volume)
+        for interval in self._intervals:
+            self._update(interval, ts, o, h, l, c, v, ts + 60000, True)
+
+    async def on_event_trade_update(self, trade):
+        """ 成交更新
+        """
+        ts = int(trade.timestamp)
+        p, q = float(trade.price), float(trade.quantity)
+        for interval in self._intervals:
+            self._update(interval, ts, p, p, p, p, q, ts)
+
+    def _update(self, interval, ts, o, h, l, c, v, end, minute=False):
+        """ 合成K线
+        @param interval K线周期(秒)
+        @param ts 行情时间戳(毫秒)
+        @param o, h, l, c, v 行情的开盘价、最高价、最低价、收盘价、成交量
+        @param end 行情的结束时间戳(毫秒)，1分钟K线为开始时间加1分钟，成交为成交时间
+        @param minute 是否是1分钟K线，同一根1分钟K线的多次更新替换上一次合并的数据
+        """
+        span = interval * 1000
+        start = ts - ts % span
+        closed = self._closed[interval]
+        if closed is not None and start <= closed:  # 已经完成的K线周期内的行情，忽略
+            return
+        bar = self._bars[interval]
+        if bar and start < bar[0]:  # 早于正在合成的K线的行情(延迟到达)，忽略
+            logger.warn("late market data ignored! interval:", interval, "timestamp:", ts, "bar start:", bar[0],
+                        caller=self)
+            return
+        if bar and start > bar[0]:
+            self._finish(interval, bar)
+            bar = None
+        if minute:
+            last = self._minutes[interval]
+            if not bar or not last or last[0] != ts:  # 新的1分钟K线，记录合并之前的数据
+                last = (ts, bar[2], bar[3], bar[5]) if bar else (ts, None, None, 0)
+                self._minutes[interval] = last
+            if last[1] is None:  # 周期内第一根1分钟K线，重新开始合成
+                bar = None
+            else:
+                bar[2], bar[3], bar[5] = last[1], last[2], last[3]
+        if not bar:
+            bar = [start, o, h, l, c, v]
+            self._bars[interval] = bar
+        else:
+            if h > bar[2]:
+                bar[2] = h
+            if l < bar[3]:
+                bar[3] = l
+            bar[4] = c
+            bar[5] += v
+        if end >= start + span:
+            self._finish(interval, bar)
+        else:
+            self._emit(interval, bar, False)
+
+    def _finish(self, interval, bar):
+        """ K线完成
+        """
+        self._bars[interval] = None
+        self._closed[interval] = bar[0]
+        self._emit(interval, bar, True)
+
+    def _emit(self, interval, bar, finished):
+        """ 推送K线
+        @param interval K线周期(秒)
+        @param bar K线 [start, open, high, low, close, volume]
+        @param finished 是否已经完成
+        """
+        callback = self._callback if finished else self._update_callback
+        publish = self._publish if finished else self._publish_updates
+        event_cls = self._events.get(interval) if publish else None
+        if not callback and not event_cls:
+            return
+        start, o, h, l, c, v = bar
+        if callback:
+            kline = Kline(self._platform, self._symbol, o, h, l, c, v, start)
+            SingleTask.run(callback, interval, kline)
+        if event_cls:
+            event_cls(self._platform, self._symbol, o, h, l, c, v, start).publish()
@@ -0,0 +1,135 @@
+# -*- coding:utf-8 -*-
+
+"""
+订单薄分析指标，基于numpy向量化计算（需要安装 numpy 库）
+所有指标函数的入参为档位数组，一维数组为一个订单薄，二维数组 (订单薄数量, 档位数量) 为一批订单薄，一次调用计算所有订单薄的指标；
+价格数组不足的档位为NaN，数量数组不足的档位为0，可以通过 to_arrays 从 Orderbook / ArrayOrderbook 生成。
+只有数组订单薄 ArrayOrderbook 能加速：档位直接从float64数组拷贝；普通 Orderbook 的档位是字符串，转换成数组时需要逐个解析
+所有档位，比直接遍历档位列表计算更慢，只在一次计算多个指标、或者需要保留数组重复计算时使用。
+
+Author: HuangTao
+Date:   2019/06/18
+Update: 2019/06/29  1. to_arrays 只取每个档位的前两个字段(价格、数量)，兼容包含其它字段的档位；
+"""
+
+import itertools
+from array import array
+
+import numpy as np
+
+from quant.market import ArrayOrderbook
+
+
+__all__ = ("to_arrays", "vwap", "imbalance", "microprice", "average_price", "slippage", "analyze", )
+
+
+def to_arrays(orderbooks, depth=10):
+    """ 将订单薄转换成档位数组
+    @param orderbooks 订单薄对象 Orderbook / ArrayOrderbook，或者订单薄对象列表
+    @param depth 档位数量
+    @return (ask_prices, ask_quantities, bid_prices, bid_quantities) 传入单个订单薄时为一维数组，传入列表时为二维数组
+    * NOTE: 全部为数组订单薄时，档位直接从float64数组拷贝，不需要解析；普通订单薄每个档位只取 [price, quantity]
+    """
+    single = not isinstance(orderbooks, (list, tuple))
+    if single:
+        orderbooks = [orderbooks]
+    n = len(orderbooks)
+    if n and all([isinstance(orderbook, ArrayOrderbook) for orderbook in orderbooks]):
+        buf = array("d")
+        for orderbook in orderbooks:
+            orderbook.dump(buf, depth)
+        data = np.frombuffer(buf, dtype=np.float64).reshape(n, 2, 2, depth)
+    else:
+        flat = []
+        pad = [np.nan, 0.0] * depth
+        for orderbook in orderbooks:
+            for levels in (orderbook.asks or [], orderbook.bids or []):
+                levels = levels[:depth]
+                flat.extend(itertools.chain.from_iterable([level[:2] for level in levels]))
+                flat.extend(pad[:(depth - len(levels)) * 2])
+        data = np.array(flat, dtype=np.float64).reshape(n, 2, depth, 2).transpose(0, 1, 3, 2)
+    if single:
+        data = data[0]
+    return data[..., 0, 0, :], data[..., 0, 1, :], data[..., 1, 0, :], data[..., 1, 1, :]
+
+
+def vwap(prices, quantities, levels=None):
+    """ 前N档成交量加权平均价格
+    @param prices 价格数组
+    @param quantities 数量数组
+    @param levels 档位数量，None为所有档位
+    """
+    p = prices[..., :levels]
+    q = quantities[..., :levels]
+    total = q.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, np.nansum(p * q, axis=-1) / total, np.nan)
+
+
+def imbalance(ask_quantities, bid_quantities, levels=1):
+    """ 前N档买卖盘数量不平衡度 (bid - ask) / (bid + ask)，取值范围 [-1, 1]，正数表示买盘更多
+    @param ask_quantities 卖盘数量数组
+    @param bid_quantities 买盘数量数组
+    @param levels 档位数量
+    """
+    a = ask_quantities[..., :levels].sum(axis=-1)
+    b = bid_quantities[..., :levels].sum(axis=-1)
+    total = a + b
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, (b - a) / total, np.nan)
+
+
+def microprice(ask_prices, ask_quantities, bid_prices, bid_quantities):
+    """ 微观价格，按照买一卖一数量加权的中间价 (ask * bid_qty + bid * ask_qty) / (ask_qty + bid_qty)
+    """
+    ap, aq = ask_prices[..., 0], ask_quantities[..., 0]
+    bp, bq = bid_prices[..., 0], bid_quantities[..., 0]
+    total = aq + bq
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, (ap * bq + bp * aq) / total, np.nan)
+
+
+def average_price(prices, quantities, size):
+    """ 吃掉size数量的平均成交价格，订单薄深度不足时为NaN
+    @param prices 价格数组
+    @param quantities 数量数组
+    @param size 目标数量，可以为每个订单薄分别指定的数组
+    """
+    size = np.asarray(size, dtype=np.float64)
+    cumulative = np.cumsum(quantities, axis=-1)
+    before = cumulative - quantities
+    fills = np.clip(np.minimum(quantities, size[..., None] - before), 0, None)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cost = np.nansum(np.where(fills > 0, prices * fills, 0), axis=-1)
+        return np.where(cumulative[..., -1] >= size, cost / size, np.nan)
+
+
+def slippage(prices, quantities, size):
+    """ 吃掉size数量相对于最优价格的滑点（绝对值），订单薄深度不足时为NaN
+    @param prices 价格数组
+    @param quantities 数量数组
+    @param size 目标数量，可以为每个订单薄分别指定的数组
+    """
+    return np.abs(average_price(prices, quantities, size) - prices[..., 0])
+
+
+def analyze(orderbooks, depth=10, levels=5, size=1):
+    """ 计算订单薄的所有指标
+    @param orderbooks 订单薄对象，或者订单薄对象列表
+    @param depth 档位数量
+    @param levels vwap和imbalance使用的档位数量
+    @param size slippage使用的目标数量
+    @return dict 指标名称对应的数值（传入列表时为数组）
+    """
+    ap, aq, bp, bq = to_arrays(orderbooks, depth)
+    result = {
+        "mid_price": (ap[..., 0] + bp[..., 0]) / 2,
+        "spread": ap[..., 0] - bp[..., 0],
+        "ask_vwap": vwap(ap, aq, levels),
+        "bid_vwap": vwap(bp, bq, levels),
+        "imbalance": imbalance(aq, bq, levels),
+        "microprice": microprice(ap, aq, bp, bq),
+        "buy_slippage": slippage(ap, aq, size),
+        "sell_slippage": slippage(bp, bq, size)
+    }
+    return result
@@ -27,6 +27,10 @@ class Config:
             `PLATFORMS`     交易所配置
             `HEARTBEAT`     服务心跳配置 {"interval": 0, "broadcast": 0}
             `PROXY`         HTTP代理配置
+            `REPLAY`        行情回放配置
+            `HTTP`          HTTP连接池配置
+            `RATE_LIMIT`    REST API限频配置
+            `WEBSOCKET`     websocket消息处理配置
         """
         self.server_id = None       # 服务id（manager服务创建）
         self.run_time_update = False  # 是否支持配置动态更新
@@ -38,6 +42,10 @@ class Config:
         self.heartbeat = {}         # 服务心跳配置
         self.service = {}           # 代理服务配置
         self.proxy = None           # HTTP代理配置
+        self.replay = None          # 行情回放配置
+        self.http = {}              # HTTP连接池配置
+        self.rate_limit = {}        # REST API限频配置
+        self.websocket = {}         # websocket消息处理配置
 
     def initialize(self):
         """ 初始化
@@ -95,6 +103,10 @@ class Config:
         self.heartbeat = update_fields.get("HEARTBEAT", {})         # 服务心跳配置
         self.service = update_fields.get("SERVICE", {})             # 代理服务配置
         self.proxy = update_fields.get("PROXY", None)               # HTTP代理配置
+        self.replay = update_fields.get("REPLAY", None)             # 行情回放配置
+        self.http = update_fields.get("HTTP", {})                   # HTTP连接池配置
+        self.rate_limit = update_fields.get("RATE_LIMIT", {})       # REST API限频配置
+        self.websocket = update_fields.get("WEBSOCKET", {})         # websocket消息处理配置
 
         # 将配置文件中的数据按照dict格式解析并设置成config的属性
         for k, v in update_fields.items():
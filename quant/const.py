@@ -28,6 +28,7 @@ BITSTAMP = "bitstamp"
 GEMINI = "gemini"
 FOTA = "fota"
 BIBOX = "bibox"
+SIMULATED = "simulated"  # 模拟交易
 
 
 # 行情类型
@@ -37,3 +38,4 @@ MARKET_TYPE_ORDERBOOK = "orderbook"
 MARKET_TYPE_KLINE = "kline"
 MARKET_TYPE_KLINE_5M = "kline_5m"
 MARKET_TYPE_KLINE_15M = "kline_15m"
+MARKET_TYPE_KLINE_1H = "kline_1h"
@@ -5,10 +5,22 @@
 
 Author: HuangTao
 Date:   2018/05/17
-Update: None
+Update: 2019/06/22  1. ticker行情和K线数据使用写缓冲批量写入;
+                    2. 声明所有表的索引;
+        2019/06/23  1. 增加流式读取K线数据;
+        2019/06/24  1. 增加K线数据、资产数据的读缓存;
+        2019/06/25  1. 增加ticker行情和K线数据按天导出、导入 .npz 文件;
+        2019/06/29  1. 写入已经结束的时间段的K线、导入K线之后，删除对应的K线读缓存；资产读缓存使用深拷贝;
+                    2. K线读缓存返回数据的拷贝;
 """
 
+import os
+import copy
+import bisect
+import asyncio
+
 from quant.utils import tools
+from quant.utils.cache import LRUCache
 from quant.utils.mongo import MongoDBBase
 
 
@@ -24,6 +36,10 @@ class TickerData(MongoDBBase):
         }
     """
 
+    INDEXES = [
+        [("create_time", -1)]
+    ]
+
     def __init__(self, platform):
         """ 初始化
         @param platform 交易平台
@@ -51,7 +67,7 @@ class TickerData(MongoDBBase):
             'B': bid_quantity,
             't': timestamp
         }
-        price_id = await self.insert(data, cursor=cursor)
+        price_id = await self.insert(data, cursor=cursor, buffered=True)
         return price_id
 
     async def get_latest_ticker_by_symbol(self, symbol):
@@ -63,6 +79,33 @@ class TickerData(MongoDBBase):
         result = await self.find_one(sort=sort, cursor=cursor)
         return result
 
+    async def export_tickers(self, symbol, start_ts, end_ts, path, concurrency=4):
+        """ 按天导出ticker行情数据为 .npz 文件 {path}/{platform}/{symbol}/ticker_{YYYYMMDD}.npz，需要安装numpy
+        @param symbol 交易对
+        @param start_ts 开始时间戳(秒)
+        @param end_ts 结束时间戳(秒)
+        @param path 导出根目录
+        @param concurrency 同时导出的天数
+        @return filenames 导出的文件列表
+        """
+        cursor = self._get_ticker_cursor_by_symbol(symbol)
+        path = os.path.join(path, self._platform, symbol.replace('/', '_'))
+        filenames = await self.export_npz(path, 'ticker', ['t', 'a', 'A', 'b', 'B'], start_ts, end_ts,
+                                          concurrency=concurrency, cursor=cursor)
+        return filenames
+
+    async def import_tickers(self, symbol, filenames):
+        """ 导入 export_tickers 导出的 .npz 文件
+        @param symbol 交易对
+        @param filenames 文件列表
+        @return count 导入的数据条数
+        """
+        cursor = self._get_ticker_cursor_by_symbol(symbol)
+        count = 0
+        for filename in filenames:
+            count += await self.import_npz(filename, cursor=cursor)
+        return count
+
     def _get_ticker_cursor_by_symbol(self, symbol):
         """ collection对应的交易对
         @param symbol 交易对
@@ -89,18 +132,42 @@ class KLineData(MongoDBBase):
             "b": bid, # 买一实时价
             "t": timestamp # 时间戳
         }
+
+    读缓存: K线数据按照交易对和时间段(bucket_secs)缓存，已经结束的时间段的K线数据不会再改变，从数据库读取一次之后缓存在内存里，
+    超出最大容量时淘汰最久没有使用的时间段；未结束的时间段每次都从数据库读取；缓存的K线数据不包含 create_time 和 update_time
+    字段，每次查询返回缓存数据的拷贝，可以修改；通过本对象写入已经结束的时间段的K线(延迟写入、修正数据)、导入K线之后，
+    对应时间段的缓存失效；其它进程写入已经结束的时间段的K线需要调用 invalidate_kline_cache 删除缓存；
     """
 
-    def __init__(self, platform):
+    INDEXES = [
+        [("t", 1)],
+        [("create_time", -1)]
+    ]
+
+    def __init__(self, platform, cache_size=64 * 1024 * 1024, bucket_secs=86400, settle_secs=60):
         """ 初始化
         @param platform 交易平台
+        @param cache_size 读缓存最大占用的内存(字节)，0为不使用缓存
+        @param bucket_secs 缓存时间段的长度(秒)
+        @param settle_secs 时间段结束之后，等待settle_secs秒再缓存，避免缓存写入延迟的K线之前的数据
         """
         self._db = platform  # 将交易平台名称作为数据库名称
         self._collection = 'kline'  # 表名
         self._platform = platform
         self._k_to_c = {}   # K线 交易对对应的数据库cursor {"BTC/USD": "kline_btc_usd"}
+        self._cache = LRUCache(cache_size) if cache_size else None  # 读缓存 {(symbol, bucket_start): (ts_list, datas)}
+        self._bucket_secs = bucket_secs
+        self._settle_secs = settle_secs
+        self._loading = {}  # 正在从数据库读取的时间段 {(symbol, bucket_start): future}
+        self._stale = set()  # 读取期间缓存已经失效的时间段，读取结果不缓存 {(symbol, bucket_start), ...}
         super(KLineData, self).__init__(self._db, self._collection)
 
+    @property
+    def cache_stats(self):
+        """ 读缓存统计数据 hits/misses/evictions 等
+        """
+        return self._cache.stats if self._cache is not None else None
+
     async def create_new_kline(self, symbol, open, high, low, close, ask, bid, timestamp):
         """ 创建新K线数据
         @param symbol 交易对
@@ -122,7 +189,12 @@ class KLineData(MongoDBBase):
             'b': bid,
             't': timestamp
         }
-        kline_id = await self.insert(data, cursor=cursor)
+        # 已经结束的时间段的K线直接写入数据库，写入之后删除缓存，避免再次缓存写缓冲里还没有写入的数据
+        bucket_start = timestamp - timestamp % self._bucket_secs
+        closed = self._cache is not None and self._is_bucket_closed(bucket_start)
+        kline_id = await self.insert(data, cursor=cursor, buffered=not closed)
+        if closed:
+            self.invalidate_kline_cache(symbol, timestamp, timestamp)
         return kline_id
 
     async def get_kline_at_ts(self, symbol, ts=None):
@@ -130,6 +202,13 @@ class KLineData(MongoDBBase):
         @param symbol 交易对
         @param ts 时间戳(秒) 如果为空，那么就是当前时间戳
         """
+        if ts and self._cache is not None:
+            bucket_start = ts - ts % self._bucket_secs
+            if self._is_bucket_closed(bucket_start):
+                ts_list, datas = await self._get_kline_bucket(symbol, bucket_start)
+                index = bisect.bisect_right(ts_list, ts)
+                if index > 0:
+                    return dict(datas[index - 1])
         cursor = self._get_kline_cursor_by_symbol(symbol)
         if ts:
             spec = {'t': {'$lte': ts}}
@@ -149,7 +228,26 @@ class KLineData(MongoDBBase):
         return result
 
     async def get_kline_between_ts(self, symbol, start_ts, end_ts):
-        """ 获取一段时间范围内的K线数据
+        """ 获取一段时间范围内的K线数据，已经结束的时间段从读缓存获取
+        @param symbol 交易对
+        @param start_ts 开始时间戳(秒)
+        @param end_ts 结束时间戳(秒)
+        """
+        if self._cache is None:
+            return await self._query_kline_between_ts(symbol, start_ts, end_ts)
+        datas = []
+        bucket_start = start_ts - start_ts % self._bucket_secs
+        while bucket_start <= end_ts and self._is_bucket_closed(bucket_start):
+            ts_list, klines = await self._get_kline_bucket(symbol, bucket_start)
+            for kline in klines[bisect.bisect_left(ts_list, start_ts):bisect.bisect_right(ts_list, end_ts)]:
+                datas.append(dict(kline))  # K线数据只有一层字段，浅拷贝即可
+            bucket_start += self._bucket_secs
+        if bucket_start <= end_ts:
+            datas.extend(await self._query_kline_between_ts(symbol, max(start_ts, bucket_start), end_ts))
+        return datas
+
+    async def _query_kline_between_ts(self, symbol, start_ts, end_ts):
+        """ 从数据库获取一段时间范围内的K线数据
         @param symbol 交易对
         @param start_ts 开始时间戳(秒)
         @param end_ts 结束时间戳(秒)
@@ -169,6 +267,149 @@ class KLineData(MongoDBBase):
         datas = await self.get_list(spec, fields=fields, sort=_sort, cursor=cursor)
         return datas
 
+    def iter_kline_between_ts(self, symbol, start_ts, end_ts, batch_size=1000):
+        """ 流式获取一段时间范围内的K线数据，按照批次从数据库读取，适合读取较长时间的K线历史
+        @param symbol 交易对
+        @param start_ts 开始时间戳(秒)
+        @param end_ts 结束时间戳(秒)
+        @param batch_size 每批从数据库读取的数据条数
+        @return 异步迭代器 async for kline in self.iter_kline_between_ts(symbol, start_ts, end_ts): ...
+        """
+        cursor = self._get_kline_cursor_by_symbol(symbol)
+        spec = {
+            't': {
+                '$gte': start_ts,
+                '$lte': end_ts
+            }
+        }
+        fields = {
+            'create_time': 0,
+            'update_time': 0
+        }
+        _sort = [('t', 1)]
+        return self.iter_list(spec, fields=fields, sort=_sort, batch_size=batch_size, cursor=cursor)
+
+    def iter_kline_arrays_between_ts(self, symbol, start_ts, end_ts, fields=('t', 'o', 'h', 'l', 'c'),
+                                     batch_size=10000):
+        """ 流式获取一段时间范围内的K线数据的numpy数组，需要安装numpy
+        @param symbol 交易对
+        @param start_ts 开始时间戳(秒)
+        @param end_ts 结束时间戳(秒)
+        @param fields 字段列表
+        @param batch_size 每批数据条数
+        @return 异步迭代器 async for arrays in self.iter_kline_arrays_between_ts(...): arrays['c'] ...
+        """
+        cursor = self._get_kline_cursor_by_symbol(symbol)
+        spec = {
+            't': {
+                '$gte': start_ts,
+                '$lte': end_ts
+            }
+        }
+        _sort = [('t', 1)]
+        return self.iter_arrays(spec, fields, sort=_sort, batch_size=batch_size, cursor=cursor)
+
+    async def export_klines(self, symbol, start_ts, end_ts, path, concurrency=4):
+        """ 按天导出K线数据为 .npz 文件 {path}/{platform}/{symbol}/kline_{YYYYMMDD}.npz，需要安装numpy
+        @param symbol 交易对
+        @param start_ts 开始时间戳(秒)
+        @param end_ts 结束时间戳(秒)
+        @param path 导出根目录
+        @param concurrency 同时导出的天数
+        @return filenames 导出的文件列表
+        """
+        cursor = self._get_kline_cursor_by_symbol(symbol)
+        path = os.path.join(path, self._platform, symbol.replace('/', '_'))
+        filenames = await self.export_npz(path, 'kline', ['t', 'o', 'h', 'l', 'c', 'a', 'b'], start_ts, end_ts,
+                                          concurrency=concurrency, cursor=cursor)
+        return filenames
+
+    async def import_klines(self, symbol, filenames):
+        """ 导入 export_klines 导出的 .npz 文件
+        @param symbol 交易对
+        @param filenames 文件列表
+        @return count 导入的数据条数
+        """
+        cursor = self._get_kline_cursor_by_symbol(symbol)
+        count = 0
+        try:
+            for filename in filenames:
+                count += await self.import_npz(filename, cursor=cursor)
+        finally:
+            self.invalidate_kline_cache(symbol)
+        return count
+
+    def invalidate_kline_cache(self, symbol, start_ts=None, end_ts=None):
+        """ 删除K线读缓存
+        @param symbol 交易对
+        @param start_ts 开始时间戳(秒)，为None时删除交易对所有时间段的缓存
+        @param end_ts 结束时间戳(秒)，为None时和start_ts相同
+        """
+        if self._cache is None:
+            return
+        if start_ts is None:
+            keys = [key for key in self._cache.keys() + list(self._loading) if key[0] == symbol]
+        else:
+            end_ts = start_ts if end_ts is None else end_ts
+            bucket_start = start_ts - start_ts % self._bucket_secs
+            keys = []
+            while bucket_start <= end_ts:
+                keys.append((symbol, bucket_start))
+                bucket_start += self._bucket_secs
+        for key in keys:
+            self._cache.delete(key)
+            if key in self._loading:
+                self._stale.add(key)
+
+    def _is_bucket_closed(self, bucket_start):
+        """ 时间段是否已经结束，结束的时间段不会再有新的K线数据
+        """
+        return bucket_start + self._bucket_secs + self._settle_secs <= tools.get_cur_timestamp()
+
+    async def _get_kline_bucket(self, symbol, bucket_start):
+        """ 获取一个已经结束的时间段的所有K线数据，优先从读缓存获取
+        @param symbol 交易对
+        @param bucket_start 时间段开始时间戳(秒)
+        @return (ts_list, datas) 时间戳列表和K线数据列表，按照时间戳升序
+        """
+        key = (symbol, bucket_start)
+        bucket = self._cache.get(key)
+        if bucket is not None:
+            return bucket
+        if key in self._loading:  # 同一个时间段正在从数据库读取，等待读取完成
+            return await self._loading[key]
+        future = self._loading[key] = asyncio.get_event_loop().create_future()
+        try:
+            cursor = self._get_kline_cursor_by_symbol(symbol)
+            spec = {
+                't': {
+                    '$gte': bucket_start,
+                    '$lt': bucket_start + self._bucket_secs
+                }
+            }
+            fields = {
+                'create_time': 0,
+                'update_time': 0
+            }
+            _sort = [('t', 1)]
+            datas = []
+            async for items in self.iter_batches(spec, fields=fields, sort=_sort, cursor=cursor):
+                datas.extend(items)
+            bucket = ([data['t'] for data in datas], datas)
+            if key in self._stale:  # 读取期间有新写入的数据，不缓存
+                self._stale.discard(key)
+            else:
+                self._cache.set(key, bucket)
+            future.set_result(bucket)
+            return bucket
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有其它协程等待时，不打印异常未获取的日志
+            raise
+        finally:
+            del self._loading[key]
+            self._stale.discard(key)
+
     def _get_kline_cursor_by_symbol(self, symbol):
         """ collection对应的交易对
         @param symbol 交易对
@@ -187,15 +428,32 @@ class AssetData(MongoDBBase):
     """ 资产数据存储
     资产数据结构:
         {}
+
+    读缓存: 指定cache_ttl之后，最新的资产信息按照 交易平台、账户、时间段(cache_ttl秒) 缓存，同一时间段内重复查询直接返回缓存，
+    本进程更新资产之后缓存失效；其它进程更新的资产最多延迟cache_ttl秒查询到；
     """
 
-    def __init__(self):
+    INDEXES = [
+        [("platform", 1), ("account", 1), ("update_time", -1)]
+    ]
+
+    def __init__(self, cache_ttl=0, cache_size=16 * 1024 * 1024):
         """ 初始化
+        @param cache_ttl 最新资产信息的缓存时间(秒)，0为不使用缓存
+        @param cache_size 读缓存最大占用的内存(字节)
         """
         self._db = 'strategy'  # 数据库名
         self._collection = 'asset'  # 表名
+        self._cache_ttl = cache_ttl
+        self._cache = LRUCache(cache_size) if cache_ttl else None  # 读缓存 {(platform, account, bucket): asset}
         super(AssetData, self).__init__(self._db, self._collection)
 
+    @property
+    def cache_stats(self):
+        """ 读缓存统计数据 hits/misses/evictions 等
+        """
+        return self._cache.stats if self._cache is not None else None
+
     async def create_new_asset(self, platform, account, asset):
         """ 创建新的资产信息
         @param platform 交易平台
@@ -209,6 +467,7 @@ class AssetData(MongoDBBase):
         for key, value in asset.items():
             d[key] = value
         asset_id = await self.insert(d)
+        self._delete_cache(platform, account)
         return asset_id
 
     async def update_asset(self, platform, account, asset, delete=None):
@@ -229,6 +488,7 @@ class AssetData(MongoDBBase):
                 d[key] = 1
             update_fields['$unset'] = d
         await self.update(spec, update_fields=update_fields, upsert=True)
+        self._delete_cache(platform, account)
 
     async def get_latest_asset(self, platform, account):
         """ 查询最新的资产信息
@@ -239,6 +499,11 @@ class AssetData(MongoDBBase):
             'platform': platform,
             'account': account
         }
+        if self._cache is not None:
+            key = self._get_cache_key(platform, account)
+            asset = self._cache.get(key)
+            if asset is not None:
+                return copy.deepcopy(asset)
         _sort = [('update_time', -1)]
         fields = {
             'platform': 0,
@@ -250,8 +515,21 @@ class AssetData(MongoDBBase):
         asset = await self.find_one(spec, sort=_sort, fields=fields)
         if asset:
             del asset['_id']
+            if self._cache is not None:
+                self._cache.set(key, copy.deepcopy(asset))
         return asset
 
+    def _get_cache_key(self, platform, account):
+        """ 读缓存的key，按照cache_ttl划分时间段，进入下一个时间段之后缓存自动失效
+        """
+        return platform, account, tools.get_cur_timestamp() // self._cache_ttl
+
+    def _delete_cache(self, platform, account):
+        """ 资产更新之后，删除读缓存
+        """
+        if self._cache is not None:
+            self._cache.delete(self._get_cache_key(platform, account))
+
 
 class AssetSnapshotData(MongoDBBase):
     """ 资产数据快照存储 每隔一个小时，从 strategy.asset 表中，创建一次快照数据
@@ -259,6 +537,11 @@ class AssetSnapshotData(MongoDBBase):
         {}
     """
 
+    INDEXES = [
+        [("platform", 1), ("account", 1), ("create_time", 1)],
+        [("platform", 1), ("account", 1), ("update_time", -1)]
+    ]
+
     def __init__(self):
         """ 初始化
         """
@@ -328,6 +611,11 @@ class OrderData(MongoDBBase):
     """ 订单数据存储
     """
 
+    INDEXES = [
+        [("platform", 1), ("order_no", 1)],
+        [("platform", 1), ("symbol", 1), ("update_time", -1)]
+    ]
+
     def __init__(self):
         """ 初始化
         @param db 数据库
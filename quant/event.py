@@ -8,23 +8,39 @@ Date:   2018/05/04
 Update: 2018/09/26  1. 优化回调函数由exchange和routing_key确定；
         2018/11/23  1. 事件增加批量订阅消息类型；
         2018/11/28  1. 增加断线重连机制；
+        2019/06/03  1. 增加事件数据编解码层，支持Json和MessagePack，通过消息属性content_type协商；
+        2019/06/04  1. 增加事件发布缓冲队列，批量发布事件，队列满时按策略丢弃或等待；
+        2019/06/05  1. 订阅事件增加合并推送模式，回调函数处理不过来时只推送最新的事件；
+        2019/06/06  1. 增加进程内事件分发，同一进程内的订阅者直接收到发布者的事件对象，无需经过RabbitMQ；
+        2019/06/07  1. 事件回调函数使用topic前缀树索引，批量订阅消息也推送解析好的事件对象；
+                    2. 同一个交换机的订阅共享一个消息队列；
+        2019/06/10  1. 每个交换机（或者配置的分片）使用独立的消费通道，并设置独立的消息窗口大小；
+        2019/06/11  1. 增加批量确认消息模式，每N条消息或者每T秒批量确认一次；
+        2019/06/17  1. 订单薄事件可以解析成数组订单薄ArrayOrderbook；
+        2019/06/19  1. 修复5分钟、15分钟K线事件，增加1小时K线事件；
+        2019/06/29  1. 断线期间发布的事件放入发布缓冲队列，重新连接之后继续发布；
+                    2. 同步发布事件时队列已满不再创建等待协程，直接丢弃事件；批量发布失败的事件放回队列头部，重新连接之后继续发布；
 """
 
 import json
+import copy
 import asyncio
+import collections
 
 import aioamqp
 
 from quant.utils import tools
 from quant.utils import logger
+from quant.utils import codec
+from quant.utils.topic import TopicTrie
 from quant.config import config
 from quant.tasks import LoopRunTask, SingleTask
 from quant.utils.decorator import async_method_locker
-from quant.market import Orderbook, Trade, Kline
+from quant.market import Orderbook, ArrayOrderbook, Trade, Kline
 
 
 __all__ = ("EventCenter", "EventConfig", "EventHeartbeat", "EventAsset", "EventOrder", "EventKline", "EventKline5Min",
-           "EventKline15Min", "EventOrderbook", "EventTrade")
+           "EventKline15Min", "EventKline1Hour", "EventOrderbook", "EventTrade")
 
 
 class Event:
@@ -47,6 +63,10 @@ class Event:
         self._pre_fetch_count = pre_fetch_count
         self._data = data
         self._callback = None  # 事件回调函数
+        self._conflate = False  # 是否合并推送
+        self._conflate_pending = {}  # 等待推送的最新消息 {(exchange, routing_key): (body, content_type, obj)}
+        self._conflate_running = set()  # 正在执行回调的 {(exchange, routing_key), ...}
+        self._conflated_count = 0  # 被合并（跳过）的消息数量
 
     @property
     def name(self):
@@ -72,20 +92,31 @@ class Event:
     def data(self):
         return self._data
 
-    def dumps(self):
-        """ 导出Json格式的数据
+    @property
+    def conflated_count(self):
+        return self._conflated_count
+
+    def dumps(self, codec=None):
+        """ 导出数据
+        @param codec 编解码器，如果为None，那么导出Json格式的字符串
         """
         d = {
             "n": self.name,
             "d": self.data
         }
-        return json.dumps(d)
+        if not codec:
+            return json.dumps(d)
+        return codec.encode(d)
 
-    def loads(self, b):
-        """ 加载Json格式的bytes数据
+    def loads(self, b, codec=None):
+        """ 加载bytes数据
         @param b bytes类型的数据
+        @param codec 编解码器，如果为None，那么按照Json格式解码
         """
-        d = json.loads(b)
+        if not codec:
+            d = json.loads(b)
+        else:
+            d = codec.decode(b)
         self._name = d.get("n")
         self._data = d.get("d")
         return d
@@ -95,31 +126,78 @@ class Event:
         """
         raise NotImplemented
 
-    def subscribe(self, callback, multi=False):
+    def subscribe(self, callback, multi=False, conflate=False):
         """ 订阅此事件
         @param callback 回调函数
         @param multi 是否批量订阅消息，即routing_key为批量匹配
+        @param conflate 是否合并推送，如果为True，那么每个exchange:routing_key只保留最新的一条消息，上一次回调执行完成之后，
+            立即使用最新的消息执行回调，中间被跳过的消息数量可以通过 conflated_count 获取
         """
         from quant.quant import quant
         self._callback = callback
+        self._conflate = conflate
         SingleTask.run(quant.event_center.subscribe, self, self.callback, multi)
 
     def publish(self):
         """ 发布此事件
         """
         from quant.quant import quant
-        SingleTask.run(quant.event_center.publish, self)
+        quant.event_center.publish_nowait(self)
 
-    async def callback(self, exchange, routing_key, body):
+    async def callback(self, exchange, routing_key, body, content_type=None):
         """ 事件回调
         @param exchange 事件被投放的RabbitMQ交换机
         @param routing_key 路由规则
         @param body 从RabbitMQ接收到的bytes类型数据
+        @param content_type 消息的编码类型，为空时按照Json格式解码
+        """
+        await self._on_message(exchange, routing_key, (body, content_type, None))
+
+    async def local_callback(self, exchange, routing_key, obj):
+        """ 进程内事件回调，直接使用发布者解析好的对象，无需经过RabbitMQ和编解码
+        @param exchange 事件被投放的RabbitMQ交换机
+        @param routing_key 路由规则
+        @param obj 发布者解析好的对象
+        """
+        await self._on_message(exchange, routing_key, (None, None, obj))
+
+    async def _on_message(self, exchange, routing_key, message):
+        """ 收到消息
+        @param exchange 事件被投放的RabbitMQ交换机
+        @param routing_key 路由规则
+        @param message 消息 (body, content_type, obj)，body为None时表示进程内事件，直接使用obj
+        """
+        if not self._conflate:
+            await self._do_callback(exchange, routing_key, message)
+            return
+
+        # 合并推送：只保留最新的消息，如果回调正在执行，那么等待回调执行完成之后再推送最新的消息
+        key = (exchange, routing_key)
+        if key in self._conflate_pending:
+            self._conflated_count += 1
+        self._conflate_pending[key] = message
+        if key in self._conflate_running:
+            return
+        self._conflate_running.add(key)
+        try:
+            while key in self._conflate_pending:
+                message = self._conflate_pending.pop(key)
+                try:
+                    await self._do_callback(exchange, routing_key, message)
+                except Exception as e:
+                    logger.error("event callback error:", e, caller=self)
+        finally:
+            self._conflate_running.discard(key)
+
+    async def _do_callback(self, exchange, routing_key, message):
+        """ 解析消息并执行回调函数
         """
+        body, content_type, o = message
         self._exchange = exchange
         self._routing_key = routing_key
-        self.loads(body)
-        o = self.parse()
+        if body is not None:
+            self.loads(body, codec.get_codec_by_content_type(content_type))
+            o = self.parse()
         await self._callback(o)
 
     def __str__(self):
@@ -326,15 +404,11 @@ class EventKline(Event):
 class EventKline5Min(Event):
     """ K线更新事件 5分钟
     """
-    EXCHANGE = "kline.5min"
-    QUEUE = None
-    NAME = "EVENT_KLINE_5MIN"
-    PRE_FETCH_COUNT = 20
 
     def __init__(self, platform=None, symbol=None, open=None, high=None, low=None, close=None, volume=None,
                  timestamp=None):
         """ 初始化
-        @param platform 平台 比如: bitfinex
+        @param platform 平台
         @param symbol 交易对
         @param open 开盘价
         @param high 最高价
@@ -344,43 +418,34 @@ class EventKline5Min(Event):
         @param timestamp 时间戳
         """
         routing_key = "{platform}.{symbol}".format(platform=platform, symbol=symbol)
-        self.ROUTING_KEY = routing_key
-        self.platform = platform
-        self.symbol = symbol
-        self.open = open
-        self.high = high
-        self.low = low
-        self.close = close
-        self.volume = volume
-        self.timestamp = timestamp
-        data = [platform, symbol, open, high, low, close, volume, timestamp]
-        super(EventKline5Min, self).__init__(data)
+        data = {
+            "platform": platform,
+            "symbol": symbol,
+            "open": open,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume,
+            "timestamp": timestamp
+        }
+        super(EventKline5Min, self).__init__(name="EVENT_KLINE_5MIN", exchange="Kline.5min", routing_key=routing_key,
+                                             data=data)
 
     def parse(self):
         """ 解析self._data数据
         """
-        self.platform = self._data[0]
-        self.symbol = self._data[1]
-        self.open = self._data[2]
-        self.high = self._data[3]
-        self.low = self._data[4]
-        self.close = self._data[5]
-        self.volume = self._data[6]
-        self.timestamp = self._data[7]
+        kline = Kline(**self.data)
+        return kline
 
 
 class EventKline15Min(Event):
-    """ K线更新事件 5分钟
+    """ K线更新事件 15分钟
     """
-    EXCHANGE = "kline.15min"
-    QUEUE = None
-    NAME = "EVENT_KLINE_15MIN"
-    PRE_FETCH_COUNT = 20
 
     def __init__(self, platform=None, symbol=None, open=None, high=None, low=None, close=None, volume=None,
                  timestamp=None):
         """ 初始化
-        @param platform 平台 比如: bitfinex
+        @param platform 平台
         @param symbol 交易对
         @param open 开盘价
         @param high 最高价
@@ -390,29 +455,61 @@ class EventKline15Min(Event):
         @param timestamp 时间戳
         """
         routing_key = "{platform}.{symbol}".format(platform=platform, symbol=symbol)
-        self.ROUTING_KEY = routing_key
-        self.platform = platform
-        self.symbol = symbol
-        self.open = open
-        self.high = high
-        self.low = low
-        self.close = close
-        self.volume = volume
-        self.timestamp = timestamp
-        data = [platform, symbol, open, high, low, close, volume, timestamp]
-        super(EventKline15Min, self).__init__(data)
+        data = {
+            "platform": platform,
+            "symbol": symbol,
+            "open": open,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume,
+            "timestamp": timestamp
+        }
+        super(EventKline15Min, self).__init__(name="EVENT_KLINE_15MIN", exchange="Kline.15min", routing_key=routing_key,
+                                              data=data)
 
     def parse(self):
         """ 解析self._data数据
         """
-        self.platform = self._data[0]
-        self.symbol = self._data[1]
-        self.open = self._data[2]
-        self.high = self._data[3]
-        self.low = self._data[4]
-        self.close = self._data[5]
-        self.volume = self._data[6]
-        self.timestamp = self._data[7]
+        kline = Kline(**self.data)
+        return kline
+
+
+class EventKline1Hour(Event):
+    """ K线更新事件 1小时
+    """
+
+    def __init__(self, platform=None, symbol=None, open=None, high=None, low=None, close=None, volume=None,
+                 timestamp=None):
+        """ 初始化
+        @param platform 平台
+        @param symbol 交易对
+        @param open 开盘价
+        @param high 最高价
+        @param low 最低价
+        @param close 收盘价
+        @param volume 成交量
+        @param timestamp 时间戳
+        """
+        routing_key = "{platform}.{symbol}".format(platform=platform, symbol=symbol)
+        data = {
+            "platform": platform,
+            "symbol": symbol,
+            "open": open,
+            "high": high,
+            "low": low,
+            "close": close,
+            "volume": volume,
+            "timestamp": timestamp
+        }
+        super(EventKline1Hour, self).__init__(name="EVENT_KLINE_1HOUR", exchange="Kline.1hour", routing_key=routing_key,
+                                              data=data)
+
+    def parse(self):
+        """ 解析self._data数据
+        """
+        kline = Kline(**self.data)
+        return kline
 
 
 class EventOrderbook(Event):
@@ -422,8 +519,9 @@ class EventOrderbook(Event):
         发布：行情服务
     """
 
-    def __init__(self, platform=None, symbol=None, asks=None, bids=None, timestamp=None):
+    def __init__(self, platform=None, symbol=None, asks=None, bids=None, timestamp=None, array=False):
         """ 初始化
+        @param array 是否解析成数组订单薄ArrayOrderbook，订阅者的数组订单薄对象被复用，每次收到事件时原地更新
         """
         routing_key = "{platform}.{symbol}".format(platform=platform, symbol=symbol)
         data = {
@@ -435,12 +533,34 @@ class EventOrderbook(Event):
         }
         super(EventOrderbook, self).__init__(name="EVENT_ORDERBOOK", exchange="Orderbook", routing_key=routing_key,
                                              data=data)
+        self._array = array
+        self._orderbook = None  # 复用的数组订单薄
 
     def parse(self):
         """ 解析self._data数据
         """
-        orderbook = Orderbook(**self.data)
-        return orderbook
+        if not self._array:
+            orderbook = Orderbook(**self.data)
+            return orderbook
+        return self._load_array_orderbook(self.data)
+
+    async def local_callback(self, exchange, routing_key, obj):
+        """ 进程内事件回调，如果订阅的是数组订单薄，那么将发布者的订单薄加载到复用的数组订单薄
+        """
+        if self._array and obj is not self._orderbook:
+            obj = self._load_array_orderbook(obj.data)
+        await super(EventOrderbook, self).local_callback(exchange, routing_key, obj)
+
+    def _load_array_orderbook(self, data):
+        """ 加载数据到复用的数组订单薄
+        @param data 订单薄数据
+        """
+        if not self._orderbook:
+            self._orderbook = ArrayOrderbook(data["platform"], data["symbol"])
+        self._orderbook.platform = data["platform"]
+        self._orderbook.symbol = data["symbol"]
+        self._orderbook.load(data["asks"] or [], data["bids"] or [], data["timestamp"])
+        return self._orderbook
 
 
 class EventTrade(Event):
@@ -481,10 +601,49 @@ class EventCenter:
         self._username = config.rabbitmq.get("username", "guest")
         self._password = config.rabbitmq.get("password", "guest")
         self._protocol = None
-        self._channel = None  # 连接通道
+        self._channel = None  # 连接通道，用于创建交换机和发布事件
+        self._consume_channels = {}  # 消费通道 {"shard": channel}
+        self._channel_shards = config.rabbitmq.get("channel_shards", {})  # 交换机对应的消费通道分片 {"exchange": "shard"}
+        self._prefetch = config.rabbitmq.get("prefetch", {})  # 消费通道的消息窗口大小 {"shard": prefetch_count}
+
+        # 批量确认消息
+        self._ack_batch_size = config.rabbitmq.get("ack_batch_size", 1)  # 每收到N条消息批量确认一次，1为每条消息都确认
+        self._ack_batch_interval = config.rabbitmq.get("ack_batch_interval", 0.1)  # 未确认消息最长等待时间(秒)
+        self._ack_states = {}  # 消费通道的确认状态 {channel: {"delivery_tag": 0, "pending": 0, "since": 0, "handle": None}}
+        self._ack_stats = {
+            "acked": 0,  # 已确认消息数量
+            "ack_frames": 0,  # 发送确认的次数
+            "last_ack_lag": 0,  # 最近一次确认时，最早的未确认消息等待时长(秒)
+            "max_ack_lag": 0  # 未确认消息最大等待时长(秒)
+        }
         self._connected = False  # 是否连接成功
         self._subscribers = []  # 订阅者 [(event, callback, multi), ...]
-        self._event_handler = {}  # 事件对应的处理函数 {"exchange:routing_key": [callback_function, ...]}
+        self._consumers = {}  # 消息队列消费者 {"exchange:queue": {"queue": queue_name, "channel": channel, ...}}
+        self._codec = codec.get_codec(config.rabbitmq.get("codec", "json"))  # 发布事件使用的编解码器
+        self._app_id = tools.get_uuid1()  # 当前进程事件中心的唯一id，发布事件的时候写入消息属性app_id
+
+        # 进程内事件分发，同一进程内的订阅者直接收到事件对象，RabbitMQ转发回来的本进程发布的事件将被忽略
+        self._local_dispatch = config.rabbitmq.get("local_dispatch", True)
+        self._local_index = {}  # 进程内事件处理函数索引 {"exchange": TopicTrie}
+
+        # 事件发布缓冲队列
+        self._publish_batch_size = config.rabbitmq.get("publish_batch_size", 100)  # 单次批量发布的最大事件数量
+        self._publish_batch_interval = config.rabbitmq.get("publish_batch_interval", 0.01)  # 批量发布时间窗口(秒)
+        self._publish_queue_size = config.rabbitmq.get("publish_queue_size", 10000)  # 缓冲队列最大长度
+        self._publish_policy = config.rabbitmq.get("publish_policy", "await")  # 队列已满时的策略 await / drop_oldest
+        self._publish_queue = collections.deque()  # 待发布的事件
+        self._publish_not_full = asyncio.Event()  # 缓冲队列未满
+        self._publish_flush_handle = None  # 批量发布的定时回调
+        self._publish_flushing = False  # 是否正在批量发布
+        self._publish_stats = {
+            "queue_depth": 0,  # 当前缓冲队列长度
+            "max_queue_depth": 0,  # 缓冲队列最大长度
+            "published": 0,  # 已发布事件数量
+            "dropped": 0,  # 已丢弃事件数量
+            "flush_count": 0,  # 批量发布次数
+            "last_flush_latency": 0,  # 最近一次批量发布耗时(秒)
+            "max_flush_latency": 0  # 批量发布最大耗时(秒)
+        }
 
         LoopRunTask.register(self._check_connection, 10)  # 检查连接是否正常
 
@@ -503,16 +662,144 @@ class EventCenter:
         logger.info("NAME:", event.name, "EXCHANGE:", event.exchange, "QUEUE:", event.queue, "ROUTING_KEY:",
                     event.routing_key, caller=self)
         self._subscribers.append((event, callback, multi))
+        if callback:
+            index = self._local_index.get(event.exchange)
+            if not index:
+                index = TopicTrie()
+                self._local_index[event.exchange] = index
+            index.add(event.routing_key, event.local_callback)
+
+    @property
+    def ack_stats(self):
+        """ 消息确认统计数据
+        """
+        stats = copy.copy(self._ack_stats)
+        stats["pending"] = sum([state["pending"] for state in self._ack_states.values()])  # 当前未确认消息数量
+        return stats
+
+    @property
+    def publish_stats(self):
+        """ 事件发布统计数据
+        """
+        stats = copy.copy(self._publish_stats)
+        stats["queue_depth"] = len(self._publish_queue)
+        return stats
 
     async def publish(self, event):
-        """ 发布消息
+        """ 发布消息，事件放入发布缓冲队列之后返回，如果队列已满且策略为await，那么等待队列可用
+        @param event 发布的事件对象
+        """
+        if self._local_dispatch:
+            self._dispatch_local(event)
+        if not self._connected:  # 断线期间事件缓存在发布缓冲队列里，重新连接之后继续发布
+            logger.warn("RabbitMQ not ready right now, event buffered!", caller=self)
+        await self._wait_and_put_publish_queue(event)
+
+    def publish_nowait(self, event):
+        """ 发布消息，不等待；如果队列已满且策略为await，那么丢弃此事件(需要等待队列可用请使用 await publish)
         @param event 发布的事件对象
         """
-        if not self._connected:
-            logger.warn("RabbitMQ not ready right now!", caller=self)
+        if self._local_dispatch:
+            self._dispatch_local(event)
+        if not self._connected:  # 断线期间事件缓存在发布缓冲队列里，重新连接之后继续发布
+            logger.warn("RabbitMQ not ready right now, event buffered!", caller=self)
+        if not self._put_publish_queue(event):
+            self._publish_stats["dropped"] += 1
+            logger.warn("publish queue is full, event dropped! exchange:", event.exchange, "routing_key:",
+                        event.routing_key, caller=self)
+
+    def _dispatch_local(self, event):
+        """ 将事件直接分发给进程内的订阅者
+        @param event 发布的事件对象
+        * NOTE: 事件只解析一次，所有进程内的订阅者共享解析好的对象
+        """
+        index = self._local_index.get(event.exchange)
+        if not index:
+            return
+        funcs = index.match(event.routing_key)
+        if not funcs:
             return
-        data = event.dumps()
-        await self._channel.basic_publish(payload=data, exchange_name=event.exchange, routing_key=event.routing_key)
+        o = event.parse()
+        for func in funcs:
+            SingleTask.run(func, event.exchange, event.routing_key, o)
+
+    async def _wait_and_put_publish_queue(self, event):
+        """ 等待发布缓冲队列可用，并将事件放入队列
+        @param event 发布的事件对象
+        """
+        while not self._put_publish_queue(event):
+            self._publish_not_full.clear()
+            await self._publish_not_full.wait()
+
+    def _put_publish_queue(self, event):
+        """ 事件放入发布缓冲队列
+        @param event 发布的事件对象
+        @return True放入成功，False队列已满
+        * NOTE: 队列已满时，如果策略为drop_oldest，那么丢弃队列里相同exchange和routing_key最早的事件，如果没有相同的事件，
+                那么丢弃队列里最早的事件；如果策略为await，那么返回False
+        """
+        if len(self._publish_queue) >= self._publish_queue_size:
+            if self._publish_policy != "drop_oldest":
+                return False
+            for e in self._publish_queue:
+                if e.exchange == event.exchange and e.routing_key == event.routing_key:
+                    self._publish_queue.remove(e)
+                    break
+            else:
+                self._publish_queue.popleft()
+            self._publish_stats["dropped"] += 1
+        self._publish_queue.append(event)
+        depth = len(self._publish_queue)
+        if depth > self._publish_stats["max_queue_depth"]:
+            self._publish_stats["max_queue_depth"] = depth
+
+        # 达到批量大小立即发布，否则等待时间窗口结束再发布
+        if depth >= self._publish_batch_size:
+            self._start_flush()
+        elif not self._publish_flush_handle:
+            self._publish_flush_handle = asyncio.get_event_loop().call_later(self._publish_batch_interval,
+                                                                              self._start_flush)
+        return True
+
+    def _start_flush(self):
+        """ 启动批量发布
+        """
+        if self._publish_flush_handle:
+            self._publish_flush_handle.cancel()
+            self._publish_flush_handle = None
+        if self._publish_flushing:
+            return
+        self._publish_flushing = True
+        SingleTask.run(self._flush)
+
+    async def _flush(self):
+        """ 批量发布缓冲队列里的事件，直到缓冲队列为空或者连接断开
+        """
+        try:
+            while self._publish_queue and self._connected:
+                n = min(len(self._publish_queue), self._publish_batch_size)
+                batch = [self._publish_queue.popleft() for _ in range(n)]
+                self._publish_not_full.set()
+                start = asyncio.get_event_loop().time()
+                properties = {"content_type": self._codec.CONTENT_TYPE, "app_id": self._app_id}
+                for index, event in enumerate(batch):
+                    data = event.dumps(self._codec)
+                    try:
+                        await self._channel.basic_publish(payload=data, exchange_name=event.exchange,
+                                                          routing_key=event.routing_key, properties=properties)
+                    except Exception as e:
+                        # 没有发布成功的事件放回队列头部，重新连接之后继续发布
+                        logger.error("publish event error:", e, caller=self)
+                        self._publish_queue.extendleft(reversed(batch[index:]))
+                        return
+                    self._publish_stats["published"] += 1
+                latency = asyncio.get_event_loop().time() - start
+                self._publish_stats["flush_count"] += 1
+                self._publish_stats["last_flush_latency"] = latency
+                if latency > self._publish_stats["max_flush_latency"]:
+                    self._publish_stats["max_flush_latency"] = latency
+        finally:
+            self._publish_flushing = False
 
     async def connect(self, reconnect=False):
         """ 建立TCP连接
@@ -540,11 +827,15 @@ class EventCenter:
         logger.info("Rabbitmq initialize success!", caller=self)
 
         # 创建默认的交换机
-        exchanges = ["Orderbook", "Trade", "Kline", ]
+        exchanges = ["Orderbook", "Trade", "Kline", "Kline.5min", "Kline.15min", "Kline.1hour", ]
         for name in exchanges:
             await self._channel.exchange_declare(exchange_name=name, type_name="topic")
         logger.info("create default exchanges success!", caller=self)
 
+        # 断线期间缓冲的事件，重新连接之后继续发布
+        if self._publish_queue:
+            self._start_flush()
+
         # 如果是断线重连，那么直接绑定队列并开始消费数据，如果是首次连接，那么等待5秒再绑定消费（等待程序各个模块初始化完成）
         if reconnect:
             self._bind_and_consume()
@@ -555,6 +846,18 @@ class EventCenter:
         """ 绑定并开始消费事件消息
         """
         async def do_them():
+            # 每个分片创建一个消费通道，消息窗口大小优先使用配置，否则使用分片内所有订阅事件的最大值
+            prefetch = {}
+            for event, _, _ in self._subscribers:
+                shard = self._channel_shards.get(event.exchange, event.exchange)
+                prefetch[shard] = max(prefetch.get(shard, 0), event.prefetch_count)
+            for shard, prefetch_count in prefetch.items():
+                prefetch_count = self._prefetch.get(shard, prefetch_count)
+                channel = await self._protocol.channel()
+                await channel.basic_qos(prefetch_count=prefetch_count)  # 消息窗口大小，越大，消息推送越快，但也需要处理越快
+                self._consume_channels[shard] = channel
+                self._ack_states[channel] = {"delivery_tag": 0, "pending": 0, "since": 0, "handle": None}
+                logger.info("shard:", shard, "prefetch_count:", prefetch_count, caller=self)
             for event, callback, multi in self._subscribers:
                 await self._initialize(event, callback, multi)
         SingleTask.run(do_them)
@@ -564,29 +867,44 @@ class EventCenter:
         @param event 订阅的事件
         @param callback 回调函数
         @param multi 是否批量订阅消息，即routing_key为批量匹配
-        """
-        if event.queue:
-            await self._channel.queue_declare(queue_name=event.queue)
-            queue_name = event.queue
-        else:
-            result = await self._channel.queue_declare(exclusive=True)
-            queue_name = result["queue"]
-        await self._channel.queue_bind(queue_name=queue_name, exchange_name=event.exchange,
-                                       routing_key=event.routing_key)
-        await self._channel.basic_qos(prefetch_count=event.prefetch_count)  # 消息窗口大小，越大，消息推送越快，但也需要处理越快
-        if callback:
-            if multi:
-                # 消费队列，routing_key为批量匹配，无需ack
-                await self._channel.basic_consume(callback=callback, queue_name=queue_name, no_ack=True)
-                logger.info("multi message queue:", queue_name, "callback:", callback, caller=self)
+        * NOTE: 同一个交换机（且没有指定队列名）的所有订阅共享一个消息队列，每个routing_key绑定一次，收到消息之后通过
+                topic前缀树找到所有匹配的回调函数
+        """
+        key = "{exchange}:{queue}".format(exchange=event.exchange, queue=event.queue or "")
+        consumer = self._consumers.get(key)
+        if not consumer:
+            channel = self._consume_channels[self._channel_shards.get(event.exchange, event.exchange)]
+            if event.queue:
+                await channel.queue_declare(queue_name=event.queue)
+                queue_name = event.queue
             else:
-                # 消费队列，routing_key唯一确定，需要ack确定
-                await self._channel.basic_consume(self._on_consume_event_msg, queue_name=queue_name)
-                logger.info("queue:", queue_name, caller=self)
-                self._add_event_handler(event, callback)
-
-    async def _on_consume_event_msg(self, channel, body, envelope, properties):
+                result = await channel.queue_declare(exclusive=True)
+                queue_name = result["queue"]
+            consumer = {
+                "queue": queue_name,
+                "channel": channel,
+                "bindings": set(),
+                "index": TopicTrie()
+            }
+            self._consumers[key] = consumer
+
+            async def on_consume(channel, body, envelope, properties):
+                await self._on_consume_event_msg(consumer, channel, body, envelope, properties)
+            await channel.basic_consume(on_consume, queue_name=queue_name)
+            logger.info("queue:", queue_name, caller=self)
+
+        # 先注册回调函数再绑定，避免绑定之后收到的消息找不到回调函数
+        if callback:
+            consumer["index"].add(event.routing_key, callback)
+        if event.routing_key not in consumer["bindings"]:
+            consumer["bindings"].add(event.routing_key)
+            await consumer["channel"].queue_bind(queue_name=consumer["queue"], exchange_name=event.exchange,
+                                                 routing_key=event.routing_key)
+        logger.info("queue:", consumer["queue"], "bindings:", consumer["bindings"], "multi:", multi, caller=self)
+
+    async def _on_consume_event_msg(self, consumer, channel, body, envelope, properties):
         """ 收到订阅的事件消息
+        @param consumer 消息队列消费者
         @param channel 消息队列通道
         @param body 接收到的消息
         @param envelope 路由规则
@@ -595,37 +913,96 @@ class EventCenter:
         # logger.debug("exchange:", envelope.exchange_name, "routing_key:", envelope.routing_key,
         #              "body:", body, caller=self)
         try:
-            key = "{exchange}:{routing_key}".format(exchange=envelope.exchange_name, routing_key=envelope.routing_key)
+            # 本进程发布的事件已经在进程内分发，忽略
+            if self._local_dispatch and properties.app_id == self._app_id:
+                return
             # 执行事件回调函数
-            funcs = self._event_handler[key]
+            funcs = consumer["index"].match(envelope.routing_key)
             for func in funcs:
-                SingleTask.run(func, envelope.exchange_name, envelope.routing_key, body)
+                SingleTask.run(func, envelope.exchange_name, envelope.routing_key, body, properties.content_type)
         except:
             logger.error("event handle error! body:", body, caller=self)
             return
         finally:
-            await self._channel.basic_client_ack(delivery_tag=envelope.delivery_tag)  # response ack
+            await self._ack(channel, envelope.delivery_tag)  # response ack
 
-    def _add_event_handler(self, event: Event, callback):
-        """ 增加事件处理回调函数
-        * NOTE: {"exchange:routing_key": [callback_function, ...]}
+    async def _ack(self, channel, delivery_tag):
+        """ 确认消息，达到批量大小立即确认，否则等待时间窗口结束再确认
+        @param channel 消息队列通道
+        @param delivery_tag 消息序号
+        * NOTE: 只有当前连接的消费通道才有确认状态，断线重连之后旧通道上的消息不会被确认（RabbitMQ将重新投递）
         """
-        key = "{exchange}:{routing_key}".format(exchange=event.exchange, routing_key=event.routing_key)
-        if key in self._event_handler:
-            self._event_handler[key].append(callback)
-        else:
-            self._event_handler[key] = [callback]
-        logger.info("event handlers:", self._event_handler.keys(), caller=self)
+        state = self._ack_states.get(channel)
+        if not state:
+            return
+        if not state["pending"]:
+            state["since"] = asyncio.get_event_loop().time()
+        state["pending"] += 1
+        state["delivery_tag"] = delivery_tag
+        if state["pending"] >= self._ack_batch_size:
+            await self._flush_ack(channel, state)
+        elif not state["handle"]:
+            state["handle"] = asyncio.get_event_loop().call_later(self._ack_batch_interval, self._on_ack_timer,
+                                                                  channel, state)
+
+    def _on_ack_timer(self, channel, state):
+        """ 确认消息时间窗口结束
+        """
+        state["handle"] = None
+        if state["pending"]:
+            SingleTask.run(self._flush_ack, channel, state)
+
+    async def _flush_ack(self, channel, state):
+        """ 批量确认通道上所有未确认的消息
+        @param channel 消息队列通道
+        @param state 通道的确认状态
+        """
+        if state["handle"]:
+            state["handle"].cancel()
+            state["handle"] = None
+        if not state["pending"]:
+            return
+        if self._ack_states.get(channel) is not state or not channel.is_open:
+            return
+        delivery_tag = state["delivery_tag"]
+        pending = state["pending"]
+        lag = asyncio.get_event_loop().time() - state["since"]
+        state["pending"] = 0
+        try:
+            await channel.basic_client_ack(delivery_tag=delivery_tag, multiple=pending > 1)
+        except Exception as e:
+            logger.error("ack error:", e, caller=self)
+            return
+        self._ack_stats["acked"] += pending
+        self._ack_stats["ack_frames"] += 1
+        self._ack_stats["last_ack_lag"] = lag
+        if lag > self._ack_stats["max_ack_lag"]:
+            self._ack_stats["max_ack_lag"] = lag
 
     async def _check_connection(self, *args, **kwargs):
         """ 检查连接是否正常，如果连接已经断开，那么立即发起连接
         """
         if self._connected and self._channel and self._channel.is_open:
-            logger.debug("RabbitMQ connection ok.", caller=self)
-            return
+            for channel in self._consume_channels.values():
+                if not channel.is_open:
+                    break
+            else:
+                logger.debug("RabbitMQ connection ok.", caller=self)
+                return
         logger.error("CONNECTION LOSE! START RECONNECT RIGHT NOW!", caller=self)
+        if self._protocol:
+            # 消费通道异常关闭时连接可能仍然存在，关闭旧连接之后重新建立连接
+            try:
+                await self._protocol.close()
+            except:
+                pass
         self._connected = False
         self._protocol = None
         self._channel = None
-        self._event_handler = {}
+        self._consume_channels = {}
+        self._consumers = {}
+        for state in self._ack_states.values():
+            if state["handle"]:
+                state["handle"].cancel()
+        self._ack_states = {}
         SingleTask.run(self.connect, reconnect=True)
@@ -5,17 +5,24 @@
 
 Author: HuangTao
 Date:   2019/02/16
+Update: 2019/06/17  1. 增加数组订单薄ArrayOrderbook，使用预分配的float64数组存储档位，支持增量更新；
+        2019/06/19  1. 增加5分钟、15分钟、1小时K线行情订阅；
+        2019/06/21  1. Orderbook、Trade、Kline使用__slots__，支持按照字典的方式读取属性；
 """
 
 import json
+from array import array
 
 from quant import const
+from quant.utils.slots import SlotsData
 
 
-class Orderbook:
+class Orderbook(SlotsData):
     """ 订单薄
     """
 
+    __slots__ = ("platform", "symbol", "asks", "bids", "timestamp")
+
     def __init__(self, platform=None, symbol=None, asks=None, bids=None, timestamp=None):
         """ 初始化
         @param platform 交易平台
@@ -49,10 +56,280 @@ class Orderbook:
         return str(self)
 
 
-class Trade:
+class _BookSide:
+    """ 订单薄单边档位，价格和数量分别存储在预分配的float64数组里，按照价格优先排序
+    """
+
+    __slots__ = ("prices", "quantities", "count", "capacity", "descending", "_cumulative", "_dirty")
+
+    def __init__(self, capacity, descending):
+        """ 初始化
+        @param capacity 最大档位数量
+        @param descending 价格是否降序排列，买盘为True，卖盘为False
+        """
+        self.prices = array("d", [0.0]) * capacity
+        self.quantities = array("d", [0.0]) * capacity
+        self.count = 0
+        self.capacity = capacity
+        self.descending = descending
+        self._cumulative = array("d", [0.0]) * capacity  # 累计数量缓存
+        self._dirty = True
+
+    def load(self, levels):
+        """ 加载全量档位
+        @param levels 档位列表 [[price, quantity], ...]，已经按照价格优先排序
+        """
+        n = min(len(levels), self.capacity)
+        prices, quantities = self.prices, self.quantities
+        for i in range(n):
+            prices[i] = float(levels[i][0])
+            quantities[i] = float(levels[i][1])
+        self.count = n
+        self._dirty = True
+
+    def search(self, price):
+        """ 二分查找价格所在的位置
+        @param price 价格
+        @return (index, found) found为True时index为价格所在的档位，否则为价格应该插入的位置
+        """
+        prices, lo, hi = self.prices, 0, self.count
+        if self.descending:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if prices[mid] > price:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        else:
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if prices[mid] < price:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return lo, lo < self.count and prices[lo] == price
+
+    def set(self, price, quantity):
+        """ 更新一个档位，数量为0时删除档位，超出最大档位数量的档位将被丢弃
+        @param price 价格
+        @param quantity 数量
+        """
+        prices, quantities, n = self.prices, self.quantities, self.count
+        i, found = self.search(price)
+        if found:
+            if quantity > 0:
+                quantities[i] = quantity
+            else:
+                prices[i:n - 1] = prices[i + 1:n]
+                quantities[i:n - 1] = quantities[i + 1:n]
+                self.count = n - 1
+        elif quantity > 0:
+            if i >= self.capacity:
+                return
+            if n == self.capacity:
+                n -= 1
+            prices[i + 1:n + 1] = prices[i:n]
+            quantities[i + 1:n + 1] = quantities[i:n]
+            prices[i] = price
+            quantities[i] = quantity
+            self.count = n + 1
+        self._dirty = True
+
+    def cumulative(self, levels):
+        """ 前N档的累计数量
+        @param levels 档位数量
+        """
+        levels = min(levels, self.count)
+        if levels <= 0:
+            return 0.0
+        if self._dirty:
+            total = 0.0
+            quantities, cumulative = self.quantities, self._cumulative
+            for i in range(self.count):
+                total += quantities[i]
+                cumulative[i] = total
+            self._dirty = False
+        return self._cumulative[levels - 1]
+
+    def within(self, price):
+        """ 价格优于或等于price的档位累计数量
+        @param price 价格
+        """
+        i, found = self.search(price)
+        return self.cumulative(i + 1 if found else i)
+
+    def levels(self):
+        """ 档位列表 [[price, quantity], ...]
+        """
+        return [[self.prices[i], self.quantities[i]] for i in range(self.count)]
+
+    def dump(self, target, depth):
+        """ 前depth档的价格和数量追加写入float64数组，不足的档位价格为NaN，数量为0
+        @param target array("d") 数组
+        @param depth 档位数量
+        """
+        n = min(self.count, depth)
+        target.extend(self.prices[:n])
+        target.extend(array("d", [float("nan")]) * (depth - n))
+        target.extend(self.quantities[:n])
+        target.extend(array("d", [0.0]) * (depth - n))
+
+
+class ArrayOrderbook:
+    """ 数组订单薄，档位价格和数量存储在预分配的float64数组里，支持增量更新档位
+    * NOTE: 最优价格、中间价、价差为O(1)，按照价格查找档位和累计数量为O(log n)；ask_prices 等属性返回数组的memoryview，
+            没有数据拷贝，回调函数只能读取，不能修改；与Orderbook兼容，asks/bids 属性返回 [[price, quantity], ...] 列表
+    """
+
+    def __init__(self, platform=None, symbol=None, asks=None, bids=None, timestamp=None, capacity=100):
+        """ 初始化
+        @param platform 交易平台
+        @param symbol 交易对
+        @param asks 卖盘数据 [[price, quantity], [...], ...]
+        @param bids 买盘数据 [[price, quantity], [...], ...]
+        @param timestamp 时间戳(毫秒)
+        @param capacity 单边最大档位数量，超出的档位将被丢弃
+        """
+        self.platform = platform
+        self.symbol = symbol
+        self.timestamp = timestamp
+        self._asks = _BookSide(capacity, False)
+        self._bids = _BookSide(capacity, True)
+        self.load(asks or [], bids or [], timestamp)
+
+    def load(self, asks, bids, timestamp=None):
+        """ 加载全量订单薄
+        @param asks 卖盘数据 [[price, quantity], [...], ...]，价格升序
+        @param bids 买盘数据 [[price, quantity], [...], ...]，价格降序
+        @param timestamp 时间戳(毫秒)
+        """
+        self._asks.load(asks)
+        self._bids.load(bids)
+        self.timestamp = timestamp
+
+    def update(self, asks=None, bids=None, timestamp=None):
+        """ 增量更新订单薄
+        @param asks 卖盘变化的档位 [[price, quantity], [...], ...]，数量为0表示删除档位
+        @param bids 买盘变化的档位 [[price, quantity], [...], ...]，数量为0表示删除档位
+        @param timestamp 时间戳(毫秒)
+        """
+        for price, quantity in asks or []:
+            self._asks.set(float(price), float(quantity))
+        for price, quantity in bids or []:
+            self._bids.set(float(price), float(quantity))
+        if timestamp:
+            self.timestamp = timestamp
+
+    def dump(self, target, depth):
+        """ 前depth档追加写入float64数组，顺序为 卖盘价格、卖盘数量、买盘价格、买盘数量，每项depth个，
+            不足的档位价格为NaN，数量为0
+        @param target array("d") 数组
+        @param depth 档位数量
+        """
+        self._asks.dump(target, depth)
+        self._bids.dump(target, depth)
+
+    @property
+    def asks(self):
+        return self._asks.levels()
+
+    @property
+    def bids(self):
+        return self._bids.levels()
+
+    @property
+    def ask_prices(self):
+        return memoryview(self._asks.prices)[:self._asks.count]
+
+    @property
+    def ask_quantities(self):
+        return memoryview(self._asks.quantities)[:self._asks.count]
+
+    @property
+    def bid_prices(self):
+        return memoryview(self._bids.prices)[:self._bids.count]
+
+    @property
+    def bid_quantities(self):
+        return memoryview(self._bids.quantities)[:self._bids.count]
+
+    @property
+    def best_ask_price(self):
+        return self._asks.prices[0] if self._asks.count else None
+
+    @property
+    def best_ask_quantity(self):
+        return self._asks.quantities[0] if self._asks.count else None
+
+    @property
+    def best_bid_price(self):
+        return self._bids.prices[0] if self._bids.count else None
+
+    @property
+    def best_bid_quantity(self):
+        return self._bids.quantities[0] if self._bids.count else None
+
+    @property
+    def mid_price(self):
+        if not self._asks.count or not self._bids.count:
+            return None
+        return (self._asks.prices[0] + self._bids.prices[0]) / 2
+
+    @property
+    def spread(self):
+        if not self._asks.count or not self._bids.count:
+            return None
+        return self._asks.prices[0] - self._bids.prices[0]
+
+    def cumulative_ask_quantity(self, levels):
+        """ 卖盘前N档累计数量
+        @param levels 档位数量
+        """
+        return self._asks.cumulative(levels)
+
+    def cumulative_bid_quantity(self, levels):
+        """ 买盘前N档累计数量
+        @param levels 档位数量
+        """
+        return self._bids.cumulative(levels)
+
+    def ask_quantity_within(self, price):
+        """ 卖盘价格小于或等于price的累计数量
+        @param price 价格
+        """
+        return self._asks.within(float(price))
+
+    def bid_quantity_within(self, price):
+        """ 买盘价格大于或等于price的累计数量
+        @param price 价格
+        """
+        return self._bids.within(float(price))
+
+    @property
+    def data(self):
+        d = {
+            "platform": self.platform,
+            "symbol": self.symbol,
+            "asks": self.asks,
+            "bids": self.bids,
+            "timestamp": self.timestamp
+        }
+        return d
+
+    def __str__(self):
+        info = json.dumps(self.data)
+        return info
+
+    def __repr__(self):
+        return str(self)
+
+
+class Trade(SlotsData):
     """ 交易数据
     """
 
+    __slots__ = ("platform", "symbol", "action", "price", "quantity", "timestamp")
+
     def __init__(self, platform=None, symbol=None, action=None, price=None, quantity=None, timestamp=None):
         """ 初始化
         @param platform 交易平台
@@ -89,10 +366,12 @@ class Trade:
         return str(self)
 
 
-class Kline:
+class Kline(SlotsData):
     """ K线 1分钟
     """
 
+    __slots__ = ("platform", "symbol", "open", "high", "low", "close", "volume", "timestamp")
+
     def __init__(self, platform=None, symbol=None, open=None, high=None, low=None, close=None, volume=None,
                  timestamp=None):
         """ 初始化
@@ -140,19 +419,39 @@ class Market:
     """ 行情订阅模块
     """
 
-    def __init__(self, market_type, platform, symbol, callback):
+    def __init__(self, market_type, platform, symbol, callback, conflate=False, array=False):
         """ 初始化
         @param market_type 行情类型
         @param platform 交易平台
         @param symbol 交易对
         @param callback 更新回调函数
+        @param conflate 是否合并推送，如果为True，那么回调函数处理不过来时，只推送最新的行情，跳过中间的行情
+        @param array 订单薄是否使用数组订单薄ArrayOrderbook，数组订单薄对象被复用，每次更新时原地加载最新的数据
         """
+        self._event = None
         if market_type == const.MARKET_TYPE_ORDERBOOK:
             from quant.event import EventOrderbook
-            EventOrderbook(platform, symbol).subscribe(callback)
+            self._event = EventOrderbook(platform, symbol, array=array)
         elif market_type == const.MARKET_TYPE_TRADE:
             from quant.event import EventTrade
-            EventTrade(platform, symbol).subscribe(callback)
+            self._event = EventTrade(platform, symbol)
         elif market_type == const.MARKET_TYPE_KLINE:
             from quant.event import EventKline
-            EventKline(platform, symbol).subscribe(callback)
+            self._event = EventKline(platform, symbol)
+        elif market_type == const.MARKET_TYPE_KLINE_5M:
+            from quant.event import EventKline5Min
+            self._event = EventKline5Min(platform, symbol)
+        elif market_type == const.MARKET_TYPE_KLINE_15M:
+            from quant.event import EventKline15Min
+            self._event = EventKline15Min(platform, symbol)
+        elif market_type == const.MARKET_TYPE_KLINE_1H:
+            from quant.event import EventKline1Hour
+            self._event = EventKline1Hour(platform, symbol)
+        if self._event:
+            self._event.subscribe(callback, conflate=conflate)
+
+    @property
+    def conflated_count(self):
+        """ 合并推送模式下，被跳过的行情数量
+        """
+        return self._event.conflated_count if self._event else 0
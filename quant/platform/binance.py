@@ -6,6 +6,9 @@ https://github.com/binance-exchange/binance-official-api-docs/blob/master/rest-a
 
 Author: HuangTao
 Date:   2018/08/09
+Update: 2019/06/27  1. REST API请求增加限频，下单、撤单优先；
+        2019/06/28  1. 批量撤单、撤销全部订单改为并发撤单，撤销全部订单遇到失败不再中断；
+                    2. 按照 事件类型:交易对 划分消息通道并发处理，去掉全局的消息处理锁；
 """
 
 import json
@@ -21,7 +24,7 @@ from quant.order import Order
 from quant.utils.websocket import Websocket
 from quant.tasks import SingleTask, LoopRunTask
 from quant.utils.http_client import AsyncHttpRequests
-from quant.utils.decorator import async_method_locker
+from quant.utils.ratelimit import get_limiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from quant.order import ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET
 from quant.order import ORDER_STATUS_SUBMITTED, ORDER_STATUS_PARTIAL_FILLED, ORDER_STATUS_FILLED, \
     ORDER_STATUS_CANCELED, ORDER_STATUS_FAILED
@@ -51,7 +54,7 @@ class BinanceRestAPI:
         params = {
             "timestamp": str(ts)
         }
-        success, error = await self.request("GET", "/api/v3/account", params, auth=True)
+        success, error = await self.request("GET", "/api/v3/account", params, auth=True, priority=PRIORITY_LOW)
         return success, error
 
     async def get_server_time(self):
@@ -84,7 +87,8 @@ class BinanceRestAPI:
             "symbol": symbol,
             "limit": limit
         }
-        success, error = await self.request("GET", "/api/v1/depth", params=params)
+        weight = 1 if limit <= 100 else 5 if limit <= 500 else 10  # 接口权重与档位数有关
+        success, error = await self.request("GET", "/api/v1/depth", params=params, weight=weight)
         return success, error
 
     async def create_order(self, action, symbol, price, quantity):
@@ -106,7 +110,7 @@ class BinanceRestAPI:
             "newOrderRespType": "FULL",
             "timestamp": tools.get_cur_timestamp_ms()
         }
-        success, error = await self.request("POST", "/api/v3/order", body=info, auth=True)
+        success, error = await self.request("POST", "/api/v3/order", body=info, auth=True, priority=PRIORITY_HIGH)
         return success, error
 
     async def revoke_order(self, symbol, order_id, client_order_id):
@@ -121,7 +125,7 @@ class BinanceRestAPI:
             "origClientOrderId": client_order_id,
             "timestamp": tools.get_cur_timestamp_ms()
         }
-        success, error = await self.request("DELETE", "/api/v3/order", params=params, auth=True)
+        success, error = await self.request("DELETE", "/api/v3/order", params=params, auth=True, priority=PRIORITY_HIGH)
         return success, error
 
     async def get_order_status(self, symbol, order_id, client_order_id):
@@ -147,7 +151,7 @@ class BinanceRestAPI:
             "symbol": symbol,
             "timestamp": tools.get_cur_timestamp_ms()
         }
-        success, error = await self.request("GET", "/api/v3/allOrders", params=params, auth=True)
+        success, error = await self.request("GET", "/api/v3/allOrders", params=params, auth=True, priority=PRIORITY_LOW)
         return success, error
 
     async def get_open_orders(self, symbol):
@@ -188,7 +192,8 @@ class BinanceRestAPI:
         success, error = await self.request("DELETE", "/api/v1/userDataStream", params=params)
         return success, error
 
-    async def request(self, method, uri, params=None, body=None, headers=None, auth=False):
+    async def request(self, method, uri, params=None, body=None, headers=None, auth=False, priority=PRIORITY_NORMAL,
+                      weight=None):
         """ 发起请求
         @param method 请求方法 GET POST DELETE PUT
         @param uri 请求uri
@@ -196,13 +201,20 @@ class BinanceRestAPI:
         @param body dict 请求body数据
         @param headers 请求http头
         @param auth boolean 是否需要加入权限校验
+        @param priority 请求优先级 PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW，限频排队时优先级高的请求先发送
+        @param weight 请求权重，默认使用限频配置里uri对应的权重
         """
+        limiter = get_limiter(BINANCE)
+        if limiter:
+            await limiter.acquire(weight or limiter.get_weight(uri), priority)
         url = urljoin(self._host, uri)
         data = {}
         if params:
             data.update(params)
         if body:
             data.update(body)
+        if auth and "timestamp" in data:  # 限频排队之后更新时间戳，避免超出recvWindow
+            data["timestamp"] = tools.get_cur_timestamp_ms()
 
         if data:
             query = "&".join(["=".join([str(k), str(v)]) for k, v in data.items()])
@@ -217,7 +229,8 @@ class BinanceRestAPI:
         if not headers:
             headers = {}
         headers["X-MBX-APIKEY"] = self._access_key
-        _, success, error = await AsyncHttpRequests.fetch(method, url, headers=headers, timeout=10, verify_ssl=False)
+        _, success, error = await AsyncHttpRequests.fetch(method, url, headers=headers, timeout=10, limiter=limiter,
+                                                          verify_ssl=False)
         return success, error
 
 
@@ -349,17 +362,21 @@ class BinanceTrade(Websocket):
     async def revoke_order(self, *order_nos):
         """ 撤销订单
         @param order_nos 订单号列表，可传入任意多个，如果不传入，那么就撤销所有订单
+        @return 撤销全部订单：全部成功返回 (True, None)，否则返回 (False, error) error为失败列表 [(order_no, e), ...]
+                撤销一个订单：返回 (order_no, error)
+                撤销多个订单：返回 (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        * NOTE: 多个订单并发撤销，同时发出的撤单请求不超过10个
         """
         # 如果传入order_nos为空，即撤销全部委托单
         if len(order_nos) == 0:
             order_infos, error = await self._rest_api.get_open_orders(self._raw_symbol)
             if error:
                 return False, error
-            for order_info in order_infos:
-                _, error = await self._rest_api.revoke_order(self._raw_symbol, order_info["orderId"],
-                                                             order_info["clientOrderId"])
-                if error:
-                    return False, error
+            order_nos = ["{}_{}".format(order_info["orderId"], order_info["clientOrderId"])
+                         for order_info in order_infos]
+            _, error = await self._revoke_orders(order_nos)
+            if error:
+                return False, error
             return True, None
 
         # 如果传入order_nos为一个委托单号，那么只撤销一个委托单
@@ -373,16 +390,27 @@ class BinanceTrade(Websocket):
 
         # 如果传入order_nos数量大于1，那么就批量撤销传入的委托单
         if len(order_nos) > 1:
-            success, error = [], []
-            for order_no in order_nos:
-                order_id, client_order_id = order_no.split("_")
-                _, e = await self._rest_api.revoke_order(self._raw_symbol, order_id, client_order_id)
-                if e:
-                    error.append((order_no, e))
-                else:
-                    success.append(order_no)
+            success, error = await self._revoke_orders(order_nos)
             return success, error
 
+    async def _revoke_orders(self, order_nos):
+        """ 并发撤销多个订单
+        @param order_nos 订单号列表
+        @return (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        """
+        coros = []
+        for order_no in order_nos:
+            order_id, client_order_id = order_no.split("_")
+            coros.append(self._rest_api.revoke_order(self._raw_symbol, order_id, client_order_id))
+        results = await SingleTask.gather(coros)
+        success, error = [], []
+        for order_no, (_, e) in zip(order_nos, results):
+            if e:
+                error.append((order_no, e))
+            else:
+                success.append(order_no)
+        return success, error
+
     async def get_open_order_nos(self):
         """ 获取未完全成交订单号列表
         """
@@ -396,7 +424,13 @@ class BinanceTrade(Websocket):
                 order_nos.append(order_no)
             return order_nos, None
 
-    @async_method_locker("process.locker")
+    def get_channel(self, msg):
+        """ 消息通道，按照 事件类型:交易对 划分通道，同一交易对的订单更新顺序处理
+        """
+        if not isinstance(msg, dict):
+            return None
+        return "{}:{}".format(msg.get("e"), msg.get("s"))
+
     async def process(self, msg):
         """ 处理websocket上接收到的消息
         """
@@ -6,6 +6,9 @@ https://docs.deribit.com/v2/
 
 Author: HuangTao
 Date:   2019/04/20
+Update: 2019/06/28  1. 批量撤单改为通过websocket并发发送撤单请求；
+                    2. 增加批量下单 create_orders，通过websocket连续发送下单请求；
+                    3. 请求返回消息和订阅推送消息使用不同的消息通道处理，去掉全局的消息处理锁；
 """
 
 import json
@@ -166,7 +169,7 @@ class DeribitTrade(Websocket):
             method = "private/sell"
         else:
             logger.error("action error! action:", action, caller=self)
-            return None
+            return None, "action error"
         if order_type == ORDER_TYPE_LIMIT:
             type_ = "limit"
         else:
@@ -184,6 +187,18 @@ class DeribitTrade(Websocket):
         order_no = success["order"]["order_id"]
         return order_no, None
 
+    async def create_orders(self, orders):
+        """ 批量创建订单，所有下单请求通过websocket连续发送，不等待上一个请求返回
+        @param orders 订单列表 [(action, price, quantity, order_type), ...]
+        @return (order_nos, errors) 按照传入顺序返回，下单成功的订单 order_no 为订单号、error 为None，否则 order_no 为None
+        """
+        coros = [self.create_order(action, price, quantity, order_type)
+                 for action, price, quantity, order_type in orders]
+        results = await SingleTask.gather(coros, len(coros) or 1)
+        order_nos = [order_no for order_no, _ in results]
+        errors = [error for _, error in results]
+        return order_nos, errors
+
     async def revoke_order(self, *order_nos):
         """ 撤销订单
         @param order_nos 订单号，如果没有指定订单号，那么撤销所有订单
@@ -213,9 +228,9 @@ class DeribitTrade(Websocket):
         if len(order_nos) > 1:
             success, error = [], []
             method = "private/cancel"
-            for order_no in order_nos:
-                params = {"order_id": order_no}
-                r, e = await self._send_message(method, params)
+            coros = [self._send_message(method, {"order_id": order_no}) for order_no in order_nos]
+            results = await SingleTask.gather(coros)
+            for order_no, (r, e) in zip(order_nos, results):
                 if e:
                     error.append((order_no, e))
                 else:
@@ -279,7 +294,17 @@ class DeribitTrade(Websocket):
         self._query_id += 1
         return self._query_id
 
-    @async_method_locker("process.locker")
+    def get_channel(self, msg):
+        """ 消息通道，请求返回消息使用单独的通道，订阅推送消息按照订阅频道划分通道
+        """
+        if not isinstance(msg, dict):
+            return None
+        if msg.get("id"):
+            return "request"
+        if msg.get("method") == "subscription":
+            return msg["params"].get("channel")
+        return None
+
     async def process(self, msg):
         """ 处理websocket消息
         """
@@ -6,6 +6,10 @@ https://www.okex.com/docs/zh/
 
 Author: HuangTao
 Date:   2019/01/19
+Update: 2019/06/27  1. REST API请求增加限频，下单、撤单优先；
+        2019/06/28  1. 批量撤单、撤销全部订单改为使用批量撤单接口并发撤单，撤销全部订单遇到失败不再中断；
+                    2. 增加批量下单 create_orders，使用批量下单接口；
+                    3. 接收消息在 decode_binary 里解压缩，按照 频道:合约 划分消息通道并发处理，去掉全局的消息处理锁；
 """
 
 import time
@@ -22,8 +26,8 @@ from quant.const import OKEX
 from quant.order import Order
 from quant.tasks import SingleTask
 from quant.utils.websocket import Websocket
-from quant.utils.decorator import async_method_locker
 from quant.utils.http_client import AsyncHttpRequests
+from quant.utils.ratelimit import get_limiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from quant.order import ORDER_ACTION_BUY, ORDER_ACTION_SELL
 from quant.order import ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET
 from quant.order import ORDER_STATUS_SUBMITTED, ORDER_STATUS_PARTIAL_FILLED, ORDER_STATUS_FILLED, \
@@ -52,7 +56,7 @@ class OKExRestAPI:
     async def get_user_account(self):
         """ 获取账户信息
         """
-        result, error = await self.request("GET", "/api/spot/v3/accounts", auth=True)
+        result, error = await self.request("GET", "/api/spot/v3/accounts", auth=True, priority=PRIORITY_LOW)
         return result, error
 
     async def create_order(self, action, symbol, price, quantity, order_type=ORDER_TYPE_LIMIT):
@@ -63,6 +67,38 @@ class OKExRestAPI:
         @param price 交易价格
         @param order_type 订单类型 市价 / 限价
         """
+        info = self._make_order_info(action, symbol, price, quantity, order_type)
+        if not info:
+            return None, "order_type error"
+        result, error = await self.request("POST", "/api/spot/v3/orders", body=info, auth=True, priority=PRIORITY_HIGH)
+        return result, error
+
+    async def create_orders(self, symbol, orders):
+        """ 批量下单
+        @param symbol 交易对
+        @param orders 订单列表 [(action, price, quantity, order_type), ...]
+        * NOTE: 单次不超过10个订单
+        """
+        if len(orders) > 10:
+            logger.warn("only create 10 orders per request!", caller=self)
+        body = []
+        for action, price, quantity, order_type in orders[:10]:
+            info = self._make_order_info(action, symbol, price, quantity, order_type)
+            if not info:
+                return None, "order_type error"
+            body.append(info)
+        result, error = await self.request("POST", "/api/spot/v3/batch_orders", body=body, auth=True,
+                                           priority=PRIORITY_HIGH)
+        return result, error
+
+    def _make_order_info(self, action, symbol, price, quantity, order_type):
+        """ 生成下单参数
+        @param action 操作类型 BUY SELL
+        @param symbol 交易对
+        @param quantity 交易量
+        @param price 交易价格
+        @param order_type 订单类型 市价 / 限价
+        """
         info = {
             "side": "buy" if action == ORDER_ACTION_BUY else "sell",
             "instrument_id": symbol,
@@ -81,8 +117,7 @@ class OKExRestAPI:
         else:
             logger.error("order_type error! order_type:", order_type, caller=self)
             return None
-        result, error = await self.request("POST", "/api/spot/v3/orders", body=info, auth=True)
-        return result, error
+        return info
 
     async def revoke_order(self, symbol, order_no):
         """ 撤销委托单
@@ -93,7 +128,7 @@ class OKExRestAPI:
             "instrument_id": symbol
         }
         uri = "/api/spot/v3/cancel_orders/{order_no}".format(order_no=order_no)
-        result, error = await self.request("POST", uri, body=body, auth=True)
+        result, error = await self.request("POST", uri, body=body, auth=True, priority=PRIORITY_HIGH)
         if error:
             return order_no, error
         if result["result"]:
@@ -114,7 +149,8 @@ class OKExRestAPI:
                 "order_ids": order_nos[:4]
             }
         ]
-        result, error = await self.request("POST", "/api/spot/v3/cancel_batch_orders", body=body, auth=True)
+        result, error = await self.request("POST", "/api/spot/v3/cancel_batch_orders", body=body, auth=True,
+                                           priority=PRIORITY_HIGH)
         return result, error
 
     async def get_open_orders(self, symbol):
@@ -140,7 +176,8 @@ class OKExRestAPI:
         result, error = await self.request("GET", uri, params=params, auth=True)
         return result, error
 
-    async def request(self, method, uri, params=None, body=None, headers=None, auth=False):
+    async def request(self, method, uri, params=None, body=None, headers=None, auth=False, priority=PRIORITY_NORMAL,
+                      weight=None):
         """ 发起请求
         @param method 请求方法 GET / POST / DELETE / PUT
         @param uri 请求uri
@@ -148,7 +185,12 @@ class OKExRestAPI:
         @param body dict 请求body数据
         @param headers 请求http头
         @param auth boolean 是否需要加入权限校验
+        @param priority 请求优先级 PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW，限频排队时优先级高的请求先发送
+        @param weight 请求权重，默认使用限频配置里uri对应的权重
         """
+        limiter = get_limiter(OKEX)
+        if limiter:
+            await limiter.acquire(weight or limiter.get_weight(uri), priority)
         if params:
             query = "&".join(["{}={}".format(k, params[k]) for k in sorted(params.keys())])
             uri += "?" + query
@@ -174,7 +216,8 @@ class OKExRestAPI:
             headers["OK-ACCESS-SIGN"] = sign.decode()
             headers["OK-ACCESS-TIMESTAMP"] = str(timestamp)
             headers["OK-ACCESS-PASSPHRASE"] = self._passphrase
-        _, success, error = await AsyncHttpRequests.fetch(method, url, body=body, headers=headers, timeout=10)
+        _, success, error = await AsyncHttpRequests.fetch(method, url, body=body, headers=headers, timeout=10,
+                                                          limiter=limiter)
         return success, error
 
 
@@ -248,18 +291,29 @@ class OKExTrade(Websocket):
             if self._order_update_callback:
                 SingleTask.run(self._order_update_callback, order)
 
-    @async_method_locker("process_binary.locker")
-    async def process_binary(self, raw):
-        """ 处理websocket上接收到的消息
+    def decode_binary(self, raw):
+        """ 解压缩websocket上接收到的消息
         @param raw 原始的压缩数据
         """
         decompress = zlib.decompressobj(-zlib.MAX_WBITS)
         msg = decompress.decompress(raw)
         msg += decompress.flush()
-        msg = msg.decode()
+        return msg.decode()
+
+    def get_channel(self, msg):
+        """ 消息通道，推送消息按照 频道:合约 划分通道，登录等其它消息使用同一通道
+        """
+        if not isinstance(msg, dict) or not msg.get("table"):
+            return None
+        data = msg.get("data") or [{}]
+        return "{}:{}".format(msg["table"], data[0].get("instrument_id"))
+
+    async def process(self, msg):
+        """ 处理websocket上接收到的消息
+        @param msg 解压缩、解析之后的消息
+        """
         if msg == "pong":  # 心跳返回
             return
-        msg = json.loads(msg)
         logger.debug('msg:', msg, caller=self)
 
         # 登陆成功之后再订阅数据
@@ -307,21 +361,50 @@ class OKExTrade(Websocket):
             return None, result
         return result["order_id"], None
 
+    async def create_orders(self, orders):
+        """ 批量创建订单，使用批量下单接口，每10个订单一组，多组并发下单
+        @param orders 订单列表 [(action, price, quantity, order_type), ...]
+        @return (order_nos, errors) 按照传入顺序返回，下单成功的订单 order_no 为订单号、error 为None，否则 order_no 为None
+        """
+        orders = [(action, tools.float_to_str(price), tools.float_to_str(quantity), order_type)
+                  for action, price, quantity, order_type in orders]
+        chunks = [orders[i:i + 10] for i in range(0, len(orders), 10)]
+        results = await SingleTask.gather([self._rest_api.create_orders(self._raw_symbol, chunk) for chunk in chunks])
+        order_nos, errors = [], []
+        for chunk, (result, e) in zip(chunks, results):
+            if e:
+                order_nos.extend([None] * len(chunk))
+                errors.extend([e] * len(chunk))
+                continue
+            # 返回结果按照下单顺序 {"btc-usdt": [{"order_id": "xxx", "result": true, "error_code": "", ...}, ...]}
+            items = result.get(self._raw_symbol.lower(), [])
+            for i in range(len(chunk)):
+                item = items[i] if i < len(items) else None
+                if item and item.get("result"):
+                    order_nos.append(item["order_id"])
+                    errors.append(None)
+                else:
+                    order_nos.append(None)
+                    errors.append(item or result)
+        return order_nos, errors
+
     async def revoke_order(self, *order_nos):
         """ 撤销订单
         @param order_nos 订单号列表，可传入任意多个，如果不传入，那么就撤销所有订单
-        * NOTE: 单次调用最多只能撤销4个订单，如果订单超过4个，请多次调用
+        @return 撤销全部订单：全部成功返回 (True, None)，否则返回 (False, error) error为失败列表 [(order_no, e), ...]
+                撤销一个订单：返回 (order_no, error)
+                撤销多个订单：返回 (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        * NOTE: 多个订单使用批量撤单接口，每4个订单一组，多组并发撤销
         """
         # 如果传入order_nos为空，即撤销全部委托单
         if len(order_nos) == 0:
             order_infos, error = await self._rest_api.get_open_orders(self._raw_symbol)
             if error:
                 return False, error
-            for order_info in order_infos:
-                order_no = order_info["order_id"]
-                _, error = await self._rest_api.revoke_order(self._raw_symbol, order_no)
-                if error:
-                    return False, error
+            order_nos = [order_info["order_id"] for order_info in order_infos]
+            _, error = await self._revoke_orders(order_nos)
+            if error:
+                return False, error
             return True, None
 
         # 如果传入order_nos为一个委托单号，那么只撤销一个委托单
@@ -334,15 +417,33 @@ class OKExTrade(Websocket):
 
         # 如果传入order_nos数量大于1，那么就批量撤销传入的委托单
         if len(order_nos) > 1:
-            success, error = [], []
-            for order_no in order_nos:
-                _, e = await self._rest_api.revoke_order(self._raw_symbol, order_no)
-                if e:
-                    error.append((order_no, e))
-                else:
-                    success.append(order_no)
+            success, error = await self._revoke_orders(list(order_nos))
             return success, error
 
+    async def _revoke_orders(self, order_nos):
+        """ 使用批量撤单接口撤销多个订单，每4个订单一组，多组并发撤销
+        @param order_nos 订单号列表
+        @return (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        """
+        chunks = [order_nos[i:i + 4] for i in range(0, len(order_nos), 4)]
+        results = await SingleTask.gather([self._rest_api.revoke_orders(self._raw_symbol, chunk) for chunk in chunks])
+        success, error = [], []
+        for chunk, (result, e) in zip(chunks, results):
+            if e:
+                error.extend([(order_no, e) for order_no in chunk])
+                continue
+            # 返回结果 {"btc-usdt": [{"order_id": "xxx", "result": true, ...}, ...]}
+            items = {}
+            for item in result.get(self._raw_symbol.lower(), []):
+                items[str(item.get("order_id"))] = item
+            for order_no in chunk:
+                item = items.get(str(order_no))
+                if item and item.get("result"):
+                    success.append(order_no)
+                else:
+                    error.append((order_no, item or result))
+        return success, error
+
     async def get_open_order_nos(self):
         """ 获取未完全成交订单号列表
         """
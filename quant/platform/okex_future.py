@@ -6,6 +6,10 @@ https://www.okex.me/docs/zh/
 
 Author: HuangTao
 Date:   2019/01/19
+Update: 2019/06/27  1. REST API请求增加限频，下单、撤单优先；
+        2019/06/28  1. 批量撤单、撤销全部订单改为使用批量撤单接口并发撤单，撤销全部订单遇到失败不再中断；
+                    2. 增加批量下单 create_orders，使用批量下单接口；
+                    3. 接收消息在 decode_binary 里解压缩，按照 频道:合约 划分消息通道并发处理，去掉全局的消息处理锁；
 """
 
 import time
@@ -25,7 +29,7 @@ from quant.position import Position
 from quant.const import OKEX_FUTURE
 from quant.utils.websocket import Websocket
 from quant.utils.http_client import AsyncHttpRequests
-from quant.utils.decorator import async_method_locker
+from quant.utils.ratelimit import get_limiter, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
 from quant.order import ORDER_ACTION_BUY, ORDER_ACTION_SELL
 from quant.order import ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET
 from quant.order import ORDER_STATUS_SUBMITTED, ORDER_STATUS_PARTIAL_FILLED, ORDER_STATUS_FILLED, \
@@ -51,7 +55,7 @@ class OKExFutureRestAPI:
     async def get_user_account(self):
         """ 获取账户信息
         """
-        success, error = await self.request("GET", "/api/futures/v3/accounts", auth=True)
+        success, error = await self.request("GET", "/api/futures/v3/accounts", auth=True, priority=PRIORITY_LOW)
         return success, error
 
     async def get_position(self, instrument_id):
@@ -79,9 +83,33 @@ class OKExFutureRestAPI:
             "match_price": match_price,
             "leverage": leverage
         }
-        success, error = await self.request("POST", "/api/futures/v3/order", body=body, auth=True)
+        success, error = await self.request("POST", "/api/futures/v3/order", body=body, auth=True,
+                                            priority=PRIORITY_HIGH)
         return success, error
 
+    async def create_orders(self, instrument_id, orders_data, leverage=20):
+        """ 批量下单
+        @param instrument_id 合约ID，如BTC-USD-180213
+        @param orders_data 订单列表 [{"type": trade_type, "price": price, "size": size, "match_price": 0}, ...]
+        @param leverage 要设定的杠杆倍数，10或20
+        * NOTE: 单次不超过10个订单
+        """
+        assert isinstance(orders_data, list)
+        if len(orders_data) > 10:
+            logger.warn("only create 10 orders per request!", caller=self)
+        body = {
+            "instrument_id": instrument_id,
+            "orders_data": orders_data[:10],
+            "leverage": leverage
+        }
+        success, error = await self.request("POST", "/api/futures/v3/orders", body=body, auth=True,
+                                            priority=PRIORITY_HIGH)
+        if error:
+            return None, error
+        if not success["result"]:
+            return None, success
+        return success, None
+
     async def revoke_order(self, instrument_id, order_no):
         """ 撤单
         @param instrument_id 合约ID，如BTC-USD-180213
@@ -89,7 +117,7 @@ class OKExFutureRestAPI:
         """
         uri = "/api/futures/v3/cancel_order/{instrument_id}/{order_id}".format(
             instrument_id=instrument_id, order_id=order_no)
-        success, error = await self.request("POST", uri, auth=True)
+        success, error = await self.request("POST", uri, auth=True, priority=PRIORITY_HIGH)
         if error:
             return None, error
         if not success["result"]:
@@ -100,13 +128,14 @@ class OKExFutureRestAPI:
         """ 批量撤单
         @param instrument_id 合约ID，如BTC-USD-180213
         @param order_ids 订单id列表
+        * NOTE: 单次不超过10个订单id
         """
         assert isinstance(order_ids, list)
         uri = "/api/futures/v3/cancel_batch_orders/{instrument_id}".format(instrument_id=instrument_id)
         body = {
             "order_ids": order_ids
         }
-        success, error = await self.request("POST", uri, body=body, auth=True)
+        success, error = await self.request("POST", uri, body=body, auth=True, priority=PRIORITY_HIGH)
         if error:
             return None, error
         if not success["result"]:
@@ -138,10 +167,11 @@ class OKExFutureRestAPI:
             "to": to,
             "limit": limit
         }
-        success, error = await self.request("GET", uri, params=params, auth=True)
+        success, error = await self.request("GET", uri, params=params, auth=True, priority=PRIORITY_LOW)
         return success, error
 
-    async def request(self, method, uri, params=None, body=None, headers=None, auth=False):
+    async def request(self, method, uri, params=None, body=None, headers=None, auth=False, priority=PRIORITY_NORMAL,
+                      weight=None):
         """ 发起请求
         @param method 请求方法 GET / POST / DELETE / PUT
         @param uri 请求uri
@@ -149,7 +179,12 @@ class OKExFutureRestAPI:
         @param body dict 请求body数据
         @param headers 请求http头
         @param auth boolean 是否需要加入权限校验
+        @param priority 请求优先级 PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW，限频排队时优先级高的请求先发送
+        @param weight 请求权重，默认使用限频配置里uri对应的权重
         """
+        limiter = get_limiter(OKEX_FUTURE)
+        if limiter:
+            await limiter.acquire(weight or limiter.get_weight(uri), priority)
         if params:
             query = "&".join(["{}={}".format(k, params[k]) for k in sorted(params.keys())])
             uri += "?" + query
@@ -176,7 +211,8 @@ class OKExFutureRestAPI:
             headers["OK-ACCESS-TIMESTAMP"] = str(timestamp)
             headers["OK-ACCESS-PASSPHRASE"] = self._passphrase
 
-        _, success, error = await AsyncHttpRequests.fetch(method, url, body=body, headers=headers, timeout=10)
+        _, success, error = await AsyncHttpRequests.fetch(method, url, body=body, headers=headers, timeout=10,
+                                                          limiter=limiter)
         return success, error
 
 
@@ -263,18 +299,29 @@ class OKExFutureTrade(Websocket):
         if self._position_update_callback:
             SingleTask.run(self._position_update_callback, self.position)
 
-    @async_method_locker("process_binary.locker")
-    async def process_binary(self, raw):
-        """ 处理websocket上接收到的消息
+    def decode_binary(self, raw):
+        """ 解压缩websocket上接收到的消息
         @param raw 原始的压缩数据
         """
         decompress = zlib.decompressobj(-zlib.MAX_WBITS)
         msg = decompress.decompress(raw)
         msg += decompress.flush()
-        msg = msg.decode()
+        return msg.decode()
+
+    def get_channel(self, msg):
+        """ 消息通道，推送消息按照 频道:合约 划分通道，登录等其它消息使用同一通道
+        """
+        if not isinstance(msg, dict) or not msg.get("table"):
+            return None
+        data = msg.get("data") or [{}]
+        return "{}:{}".format(msg["table"], data[0].get("instrument_id"))
+
+    async def process(self, msg):
+        """ 处理websocket上接收到的消息
+        @param msg 解压缩、解析之后的消息
+        """
         if msg == "pong":  # 心跳返回
             return
-        msg = json.loads(msg)
         # logger.debug("msg:", msg, caller=self)
 
         # 登陆成功之后再订阅数据
@@ -318,6 +365,53 @@ class OKExFutureTrade(Websocket):
         @param quantity 委托数量(可以是正数，也可以是复数)
         @param order_type 委托类型 limit/market
         """
+        trade_type = self._get_trade_type(action, quantity)
+        quantity = abs(int(quantity))
+        result, error = await self._rest_api.create_order(self._symbol, trade_type, price, quantity)
+        if error:
+            return None, error
+        return result["order_id"], None
+
+    async def create_orders(self, orders):
+        """ 批量创建订单，使用批量下单接口，每10个订单一组，多组并发下单
+        @param orders 订单列表 [(action, price, quantity, order_type), ...]
+        @return (order_nos, errors) 按照传入顺序返回，下单成功的订单 order_no 为订单号、error 为None，否则 order_no 为None
+        """
+        orders_data = []
+        for action, price, quantity, order_type in orders:
+            data = {
+                "type": self._get_trade_type(action, quantity),
+                "price": price,
+                "size": abs(int(quantity)),
+                "match_price": 0
+            }
+            orders_data.append(data)
+        chunks = [orders_data[i:i + 10] for i in range(0, len(orders_data), 10)]
+        results = await SingleTask.gather([self._rest_api.create_orders(self._symbol, chunk) for chunk in chunks])
+        order_nos, errors = [], []
+        for chunk, (result, e) in zip(chunks, results):
+            if e:
+                order_nos.extend([None] * len(chunk))
+                errors.extend([e] * len(chunk))
+                continue
+            # 返回结果按照下单顺序 {"result": true, "order_info": [{"order_id": "xxx", "error_code": 0, ...}, ...]}
+            items = result.get("order_info", [])
+            for i in range(len(chunk)):
+                item = items[i] if i < len(items) else None
+                if item and str(item.get("error_code", 0)) in ("0", "") and str(item.get("order_id")) != "-1":
+                    order_nos.append(item["order_id"])
+                    errors.append(None)
+                else:
+                    order_nos.append(None)
+                    errors.append(item or result)
+        return order_nos, errors
+
+    def _get_trade_type(self, action, quantity):
+        """ 根据交易方向和委托数量获取交易类型
+        @param action 交易方向 BUY/SELL
+        @param quantity 委托数量(正数为多仓操作，负数为空仓操作)
+        @return trade_type 交易类型，1 开多 / 2 开空 / 3 平多 / 4 平空
+        """
         if int(quantity) > 0:
             if action == ORDER_ACTION_BUY:
                 trade_type = "1"
@@ -328,27 +422,25 @@ class OKExFutureTrade(Websocket):
                 trade_type = "4"
             else:
                 trade_type = "2"
-        quantity = abs(int(quantity))
-        result, error = await self._rest_api.create_order(self._symbol, trade_type, price, quantity)
-        if error:
-            return None, error
-        return result["order_id"], None
+        return trade_type
 
     async def revoke_order(self, *order_nos):
         """ 撤销订单
         @param order_nos 订单号，可传入任意多个，如果不传入，那么就撤销所有订单
-        * NOTE: 单次调用最多只能撤销100个订单，如果订单超过100个，请多次调用
+        @return 撤销全部订单：全部成功返回 (True, None)，否则返回 (False, error) error为失败列表 [(order_no, e), ...]
+                撤销一个订单：返回 (order_no, error)
+                撤销多个订单：返回 (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        * NOTE: 撤销全部订单时，单次调用最多只能撤销100个订单，如果订单超过100个，请多次调用
         """
         # 如果传入order_nos为空，即撤销全部委托单
         if len(order_nos) == 0:
             result, error = await self._rest_api.get_order_list(self._symbol, 6)
             if error:
                 return False, error
-            for order_info in result["order_info"]:
-                order_no = order_info["order_id"]
-                _, error = await self._rest_api.revoke_order(self._symbol, order_no)
-                if error:
-                    return False, error
+            order_nos = [order_info["order_id"] for order_info in result["order_info"]]
+            _, error = await self._revoke_orders(order_nos)
+            if error:
+                return False, error
             return True, None
 
         # 如果传入order_nos为一个委托单号，那么只撤销一个委托单
@@ -361,15 +453,24 @@ class OKExFutureTrade(Websocket):
 
         # 如果传入order_nos数量大于1，那么就批量撤销传入的委托单
         if len(order_nos) > 1:
-            success, error = [], []
-            for order_no in order_nos:
-                _, e = await self._rest_api.revoke_order(self._symbol, order_no)
-                if e:
-                    error.append((order_no, e))
-                else:
-                    success.append(order_no)
+            success, error = await self._revoke_orders(list(order_nos))
             return success, error
 
+    async def _revoke_orders(self, order_nos):
+        """ 使用批量撤单接口撤销多个订单，每10个订单一组，多组并发撤销
+        @param order_nos 订单号列表
+        @return (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        """
+        chunks = [order_nos[i:i + 10] for i in range(0, len(order_nos), 10)]
+        results = await SingleTask.gather([self._rest_api.revoke_orders(self._symbol, chunk) for chunk in chunks])
+        success, error = [], []
+        for chunk, (_, e) in zip(chunks, results):
+            if e:
+                error.extend([(order_no, e) for order_no in chunk])
+            else:
+                success.extend(chunk)
+        return success, error
+
     async def get_open_order_nos(self):
         """ 获取未完全成交订单号列表
         """
@@ -0,0 +1,332 @@
+# -*- coding:utf-8 -*-
+
+"""
+Simulated Trade 模拟交易模块
+订阅指定交易平台的订单薄(Orderbook)和成交(Trade)行情（实盘行情或者回放行情），在本地按照价格优先、时间优先撮合委托单，
+用于回测和模拟盘。
+
+撮合规则:
+1. 委托单经过 latency 秒之后到达撮合引擎，撤单同理；撤单的目标订单在发出撤单请求时确定，包括还在路上的委托单，
+   撤单请求之后创建的委托单不会被撤销；
+2. 委托单到达时，与订单薄对手盘可以成交的档位立即按照档位价格成交（吃单），剩余数量挂单；市价单剩余数量撤销；
+3. 挂单时，排在委托单前面的数量为订单薄同价位档位的数量；成交行情在同价位成交时，先消耗排在前面的数量，再成交委托单；
+   成交价格优于委托价格时，委托单全部成交；订单薄同价位数量减少时，排在前面的数量随之减少；
+4. 订单薄对手盘价格穿过委托价格时，委托单按照委托价格成交；
+
+Author: HuangTao
+Date:   2019/06/14
+Update: 2019/06/29  1. 撤单的目标订单在发出请求时确定，可以撤销还在路上的委托单，全部撤单不会撤销请求之后创建的委托单；
+"""
+
+import copy
+import asyncio
+
+from quant import const
+from quant.utils import tools
+from quant.utils import logger
+from quant.config import config
+from quant.const import SIMULATED
+from quant.market import Market
+from quant.position import Position
+from quant.tasks import SingleTask
+from quant.order import Order
+from quant.order import ORDER_ACTION_BUY, ORDER_ACTION_SELL
+from quant.order import ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET
+from quant.order import ORDER_STATUS_SUBMITTED, ORDER_STATUS_PARTIAL_FILLED, ORDER_STATUS_FILLED, \
+    ORDER_STATUS_CANCELED
+from quant.order import TRADE_TYPE_BUY_OPEN, TRADE_TYPE_SELL_OPEN, TRADE_TYPE_SELL_CLOSE, TRADE_TYPE_BUY_CLOSE
+
+
+__all__ = ("SimulatedTrade", )
+
+
+class SimulatedTrade:
+    """ Simulated Trade 模拟交易模块
+    """
+
+    def __init__(self, account, strategy, symbol, market_platform=None, latency=None, order_update_callback=None,
+                 position_update_callback=None):
+        """ 初始化
+        @param account 账户
+        @param strategy 策略名称
+        @param symbol 交易对（合约名称）
+        @param market_platform 撮合使用的行情交易平台，默认使用配置 PLATFORMS.simulated.platform
+        @param latency 委托单、撤单到达撮合引擎的延迟(秒)，默认使用配置 PLATFORMS.simulated.latency，或者0.05秒
+        @param order_update_callback 订单更新回调
+        @param position_update_callback 持仓更新回调
+        """
+        settings = config.platforms.get(SIMULATED, {})
+        self._account = account
+        self._strategy = strategy
+        self._platform = SIMULATED
+        self._symbol = symbol
+        self._market_platform = market_platform or settings.get("platform")
+        self._latency = latency if latency is not None else settings.get("latency", 0.05)
+
+        self._order_update_callback = order_update_callback
+        self._position_update_callback = position_update_callback
+
+        self._orders = {}  # 未完成的订单 {"order_no": order}
+        self._inflight = set()  # 已经发出、还没有到达撮合引擎的委托单 {"order_no", ...}
+        self._queue_ahead = {}  # 挂单排在委托单前面的数量 {"order_no": quantity}
+        self._position = Position(self._platform, self._account, strategy, symbol)  # 仓位
+        self._order_id = 0  # 订单序号
+        self._asks = []  # 最新的订单薄卖盘 [[price, quantity], ...]
+        self._bids = []  # 最新的订单薄买盘 [[price, quantity], ...]
+        self._timestamp = None  # 最新的行情时间戳(毫秒)
+
+        if not self._market_platform:
+            logger.error("simulated market platform not specified!", caller=self)
+            return
+        Market(const.MARKET_TYPE_ORDERBOOK, self._market_platform, symbol, self.on_event_orderbook_update)
+        Market(const.MARKET_TYPE_TRADE, self._market_platform, symbol, self.on_event_trade_update)
+
+    @property
+    def position(self):
+        return copy.copy(self._position)
+
+    @property
+    def orders(self):
+        return copy.copy(self._orders)
+
+    async def create_order(self, action, price, quantity, order_type=ORDER_TYPE_LIMIT):
+        """ 创建订单
+        @param action 交易方向 BUY/SELL
+        @param price 委托价格
+        @param quantity 委托数量(当为负数时，代表合约操作空单)
+        @param order_type 委托类型 LIMIT / MARKET
+        """
+        if action not in [ORDER_ACTION_BUY, ORDER_ACTION_SELL]:
+            return None, "action error"
+        if order_type not in [ORDER_TYPE_LIMIT, ORDER_TYPE_MARKET]:
+            return None, "order type error"
+        try:
+            float(price)
+            q = float(quantity)
+        except (TypeError, ValueError):
+            return None, "price or quantity error"
+        if q == 0:
+            return None, "quantity error"
+        if order_type == ORDER_TYPE_MARKET and not (self._asks if action == ORDER_ACTION_BUY else self._bids):
+            return None, "orderbook not ready"
+
+        if action == ORDER_ACTION_BUY:
+            trade_type = TRADE_TYPE_BUY_OPEN if q > 0 else TRADE_TYPE_BUY_CLOSE
+        else:
+            trade_type = TRADE_TYPE_SELL_CLOSE if q > 0 else TRADE_TYPE_SELL_OPEN
+
+        self._order_id += 1
+        order_no = str(self._order_id)
+        self._inflight.add(order_no)
+        await asyncio.sleep(self._latency)
+        self._inflight.discard(order_no)
+
+        ts = self._now()
+        order = Order(self._account, self._platform, self._strategy, order_no, self._symbol, action, price, quantity,
+                      abs(q), ORDER_STATUS_SUBMITTED, 0, order_type, trade_type, ts, ts)
+        self._orders[order_no] = order
+        if self._order_update_callback:
+            SingleTask.run(self._order_update_callback, copy.copy(order))
+
+        # 吃单
+        levels = self._asks if action == ORDER_ACTION_BUY else self._bids
+        for level in levels:
+            if order.remain <= 0:
+                break
+            if order_type == ORDER_TYPE_LIMIT and not self._cross(action, level[0], float(price)):
+                break
+            fill = min(order.remain, level[1])
+            if fill > 0:
+                level[1] -= fill
+                self._fill(order, fill, level[0])
+
+        if order.status in [ORDER_STATUS_SUBMITTED, ORDER_STATUS_PARTIAL_FILLED]:
+            if order_type == ORDER_TYPE_MARKET:
+                self._finish(order, ORDER_STATUS_CANCELED)
+            else:
+                self._queue_ahead[order_no] = self._level_quantity(action, float(price))
+        return order_no, None
+
+    async def revoke_order(self, *order_nos):
+        """ 撤销订单
+        @param order_nos 订单号列表，可传入任意多个，如果不传入，那么就撤销所有订单
+        * NOTE: 撤单的目标订单在发出请求时确定：还在路上的委托单与撤单请求的延迟相同、先于撤单到达，可以被撤销；
+                全部撤单只撤销发出请求时已经存在的订单
+        """
+        targets = set(self._orders) | self._inflight  # 发出撤单请求时的未完成订单
+        await asyncio.sleep(self._latency)
+
+        # 如果传入order_nos为空，即撤销全部委托单
+        if len(order_nos) == 0:
+            for order_no in sorted(targets, key=int):
+                order = self._orders.get(order_no)
+                if order:
+                    self._finish(order, ORDER_STATUS_CANCELED)
+            return True, None
+
+        # 如果传入order_nos为一个委托单号，那么只撤销一个委托单
+        if len(order_nos) == 1:
+            order = self._orders.get(order_nos[0]) if order_nos[0] in targets else None
+            if not order:
+                return order_nos[0], "order not found"
+            self._finish(order, ORDER_STATUS_CANCELED)
+            return order_nos[0], None
+
+        # 如果传入order_nos数量大于1，那么就批量撤销传入的委托单
+        success, error = [], []
+        for order_no in order_nos:
+            order = self._orders.get(order_no) if order_no in targets else None
+            if not order:
+                error.append((order_no, "order not found"))
+            else:
+                self._finish(order, ORDER_STATUS_CANCELED)
+                success.append(order_no)
+        return success, error
+
+    async def get_open_order_nos(self):
+        """ 获取未完全成交订单号列表
+        """
+        await asyncio.sleep(self._latency)
+        return list(self._orders.keys()), None
+
+    async def on_event_orderbook_update(self, orderbook):
+        """ 订单薄更新，对手盘价格穿过委托价格的挂单按照委托价格成交
+        """
+        self._asks = [[float(p), float(q)] for p, q in orderbook.asks]
+        self._bids = [[float(p), float(q)] for p, q in orderbook.bids]
+        self._timestamp = orderbook.timestamp
+        for order in self._resting_orders():
+            price = float(order.price)
+            levels = self._asks if order.action == ORDER_ACTION_BUY else self._bids
+            for level in levels:
+                if order.remain <= 0 or not self._cross(order.action, level[0], price):
+                    break
+                fill = min(order.remain, level[1])
+                if fill > 0:
+                    level[1] -= fill
+                    self._fill(order, fill, price)
+            if order.order_no in self._queue_ahead:
+                self._queue_ahead[order.order_no] = min(self._queue_ahead[order.order_no],
+                                                        self._level_quantity(order.action, price))
+
+    async def on_event_trade_update(self, trade):
+        """ 成交行情更新，主动卖出成交买单，主动买入成交卖单
+        """
+        self._timestamp = trade.timestamp
+        price = float(trade.price)
+        volume = float(trade.quantity)
+        side = ORDER_ACTION_BUY if trade.action == ORDER_ACTION_SELL else ORDER_ACTION_SELL
+        for order in self._resting_orders(side):
+            order_price = float(order.price)
+            if order_price != price and self._cross(trade.action, order_price, price):  # 成交价格优于委托价格
+                self._fill(order, order.remain, order_price)
+                continue
+            if order_price != price or volume <= 0:
+                break
+            ahead = self._queue_ahead.get(order.order_no, 0)
+            consumed = min(ahead, volume)
+            self._queue_ahead[order.order_no] = ahead - consumed
+            volume -= consumed
+            fill = min(order.remain, volume)
+            if fill > 0:
+                volume -= fill
+                self._fill(order, fill, order_price)
+
+    def _resting_orders(self, action=None):
+        """ 按照价格优先、时间优先排序的挂单
+        @param action 交易方向，为None时返回所有挂单
+        """
+        buys, sells = [], []
+        for order in self._orders.values():
+            if order.order_no not in self._queue_ahead:
+                continue
+            if order.action == ORDER_ACTION_BUY:
+                buys.append(order)
+            else:
+                sells.append(order)
+        buys.sort(key=lambda o: -float(o.price))
+        sells.sort(key=lambda o: float(o.price))
+        if action == ORDER_ACTION_BUY:
+            return buys
+        if action == ORDER_ACTION_SELL:
+            return sells
+        return buys + sells
+
+    def _cross(self, action, level_price, price):
+        """ 对手盘价格是否可以与委托价格成交
+        @param action 委托单交易方向
+        @param level_price 对手盘价格
+        @param price 委托价格
+        """
+        if action == ORDER_ACTION_BUY:
+            return level_price <= price
+        return level_price >= price
+
+    def _level_quantity(self, action, price):
+        """ 订单薄中与委托单同方向、同价位的挂单数量
+        """
+        levels = self._bids if action == ORDER_ACTION_BUY else self._asks
+        for p, q in levels:
+            if p == price:
+                return q
+        return 0
+
+    def _now(self):
+        """ 当前时间戳(毫秒)，优先使用行情时间，回放模式下与行情时间一致
+        """
+        return self._timestamp if self._timestamp else tools.get_cur_timestamp_ms()
+
+    def _fill(self, order, quantity, price):
+        """ 委托单成交
+        @param order 委托单
+        @param quantity 成交数量
+        @param price 成交价格
+        """
+        filled = abs(float(order.quantity)) - order.remain
+        order.avg_price = (order.avg_price * filled + price * quantity) / (filled + quantity)
+        order.remain -= quantity
+        self._update_position(order.trade_type, quantity, price)
+        if order.remain <= 0:
+            order.remain = 0
+            self._finish(order, ORDER_STATUS_FILLED)
+        else:
+            order.status = ORDER_STATUS_PARTIAL_FILLED
+            order.utime = self._now()
+            if self._order_update_callback:
+                SingleTask.run(self._order_update_callback, copy.copy(order))
+
+    def _finish(self, order, status):
+        """ 委托单完成（全部成交或者撤销）
+        """
+        order.status = status
+        order.utime = self._now()
+        self._orders.pop(order.order_no, None)
+        self._queue_ahead.pop(order.order_no, None)
+        if self._order_update_callback:
+            SingleTask.run(self._order_update_callback, copy.copy(order))
+
+    def _update_position(self, trade_type, quantity, price):
+        """ 成交之后更新持仓
+        @param trade_type 合约订单类型
+        @param quantity 成交数量
+        @param price 成交价格
+        """
+        p = self._position
+        if trade_type == TRADE_TYPE_BUY_OPEN:
+            p.long_avg_price = (p.long_avg_price * p.long_quantity + price * quantity) / (p.long_quantity + quantity)
+            p.long_quantity += quantity
+        elif trade_type == TRADE_TYPE_SELL_CLOSE:
+            p.long_quantity -= quantity
+            if p.long_quantity <= 0:
+                p.long_avg_price = 0
+        elif trade_type == TRADE_TYPE_SELL_OPEN:
+            p.short_avg_price = (p.short_avg_price * p.short_quantity + price * quantity) / \
+                                (p.short_quantity + quantity)
+            p.short_quantity += quantity
+        elif trade_type == TRADE_TYPE_BUY_CLOSE:
+            p.short_quantity -= quantity
+            if p.short_quantity <= 0:
+                p.short_avg_price = 0
+        p.utime = self._now()
+        if self._position_update_callback:
+            SingleTask.run(self._position_update_callback, self.position)
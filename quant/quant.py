@@ -5,9 +5,15 @@
 
 Author: HuangTao
 Date:   2017/04/26
+Update: 2019/06/13  1. 增加行情回放模式，使用虚拟时钟事件循环和回放事件中心；
+        2019/06/22  1. 事件循环退出之前执行清理，将mongodb写缓冲里的数据写入数据库；
+        2019/06/26  1. 启动时预热HTTP连接，退出之前关闭HTTP连接池；
+        2019/06/29  1. 退出之前将行情录制模块缓冲区剩余的数据写入文件；
+                    2. 回放模式虚拟时钟从开始日期的UTC零点开始，与行情录制文件的UTC日期一致；
 """
 
 import asyncio
+import datetime
 
 from quant.utils import logger
 from quant.config import config
@@ -27,24 +33,38 @@ class Quant:
         """ 初始化
         @param config_module 配置模块
         """
-        self._get_event_loop()
         self._load_settings(config_module)
+        self._get_event_loop()
         self._init_logger()
         self._init_db_instance()
         self._init_event_center()
+        self._init_http()
         self._do_heartbeat()
 
     def start(self):
         """ 启动
         """
         logger.info("start io loop ...", caller=self)
-        self.loop.run_forever()
+        if config.replay:
+            self.loop.create_task(self.event_center.run())
+        try:
+            self.loop.run_forever()
+        finally:
+            self._shutdown()
 
     def _get_event_loop(self):
         """ 获取主事件io loop
         """
         if not self.loop:
-            self.loop = asyncio.get_event_loop()
+            if config.replay:
+                from quant.replay import VirtualClockEventLoop
+                # 录制文件按照UTC日期保存，虚拟时钟从开始日期的UTC零点开始，不使用本地时区
+                start = datetime.datetime.strptime(str(config.replay.get("start")), "%Y%m%d")
+                start = int(start.replace(tzinfo=datetime.timezone.utc).timestamp())
+                self.loop = VirtualClockEventLoop(start)
+                asyncio.set_event_loop(self.loop)
+            else:
+                self.loop = asyncio.get_event_loop()
         return self.loop
 
     def _load_settings(self, config_module):
@@ -76,12 +96,39 @@ class Quant:
     def _init_event_center(self):
         """ 初始化事件中心
         """
-        if config.rabbitmq:
+        if config.replay:
+            from quant.replay import ReplayEventCenter
+            self.event_center = ReplayEventCenter()
+            config.initialize()  # 订阅配置更新事件
+        elif config.rabbitmq:
             from quant.event import EventCenter
             self.event_center = EventCenter()
             self.loop.run_until_complete(self.event_center.connect())
             config.initialize()  # 订阅配置更新事件
 
+    def _init_http(self):
+        """ 预热HTTP连接
+        """
+        if config.http and config.http.get("prewarm"):
+            from quant.tasks import LoopRunTask
+            from quant.utils.http_client import AsyncHttpRequests
+            self.loop.create_task(AsyncHttpRequests.prewarm())
+            interval = config.http.get("prewarm_interval", 0)  # 定时预热的时间间隔(秒)，保持连接不被空闲超时关闭
+            if interval:
+                LoopRunTask.register(AsyncHttpRequests.prewarm, interval)
+
+    def _shutdown(self):
+        """ 事件循环退出之前执行清理
+        """
+        logger.info("shutdown ...", caller=self)
+        from quant.recorder import close_recorders
+        self.loop.run_until_complete(close_recorders())
+        if config.mongodb:
+            from quant.utils.mongo import closeMongodb
+            self.loop.run_until_complete(closeMongodb())
+        from quant.utils.http_client import AsyncHttpRequests
+        self.loop.run_until_complete(AsyncHttpRequests.close())
+
     def _do_heartbeat(self):
         """ 服务器心跳
         """
@@ -0,0 +1,255 @@
+# -*- coding:utf-8 -*-
+
+"""
+行情数据录制
+订阅订单薄(Orderbook)、成交(Trade)、K线(KLine)行情，按照 交易平台/交易对/日期 追加写入定长记录的二进制文件，
+文件可以通过 numpy.memmap 直接读取，无需解析。
+
+文件路径: {path}/{platform}/{symbol}/{market_type}_{date}.bin，如 /data/binance/BTC_USDT/trade_20190612.bin，
+订单薄文件名包含档位深度，如 orderbook10_20190612.bin；日期为行情时间戳对应的UTC日期。
+
+记录格式（小端，每个字段8字节）:
+    trade       timestamp(int64), price(float64), quantity(float64), side(int64, 1买 / -1卖)
+    kline       timestamp(int64), open, high, low, close, volume(float64)
+    orderbook   timestamp(int64), ask_price[depth], ask_quantity[depth], bid_price[depth], bid_quantity[depth](float64)，
+                不足depth档位的价格和数量为NaN
+
+Author: HuangTao
+Date:   2019/06/12
+Update: 2019/06/29  1. 程序退出之前将所有录制模块缓冲区剩余的数据写入文件；
+"""
+
+import os
+import struct
+import asyncio
+import datetime
+
+from quant import const
+from quant.utils import logger
+from quant.market import Market
+from quant.tasks import LoopRunTask
+from quant.order import ORDER_ACTION_BUY
+
+
+__all__ = ("Recorder", "close_recorders", "get_dtype", "get_record_path", "load", "iter_records", )
+
+
+NAN = float("nan")
+
+RECORDERS = []  # 所有创建的录制模块，程序退出之前写入缓冲区剩余的数据
+
+
+async def close_recorders():
+    """ 将所有录制模块缓冲区剩余的数据写入文件，程序退出之前调用
+    """
+    for recorder in RECORDERS:
+        await recorder.flush()
+
+
+def _get_struct(market_type, depth=10):
+    """ 获取记录的struct格式
+    @param market_type 行情类型
+    @param depth 订单薄档位深度
+    """
+    if market_type == const.MARKET_TYPE_TRADE:
+        return struct.Struct("<qddq")
+    elif market_type == const.MARKET_TYPE_KLINE:
+        return struct.Struct("<q5d")
+    elif market_type == const.MARKET_TYPE_ORDERBOOK:
+        return struct.Struct("<q{n}d".format(n=depth * 4))
+    raise ValueError("market_type error: {}".format(market_type))
+
+
+def get_dtype(market_type, depth=10):
+    """ 获取记录对应的numpy数据类型
+    @param market_type 行情类型
+    @param depth 订单薄档位深度
+    """
+    import numpy as np
+    if market_type == const.MARKET_TYPE_TRADE:
+        fields = [("timestamp", "<i8"), ("price", "<f8"), ("quantity", "<f8"), ("side", "<i8")]
+    elif market_type == const.MARKET_TYPE_KLINE:
+        fields = [("timestamp", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"),
+                  ("volume", "<f8")]
+    elif market_type == const.MARKET_TYPE_ORDERBOOK:
+        fields = [("timestamp", "<i8"), ("ask_price", "<f8", (depth, )), ("ask_quantity", "<f8", (depth, )),
+                  ("bid_price", "<f8", (depth, )), ("bid_quantity", "<f8", (depth, ))]
+    else:
+        raise ValueError("market_type error: {}".format(market_type))
+    return np.dtype(fields)
+
+
+def get_record_path(path, platform, symbol, market_type, date, depth=10):
+    """ 获取记录文件路径
+    @param path 根目录
+    @param platform 交易平台
+    @param symbol 交易对
+    @param market_type 行情类型
+    @param date 日期 如 20190612
+    @param depth 订单薄档位深度
+    """
+    name = market_type
+    if market_type == const.MARKET_TYPE_ORDERBOOK:
+        name += str(depth)
+    filename = "{name}_{date}.bin".format(name=name, date=date)
+    return os.path.join(path, platform, symbol.replace("/", "_"), filename)
+
+
+def load(filename, market_type, depth=10):
+    """ 使用numpy.memmap只读加载记录文件，文件末尾不完整的记录将被忽略
+    @param filename 记录文件
+    @param market_type 行情类型
+    @param depth 订单薄档位深度
+    @return numpy.memmap 结构化数组
+    """
+    import numpy as np
+    dtype = get_dtype(market_type, depth)
+    count = os.path.getsize(filename) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(filename, dtype=dtype, mode="r", shape=(count, ))
+
+
+def iter_records(filename, market_type, depth=10):
+    """ 逐条读取记录文件，无需numpy
+    @param filename 记录文件
+    @param market_type 行情类型
+    @param depth 订单薄档位深度
+    @return 记录元组的迭代器，字段顺序与记录格式一致
+    """
+    s = _get_struct(market_type, depth)
+    with open(filename, "rb") as f:
+        data = f.read()
+    n = len(data) - len(data) % s.size
+    return s.iter_unpack(memoryview(data)[:n])
+
+
+class Recorder:
+    """ 行情数据录制
+    """
+
+    def __init__(self, platform, symbols, path, market_types=None, depth=10, flush_interval=1):
+        """ 初始化
+        @param platform 交易平台
+        @param symbols 交易对列表
+        @param path 记录文件根目录
+        @param market_types 录制的行情类型列表，默认录制订单薄、成交和K线
+        @param depth 订单薄录制的档位深度
+        @param flush_interval 写入文件的时间间隔(秒)
+        """
+        self._platform = platform
+        self._symbols = symbols
+        self._path = path
+        self._depth = depth
+        self._market_types = market_types or [const.MARKET_TYPE_ORDERBOOK, const.MARKET_TYPE_TRADE,
+                                              const.MARKET_TYPE_KLINE]
+        self._structs = {market_type: _get_struct(market_type, depth) for market_type in self._market_types}
+        self._buffers = {}  # 等待写入文件的数据 {filename: bytearray}
+        self._filenames = {}  # 记录文件路径缓存 {(symbol, market_type, day): filename}
+        self._count = 0  # 已录制的记录条数
+        self._writing = False  # 是否正在写入文件
+
+        callbacks = {
+            const.MARKET_TYPE_ORDERBOOK: self.on_event_orderbook_update,
+            const.MARKET_TYPE_TRADE: self.on_event_trade_update,
+            const.MARKET_TYPE_KLINE: self.on_event_kline_update
+        }
+        for symbol in symbols:
+            for market_type in self._market_types:
+                Market(market_type, platform, symbol, callbacks[market_type])
+
+        LoopRunTask.register(self._flush, flush_interval)
+        RECORDERS.append(self)
+
+    @property
+    def count(self):
+        return self._count
+
+    async def on_event_orderbook_update(self, orderbook):
+        """ 订单薄更新
+        """
+        depth = self._depth
+        values = [NAN] * (depth * 4)
+        for i, (price, quantity) in enumerate(orderbook.asks[:depth]):
+            values[i] = float(price)
+            values[depth + i] = float(quantity)
+        for i, (price, quantity) in enumerate(orderbook.bids[:depth]):
+            values[depth * 2 + i] = float(price)
+            values[depth * 3 + i] = float(quantity)
+        data = self._structs[const.MARKET_TYPE_ORDERBOOK].pack(int(orderbook.timestamp), *values)
+        self._append(orderbook.symbol, const.MARKET_TYPE_ORDERBOOK, orderbook.timestamp, data)
+
+    async def on_event_trade_update(self, trade):
+        """ 成交更新
+        """
+        side = 1 if trade.action == ORDER_ACTION_BUY else -1
+        data = self._structs[const.MARKET_TYPE_TRADE].pack(int(trade.timestamp), float(trade.price),
+                                                           float(trade.quantity), side)
+        self._append(trade.symbol, const.MARKET_TYPE_TRADE, trade.timestamp, data)
+
+    async def on_event_kline_update(self, kline):
+        """ K线更新
+        """
+        data = self._structs[const.MARKET_TYPE_KLINE].pack(int(kline.timestamp), float(kline.open), float(kline.high),
+                                                           float(kline.low), float(kline.close), float(kline.volume))
+        self._append(kline.symbol, const.MARKET_TYPE_KLINE, kline.timestamp, data)
+
+    def _append(self, symbol, market_type, timestamp, data):
+        """ 记录放入写入缓冲区
+        @param symbol 交易对
+        @param market_type 行情类型
+        @param timestamp 时间戳(毫秒)
+        @param data 打包好的记录
+        """
+        day = int(timestamp) // 86400000
+        key = (symbol, market_type, day)
+        filename = self._filenames.get(key)
+        if not filename:
+            date = datetime.datetime.utcfromtimestamp(day * 86400).strftime("%Y%m%d")
+            filename = get_record_path(self._path, self._platform, symbol, market_type, date, self._depth)
+            self._filenames[key] = filename
+        buf = self._buffers.get(filename)
+        if buf is None:
+            buf = bytearray()
+            self._buffers[filename] = buf
+        buf += data
+        self._count += 1
+
+    async def _flush(self, *args, **kwargs):
+        """ 将缓冲区的数据写入文件，文件写入在线程池里执行，不阻塞事件循环
+        """
+        if self._writing or not self._buffers:
+            return
+        buffers, self._buffers = self._buffers, {}
+        self._writing = True
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, buffers)
+        except Exception as e:
+            logger.error("write record file error:", e, caller=self)
+        finally:
+            self._writing = False
+
+    async def flush(self):
+        """ 等待正在执行的写入完成，再将缓冲区剩余的数据全部写入文件
+        """
+        while self._writing:
+            await asyncio.sleep(0.01)
+        await self._flush()
+
+    def close(self):
+        """ 将缓冲区剩余的数据写入文件
+        * NOTE: 同步写入，不等待正在线程池里执行的写入，在事件循环里请使用 flush
+        """
+        buffers, self._buffers = self._buffers, {}
+        self._write(buffers)
+
+    def _write(self, buffers):
+        """ 追加写入文件
+        @param buffers 等待写入文件的数据 {filename: bytearray}
+        """
+        for filename, buf in buffers.items():
+            dirname = os.path.dirname(filename)
+            if not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            with open(filename, "ab") as f:
+                f.write(buf)
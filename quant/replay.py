@@ -0,0 +1,254 @@
+# -*- coding:utf-8 -*-
+
+"""
+行情回放
+1. 虚拟时钟事件循环：事件循环没有就绪的任务时，时钟直接跳到下一个定时任务的时间，无需真实等待，
+   因此服务器心跳、LoopRunTask、SingleTask.call_later 都按照回放的行情时间执行；
+2. 回放事件中心：替代 EventCenter，接口一致，从行情录制文件(quant.recorder)读取订单薄、成交、K线，
+   按照时间戳顺序推送给订阅者，不需要RabbitMQ；每条行情的回调函数执行完成之后再推送下一条行情，回放结果可以重复；
+
+Author: HuangTao
+Date:   2019/06/13
+Update: 2019/06/29  1. 顺序等待每条行情的回调函数执行完成；等待策略订阅完成之后再开始回放，回放期间新的订阅从当前行情时间开始推送；
+"""
+
+import os
+import heapq
+import asyncio
+import itertools
+import datetime
+import selectors
+
+from quant import const
+from quant import recorder
+from quant.utils import tools
+from quant.utils import logger
+from quant.utils.topic import TopicTrie
+from quant.config import config
+from quant.tasks import SingleTask
+from quant.market import Orderbook, Trade, Kline
+from quant.order import ORDER_ACTION_BUY, ORDER_ACTION_SELL
+
+
+__all__ = ("VirtualClockEventLoop", "ReplayEventCenter", )
+
+
+# 连续多少次事件循环迭代没有新的订阅，认为策略初始化完成
+SUBSCRIBE_IDLE_ITERATIONS = 10
+
+# 交换机对应的行情类型
+EXCHANGE_MARKET_TYPES = {
+    "Orderbook": const.MARKET_TYPE_ORDERBOOK,
+    "Trade": const.MARKET_TYPE_TRADE,
+    "Kline": const.MARKET_TYPE_KLINE
+}
+
+
+class _VirtualClockSelector(selectors.DefaultSelector):
+    """ 虚拟时钟IO多路复用，不阻塞等待，没有就绪的IO时将虚拟时钟向前推进timeout秒
+    """
+
+    def __init__(self, loop):
+        super(_VirtualClockSelector, self).__init__()
+        self._loop = loop
+
+    def select(self, timeout=None):
+        if timeout is None:  # 没有任何定时任务，等待真实的IO
+            return super(_VirtualClockSelector, self).select(timeout)
+        events = super(_VirtualClockSelector, self).select(0)
+        if not events and timeout > 0:
+            self._loop.advance(timeout)
+        return events
+
+
+class VirtualClockEventLoop(asyncio.SelectorEventLoop):
+    """ 虚拟时钟事件循环
+    * NOTE: 网络IO不会阻止时钟推进，回放模式下不应该依赖真实的网络请求
+    """
+
+    def __init__(self, start_time=0):
+        """ 初始化
+        @param start_time 虚拟时钟的起始时间(秒)
+        """
+        self._virtual_time = start_time
+        super(VirtualClockEventLoop, self).__init__(selector=_VirtualClockSelector(self))
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return self._virtual_time
+
+    def advance(self, seconds):
+        """ 虚拟时钟向前推进
+        @param seconds 推进的时间(秒)
+        """
+        self._virtual_time += seconds
+
+
+class ReplayEventCenter:
+    """ 回放事件中心
+    """
+
+    def __init__(self):
+        self._path = config.replay.get("path", "/data/market")  # 行情录制文件根目录
+        self._start = config.replay.get("start")  # 回放开始日期 如 20190601
+        self._end = config.replay.get("end", self._start)  # 回放结束日期(包含) 如 20190630
+        self._depth = config.replay.get("depth", 10)  # 订单薄录制的档位深度
+        self._subscribers = []  # 订阅者 [(event, callback, multi), ...]
+        self._local_index = {}  # 事件处理函数索引 {"exchange": TopicTrie}
+        self._count = 0  # 已回放的行情数量
+        self._running = False  # 是否正在回放
+        self._heap = []  # 每个行情流的下一条行情 [(timestamp, seq, exchange, routing_key, object, stream), ...]
+        self._seq = itertools.count()  # 时间戳相同的行情按照加入的顺序推送
+        self._streamed = set()  # 已经加载的行情录制文件 {(platform, symbol, exchange), ...}
+        self._ts = 0  # 当前回放的行情时间戳(毫秒)
+
+    @property
+    def count(self):
+        return self._count
+
+    async def connect(self, reconnect=False):
+        """ 回放模式不需要连接RabbitMQ
+        """
+        pass
+
+    async def subscribe(self, event, callback=None, multi=False):
+        """ 注册事件
+        @param event 事件
+        @param callback 回调函数
+        @param multi 是否批量订阅消息，即routing_key为批量匹配
+        """
+        logger.info("NAME:", event.name, "EXCHANGE:", event.exchange, "ROUTING_KEY:", event.routing_key, caller=self)
+        self._subscribers.append((event, callback, multi))
+        if callback:
+            index = self._local_index.get(event.exchange)
+            if not index:
+                index = TopicTrie()
+                self._local_index[event.exchange] = index
+            index.add(event.routing_key, event.local_callback)
+            if self._running:  # 回放期间新的订阅，从当前行情时间开始推送
+                for stream in self._load_streams():
+                    self._push(itertools.dropwhile(lambda item: item[0] < self._ts, stream))
+
+    async def publish(self, event):
+        """ 发布消息，直接分发给订阅者
+        @param event 发布的事件对象
+        """
+        self.publish_nowait(event)
+
+    def publish_nowait(self, event):
+        """ 发布消息，直接分发给订阅者
+        @param event 发布的事件对象
+        """
+        index = self._local_index.get(event.exchange)
+        if not index:
+            return
+        funcs = index.match(event.routing_key)
+        if not funcs:
+            return
+        o = event.parse()
+        for func in funcs:
+            SingleTask.run(func, event.exchange, event.routing_key, o)
+
+    async def run(self):
+        """ 按照时间戳顺序回放所有被订阅的行情，回放完成之后停止事件循环
+        * NOTE: 每条行情的回调函数顺序执行完成之后再推送下一条行情；回放期间新的订阅从当前行情时间开始推送
+        """
+        await self._wait_subscriptions()
+        streams = self._load_streams()
+        for stream in streams:
+            self._push(stream)
+        self._running = True
+        logger.info("replay start, streams:", len(streams), "start:", self._start, "end:", self._end, caller=self)
+
+        loop = asyncio.get_event_loop()
+        begin = tools.get_cur_timestamp_ms()
+        while self._heap:
+            ts, _, exchange, routing_key, o, stream = heapq.heappop(self._heap)
+            self._push(stream)
+            self._ts = ts
+            delay = ts / 1000 - loop.time()
+            await asyncio.sleep(delay if delay > 0 else 0)
+            for func in self._local_index[exchange].match(routing_key):
+                try:
+                    await func(exchange, routing_key, o)
+                except Exception as e:
+                    logger.error("replay callback error:", e, caller=self)
+            self._count += 1
+        self._running = False
+        await asyncio.sleep(0)  # 执行最后一条行情发布的事件的回调
+
+        cost = (tools.get_cur_timestamp_ms() - begin) / 1000
+        logger.info("replay finished, count:", self._count, "cost:", cost, "seconds", caller=self)
+        loop.stop()
+
+    async def _wait_subscriptions(self):
+        """ 等待策略初始化完成，连续 SUBSCRIBE_IDLE_ITERATIONS 次事件循环迭代没有新的订阅时返回
+        """
+        idle = 0
+        while idle < SUBSCRIBE_IDLE_ITERATIONS:
+            count = len(self._subscribers)
+            await asyncio.sleep(0)
+            idle = idle + 1 if len(self._subscribers) == count else 0
+
+    def _push(self, stream):
+        """ 读取行情流的下一条行情放入合并堆，行情流读取完成时忽略
+        @param stream 行情迭代器
+        """
+        for ts, exchange, routing_key, o in stream:
+            heapq.heappush(self._heap, (ts, next(self._seq), exchange, routing_key, o, stream))
+            return
+
+    def _load_streams(self):
+        """ 根据订阅的事件，加载需要回放、并且还没有加载的行情录制文件
+        @return 行情迭代器列表
+        """
+        dates = []
+        day = datetime.datetime.strptime(str(self._start), "%Y%m%d")
+        end = datetime.datetime.strptime(str(self._end), "%Y%m%d")
+        while day <= end:
+            dates.append(day.strftime("%Y%m%d"))
+            day += datetime.timedelta(days=1)
+
+        streams = []
+        if not os.path.isdir(self._path):
+            logger.warn("replay path not exist:", self._path, caller=self)
+            return streams
+        for platform in sorted(os.listdir(self._path)):
+            if not os.path.isdir(os.path.join(self._path, platform)):
+                continue
+            for name in sorted(os.listdir(os.path.join(self._path, platform))):
+                symbol = name.replace("_", "/")
+                routing_key = "{platform}.{symbol}".format(platform=platform, symbol=symbol)
+                for exchange, market_type in EXCHANGE_MARKET_TYPES.items():
+                    index = self._local_index.get(exchange)
+                    if not index:
+                        continue
+                    if (platform, symbol, exchange) in self._streamed or not index.match(routing_key):
+                        continue
+                    filenames = [recorder.get_record_path(self._path, platform, symbol, market_type, date, self._depth)
+                                 for date in dates]
+                    filenames = [filename for filename in filenames if os.path.isfile(filename)]
+                    if not filenames:
+                        continue
+                    self._streamed.add((platform, symbol, exchange))
+                    streams.append(self._iter_stream(filenames, market_type, platform, symbol, exchange, routing_key))
+        return streams
+
+    def _iter_stream(self, filenames, market_type, platform, symbol, exchange, routing_key):
+        """ 按照时间顺序读取一个交易对的行情录制文件
+        @return 迭代器 (timestamp, exchange, routing_key, object)
+        """
+        depth = self._depth
+        for filename in filenames:
+            for r in recorder.iter_records(filename, market_type, depth):
+                ts = r[0]
+                if market_type == const.MARKET_TYPE_ORDERBOOK:
+                    asks = [[p, q] for p, q in zip(r[1:depth + 1], r[depth + 1:depth * 2 + 1]) if p == p]
+                    bids = [[p, q] for p, q in zip(r[depth * 2 + 1:depth * 3 + 1], r[depth * 3 + 1:]) if p == p]
+                    o = Orderbook(platform, symbol, asks, bids, ts)
+                elif market_type == const.MARKET_TYPE_TRADE:
+                    action = ORDER_ACTION_BUY if r[3] > 0 else ORDER_ACTION_SELL
+                    o = Trade(platform, symbol, action, r[1], r[2], ts)
+                else:
+                    o = Kline(platform, symbol, r[1], r[2], r[3], r[4], r[5], ts)
+                yield ts, exchange, routing_key, o
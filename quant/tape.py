@@ -0,0 +1,223 @@
+# -*- coding:utf-8 -*-
+
+"""
+成交记录(Trade Tape)
+订阅交易对的成交行情，保存在固定容量的环形数组里，并增量维护滚动窗口统计数据：
+成交笔数、成交量、主动买入量、主动卖出量、成交量加权平均价格(VWAP)、买卖不平衡度、已实现波动率。
+
+滚动窗口支持按照成交笔数（最近N笔）和按照时间（最近T秒）两种方式，每笔成交更新统计数据的时间复杂度为O(1)。
+
+Author: HuangTao
+Date:   2019/06/20
+"""
+
+import math
+from array import array
+
+from quant import const
+from quant.market import Market
+from quant.tasks import SingleTask
+from quant.order import ORDER_ACTION_BUY
+
+
+__all__ = ("TradeTape", "RollingStats", )
+
+
+class RollingStats:
+    """ 滚动窗口统计数据
+    """
+
+    __slots__ = ("start", "count", "volume", "buy_volume", "sell_volume", "turnover", "sum_return", "sum_return2")
+
+    def __init__(self):
+        self.start = 0  # 窗口内第一笔成交的序号
+        self.count = 0  # 成交笔数
+        self.volume = 0.0  # 成交量
+        self.buy_volume = 0.0  # 主动买入成交量
+        self.sell_volume = 0.0  # 主动卖出成交量
+        self.turnover = 0.0  # 成交额
+        self.sum_return = 0.0  # 对数收益率之和
+        self.sum_return2 = 0.0  # 对数收益率平方和
+
+    @property
+    def vwap(self):
+        """ 成交量加权平均价格
+        """
+        return self.turnover / self.volume if self.volume > 0 else None
+
+    @property
+    def imbalance(self):
+        """ 买卖不平衡度 (buy - sell) / (buy + sell)，取值范围 [-1, 1]
+        """
+        total = self.buy_volume + self.sell_volume
+        return (self.buy_volume - self.sell_volume) / total if total > 0 else None
+
+    @property
+    def realized_volatility(self):
+        """ 已实现波动率，窗口内逐笔对数收益率平方和的平方根
+        """
+        return math.sqrt(max(self.sum_return2, 0.0))
+
+    def add(self, price, quantity, side, r, sign=1):
+        """ 增加（sign=1）或者移除（sign=-1）一笔成交
+        """
+        self.count += sign
+        q = quantity * sign
+        self.volume += q
+        self.turnover += price * q
+        if side > 0:
+            self.buy_volume += q
+        else:
+            self.sell_volume += q
+        self.sum_return += r * sign
+        self.sum_return2 += r * r * sign
+
+    def reset(self):
+        """ 清空统计数据，不修改窗口起始序号
+        """
+        self.count = 0
+        self.volume = self.buy_volume = self.sell_volume = self.turnover = 0.0
+        self.sum_return = self.sum_return2 = 0.0
+
+    @property
+    def data(self):
+        d = {
+            "count": self.count,
+            "volume": self.volume,
+            "buy_volume": self.buy_volume,
+            "sell_volume": self.sell_volume,
+            "vwap": self.vwap,
+            "imbalance": self.imbalance,
+            "realized_volatility": self.realized_volatility
+        }
+        return d
+
+    def __str__(self):
+        return str(self.data)
+
+    def __repr__(self):
+        return str(self)
+
+
+class TradeTape:
+    """ 成交记录，固定容量的环形数组
+    """
+
+    def __init__(self, platform=None, symbol=None, capacity=10000, window_count=None, window_secs=None,
+                 callback=None):
+        """ 初始化
+        @param platform 交易平台，不为空时订阅此交易平台的成交行情
+        @param symbol 交易对
+        @param capacity 最多保存的成交笔数，超出的最早的成交将被覆盖
+        @param window_count 按照成交笔数的滚动窗口大小，默认为capacity
+        @param window_secs 按照时间的滚动窗口大小(秒)，None为不统计；窗口内的成交笔数不能超过capacity，超出的部分不参与统计
+        @param callback 成交记录更新回调函数 async def callback(tape)
+        """
+        self._platform = platform
+        self._symbol = symbol
+        self._capacity = capacity
+        self._window_count = min(window_count or capacity, capacity)
+        self._window_ms = window_secs * 1000 if window_secs else None
+        self._callback = callback
+
+        self._timestamps = array("d", [0.0]) * capacity
+        self._prices = array("d", [0.0]) * capacity
+        self._quantities = array("d", [0.0]) * capacity
+        self._sides = array("d", [0.0]) * capacity  # 1主动买入 / -1主动卖出
+        self._returns = array("d", [0.0]) * capacity  # 与上一笔成交价格的对数收益率
+        self._seq = 0  # 已经保存的成交笔数，下一笔成交的序号
+
+        self._count_stats = RollingStats()  # 按照成交笔数的滚动窗口统计
+        self._time_stats = RollingStats() if self._window_ms else None  # 按照时间的滚动窗口统计
+
+        if platform and symbol:
+            Market(const.MARKET_TYPE_TRADE, platform, symbol, self.on_event_trade_update)
+
+    @property
+    def count_stats(self):
+        return self._count_stats
+
+    @property
+    def time_stats(self):
+        return self._time_stats
+
+    def __len__(self):
+        return min(self._seq, self._capacity)
+
+    async def on_event_trade_update(self, trade):
+        """ 成交更新
+        """
+        side = 1 if trade.action == ORDER_ACTION_BUY else -1
+        self.push(trade.timestamp, float(trade.price), float(trade.quantity), side)
+        if self._callback:
+            SingleTask.run(self._callback, self)
+
+    def push(self, timestamp, price, quantity, side):
+        """ 增加一笔成交
+        @param timestamp 时间戳(毫秒)
+        @param price 价格
+        @param quantity 数量
+        @param side 1主动买入 / -1主动卖出
+        """
+        seq, cap = self._seq, self._capacity
+        i = seq % cap
+        r = math.log(price / self._prices[(seq - 1) % cap]) if seq > 0 and price > 0 else 0.0
+
+        # 即将被覆盖的成交移出所有窗口
+        if seq >= cap:
+            self._evict(self._count_stats, seq - cap + 1)
+            if self._time_stats:
+                self._evict(self._time_stats, seq - cap + 1)
+
+        self._timestamps[i] = timestamp
+        self._prices[i] = price
+        self._quantities[i] = quantity
+        self._sides[i] = side
+        self._returns[i] = r
+        self._seq = seq + 1
+
+        self._count_stats.add(price, quantity, side, r)
+        self._evict(self._count_stats, self._seq - self._window_count)
+        if self._time_stats:
+            self._time_stats.add(price, quantity, side, r)
+            stats, deadline = self._time_stats, timestamp - self._window_ms
+            while stats.start < self._seq and self._timestamps[stats.start % cap] <= deadline:
+                self._evict(stats, stats.start + 1)
+
+        # 定期重新计算，消除浮点数累计误差
+        if self._seq % cap == 0:
+            self._rebuild(self._count_stats)
+            if self._time_stats:
+                self._rebuild(self._time_stats)
+
+    def latest(self, n=None):
+        """ 最近的成交记录，按照时间升序
+        @param n 成交笔数，默认为所有保存的成交
+        @return [(timestamp, price, quantity, side), ...]
+        """
+        n = min(n or len(self), len(self))
+        result = []
+        for seq in range(self._seq - n, self._seq):
+            i = seq % self._capacity
+            result.append((int(self._timestamps[i]), self._prices[i], self._quantities[i], int(self._sides[i])))
+        return result
+
+    def _evict(self, stats, start):
+        """ 将窗口起始序号之前的成交移出窗口
+        @param stats 滚动窗口统计
+        @param start 新的窗口起始序号
+        """
+        cap = self._capacity
+        while stats.start < start:
+            i = stats.start % cap
+            stats.add(self._prices[i], self._quantities[i], self._sides[i], self._returns[i], -1)
+            stats.start += 1
+
+    def _rebuild(self, stats):
+        """ 根据窗口内的成交重新计算统计数据
+        """
+        stats.reset()
+        cap = self._capacity
+        for seq in range(stats.start, self._seq):
+            i = seq % cap
+            stats.add(self._prices[i], self._quantities[i], self._sides[i], self._returns[i])
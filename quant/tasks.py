@@ -7,11 +7,14 @@
 
 Author: HuangTao
 Date:   2018/04/26
+Update: 2019/06/28  1. 增加 SingleTask.gather，限制并发数量执行多个协程；
+        2019/06/29  1. SingleTask.gather 单个协程抛出异常时不影响其它协程的结果；
 """
 
 import asyncio
 import inspect
 
+from quant.utils import logger
 from quant.heartbeat import heartbeat
 
 __all__ = ("LoopRunTask", "SingleTask")
@@ -62,3 +65,26 @@ class SingleTask:
             def foo(f, *args, **kwargs):
                 asyncio.get_event_loop().create_task(f(*args, **kwargs))
             asyncio.get_event_loop().call_later(delay, foo, func, *args)
+
+    @classmethod
+    async def gather(cls, coros, limit=10):
+        """ 并发执行多个协程，同时执行的协程数量不超过limit
+        @param coros 协程列表
+        @param limit 最大并发数量
+        @return results 按照传入顺序返回每个协程的结果
+        * NOTE: 协程抛出异常时，对应位置的结果为 (None, e)，与接口返回 (result, error) 的约定一致
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def run(coro):
+            async with semaphore:
+                try:
+                    return await coro
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error("coroutine error:", e, caller=cls)
+                    return None, e
+
+        results = await asyncio.gather(*[run(coro) for coro in coros])
+        return results
@@ -5,16 +5,19 @@ Trade 交易模块，整合所有交易所为一体
 
 Author: HuangTao
 Date:   2019/04/21
+Update: 2019/06/28  1. 增加批量下单 create_orders、撤单并重新下单 replace_orders；
 """
 
 from quant.utils import logger
+from quant.tasks import SingleTask
 from quant.order import ORDER_TYPE_LIMIT
-from quant.const import OKEX, OKEX_FUTURE, DERIBIT, BITMEX, BINANCE
+from quant.const import OKEX, OKEX_FUTURE, DERIBIT, BITMEX, BINANCE, SIMULATED
 from quant.platform.okex import OKExTrade
 # from quant.platform.bitmex.trade import BitmexTrade
 from quant.platform.binance import BinanceTrade
 from quant.platform.deribit import DeribitTrade
 from quant.platform.okex_future import OKExFutureTrade
+from quant.platform.simulated import SimulatedTrade
 
 
 class Trade:
@@ -53,6 +56,10 @@ class Trade:
         elif platform == BINANCE:
             self._t = BinanceTrade(account, strategy, symbol, host, wss, access_key, secret_key,
                                    order_update_callback=order_update_callback)
+        elif platform == SIMULATED:
+            self._t = SimulatedTrade(account, strategy, symbol, kwargs.get("market_platform"), kwargs.get("latency"),
+                                     order_update_callback=order_update_callback,
+                                     position_update_callback=position_update_callback)
         else:
             logger.error("platform error:", platform, caller=self)
             exit(-1)
@@ -76,10 +83,52 @@ class Trade:
         order_no, error = await self._t.create_order(action, price, quantity, order_type)
         return order_no, error
 
+    async def create_orders(self, orders):
+        """ 批量创建委托单
+        @param orders 委托单列表 [(action, price, quantity), ...] 或 [(action, price, quantity, order_type), ...]
+        @return (order_nos, errors) 按照传入顺序返回每个委托单的结果，下单成功 order_no 为委托单号、error 为None，
+                否则 order_no 为None、error 为失败信息
+        * NOTE: OKEx使用批量下单接口，Deribit通过websocket连续发送下单请求，其它交易平台并发下单，同时发出的请求不超过10个
+        """
+        orders = [(order[0], order[1], order[2], order[3] if len(order) > 3 else ORDER_TYPE_LIMIT) for order in orders]
+        if not orders:
+            return [], []
+        if hasattr(self._t, "create_orders"):
+            order_nos, errors = await self._t.create_orders(orders)
+            return order_nos, errors
+        results = await SingleTask.gather([self._t.create_order(*order) for order in orders])
+        order_nos = [order_no for order_no, _ in results]
+        errors = [error for _, error in results]
+        return order_nos, errors
+
+    async def replace_orders(self, order_nos, orders):
+        """ 撤销委托单并重新下单，所有委托单撤销成功之后才会创建新的委托单
+        @param order_nos 需要撤销的委托单号列表
+        @param orders 新的委托单列表，格式与 create_orders 一致
+        @return (order_nos, errors) 新委托单的结果，格式与 create_orders 一致；
+                如果有委托单撤销失败，那么不会创建新的委托单，order_nos 全部为None，errors 全部为撤单失败的列表
+        """
+        if len(order_nos) == 1:
+            _, error = await self._t.revoke_order(*order_nos)
+            if error:
+                error = [(order_nos[0], error)]
+        elif len(order_nos) > 1:
+            _, error = await self._t.revoke_order(*order_nos)
+        else:
+            error = None
+        if error:
+            logger.error("revoke orders error! error:", error, caller=self)
+            return [None] * len(orders), [error] * len(orders)
+        order_nos, errors = await self.create_orders(orders)
+        return order_nos, errors
+
     async def revoke_order(self, *order_nos):
         """ 撤销委托单
         @param order_nos 订单号列表，可传入任意多个，如果不传入，那么就撤销所有订单
-        @return (success, error) success为撤单成功列表，error为撤单失败的列表
+        @return 撤销全部订单：全部成功返回 (True, None)，否则返回 (False, error)
+                撤销一个订单：返回 (order_no, error)
+                撤销多个订单：返回 (success, error) success为撤单成功列表，error为撤单失败的列表 [(order_no, e), ...]
+        * NOTE: 多个订单并发撤销，撤销全部订单时遇到失败会继续撤销剩余订单，error为撤单失败的列表
         """
         success, error = await self._t.revoke_order(*order_nos)
         return success, error
@@ -0,0 +1,114 @@
+# -*- coding:utf-8 -*-
+
+"""
+LRU缓存
+按照最近使用的顺序保存数据，缓存数据的总大小超出最大容量时，淘汰最久没有使用的数据；统计命中、未命中、淘汰次数。
+
+Author: HuangTao
+Date:   2019/06/24
+"""
+
+import sys
+from collections import OrderedDict
+
+
+__all__ = ("LRUCache", "get_size", )
+
+
+class LRUCache:
+    """ LRU缓存
+    """
+
+    def __init__(self, max_size=64 * 1024 * 1024, sizeof=None):
+        """ 初始化
+        @param max_size 最大容量，单位与sizeof的返回值一致
+        @param sizeof 计算数据大小的函数 sizeof(value)，默认使用 get_size 估算占用的内存(字节)
+        """
+        self._max_size = max_size
+        self._sizeof = sizeof or get_size
+        self._data = OrderedDict()  # 缓存的数据，最近使用的在最后 {key: (value, size)}
+        self._size = 0  # 缓存数据的总大小
+        self._hits = 0  # 命中次数
+        self._misses = 0  # 未命中次数
+        self._evictions = 0  # 淘汰次数
+
+    @property
+    def stats(self):
+        total = self._hits + self._misses
+        d = {
+            "count": len(self._data),
+            "size": self._size,
+            "max_size": self._max_size,
+            "hits": self._hits,
+            "misses": self._misses,
+            "evictions": self._evictions,
+            "hit_rate": self._hits / total if total else 0
+        }
+        return d
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """ 读取缓存
+        @param key 缓存的key
+        @param default 未命中时的返回值
+        """
+        item = self._data.get(key)
+        if item is None:
+            self._misses += 1
+            return default
+        self._data.move_to_end(key)
+        self._hits += 1
+        return item[0]
+
+    def set(self, key, value):
+        """ 写入缓存，超出最大容量时淘汰最久没有使用的数据；单个数据超出最大容量时不缓存
+        @param key 缓存的key
+        @param value 缓存的数据
+        """
+        self.delete(key)
+        size = self._sizeof(value)
+        if size > self._max_size:
+            return
+        self._data[key] = (value, size)
+        self._size += size
+        while self._size > self._max_size:
+            _, (_, evicted_size) = self._data.popitem(last=False)
+            self._size -= evicted_size
+            self._evictions += 1
+
+    def keys(self):
+        """ 所有缓存的key列表，不改变使用顺序
+        """
+        return list(self._data.keys())
+
+    def delete(self, key):
+        """ 删除缓存
+        @param key 缓存的key
+        """
+        item = self._data.pop(key, None)
+        if item is not None:
+            self._size -= item[1]
+
+    def clear(self):
+        """ 清空缓存，不清空统计数据
+        """
+        self._data.clear()
+        self._size = 0
+
+
+def get_size(obj):
+    """ 估算对象占用的内存(字节)，递归计算 dict、list、tuple 里的元素
+    """
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += sys.getsizeof(key) + get_size(value)
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += get_size(item)
+    return size
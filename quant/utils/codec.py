@@ -0,0 +1,95 @@
+# -*- coding:utf-8 -*-
+
+"""
+事件数据编解码
+1. Json编解码，默认的编码方式，兼容旧版本的发布者和订阅者；
+2. MessagePack二进制编解码，数据更紧凑，编解码速度更快（需要安装 msgpack 库）；
+
+发布者通过RabbitMQ消息属性 content_type 标识消息的编码方式，订阅者根据 content_type 选择对应的解码器，
+没有 content_type 的消息按照Json格式解码，因此不同编码方式的发布者可以同时存在。
+
+Author: HuangTao
+Date:   2019/06/03
+"""
+
+import json
+
+
+__all__ = ("JsonCodec", "MsgpackCodec", "get_codec", "get_codec_by_content_type", )
+
+
+class JsonCodec:
+    """ Json编解码
+    """
+
+    NAME = "json"
+    CONTENT_TYPE = "application/json"
+
+    def encode(self, d):
+        """ 编码
+        @param d 需要编码的数据
+        @return bytes类型的数据
+        """
+        return json.dumps(d).encode()
+
+    def decode(self, b):
+        """ 解码
+        @param b bytes类型的数据
+        """
+        return json.loads(b)
+
+
+class MsgpackCodec:
+    """ MessagePack二进制编解码
+    """
+
+    NAME = "msgpack"
+    CONTENT_TYPE = "application/x-msgpack"
+
+    def __init__(self):
+        import msgpack
+        self._packb = msgpack.packb
+        self._unpackb = msgpack.unpackb
+
+    def encode(self, d):
+        """ 编码
+        @param d 需要编码的数据
+        @return bytes类型的数据
+        """
+        return self._packb(d, use_bin_type=True)
+
+    def decode(self, b):
+        """ 解码
+        @param b bytes类型的数据
+        """
+        return self._unpackb(b, raw=False)
+
+
+_CODEC_CLASSES = {
+    JsonCodec.NAME: JsonCodec,
+    MsgpackCodec.NAME: MsgpackCodec
+}
+_CONTENT_TYPES = {
+    JsonCodec.CONTENT_TYPE: JsonCodec.NAME,
+    MsgpackCodec.CONTENT_TYPE: MsgpackCodec.NAME
+}
+_CODECS = {}  # 已经初始化的编解码器 {"name": codec}
+
+
+def get_codec(name="json"):
+    """ 根据名称获取编解码器
+    @param name 编解码器名称 json / msgpack
+    """
+    codec = _CODECS.get(name)
+    if not codec:
+        codec = _CODEC_CLASSES[name]()
+        _CODECS[name] = codec
+    return codec
+
+
+def get_codec_by_content_type(content_type=None):
+    """ 根据消息的content_type获取编解码器
+    @param content_type 消息属性content_type，为空或者未知类型时使用Json编解码器
+    """
+    name = _CONTENT_TYPES.get(content_type, JsonCodec.NAME)
+    return get_codec(name)
@@ -5,8 +5,14 @@ aiohttp client接口封装
 
 Author: HuangTao
 Date:   2018/05/03
+Update: 2019/06/26  1. 每个域名的连接池可以通过配置 HTTP 调整连接数、keep-alive、DNS缓存、TCP_NODELAY;
+                    2. 支持启动时预热连接、定时保持连接，退出时关闭所有session;
+        2019/06/27  1. 请求完成之后，将响应状态和响应头交给限频器调整剩余令牌;
+        2019/06/29  1. 删除TCP_NODELAY配置，asyncio创建TCP连接时已经设置TCP_NODELAY;
 """
 
+import asyncio
+
 import aiohttp
 from urllib.parse import urlparse
 
@@ -20,8 +26,17 @@ class AsyncHttpRequests(object):
 
     _SESSIONS = {}  # 每个域名保持一个公用的session连接（每个session持有自己的连接池），这样可以节省资源、加快请求速度
 
+    # 连接池默认配置，可以被配置文件 HTTP 里的配置覆盖
+    DEFAULT_SETTINGS = {
+        "limit": 100,  # 连接池最大连接数
+        "limit_per_host": 0,  # 每个ip:port最大连接数，0为不限制
+        "keepalive_timeout": 30,  # 空闲连接保持时间(秒)
+        "ttl_dns_cache": 300  # DNS缓存时间(秒)
+    }
+
     @classmethod
-    async def fetch(cls, method, url, params=None, body=None, data=None, headers=None, timeout=30, **kwargs):
+    async def fetch(cls, method, url, params=None, body=None, data=None, headers=None, timeout=30, limiter=None,
+                    **kwargs):
         """ 发起HTTP请求
         @param method 请求方法 GET/POST/PUT/DELETE
         @param url 请求的url
@@ -30,6 +45,7 @@ class AsyncHttpRequests(object):
         @param data json格式的数据
         @param headers 请求的headers
         @param timeout 超时时间(秒)
+        @param limiter 限频器 RateLimiter，根据响应状态和响应头调整剩余令牌
         @return (code, success, error) 如果成功，error为None，失败success为None，error为失败信息
         """
         session = cls._get_session(url)
@@ -54,6 +70,8 @@ class AsyncHttpRequests(object):
             logger.error("method:", method, "url:", url, "params:", params, "body:", body, "data:", data, "Error:", e,
                          caller=cls)
             return None, None, e
+        if limiter:
+            limiter.update(response.status, response.headers)
         code = response.status
         if code not in (200, 201, 202, 203, 204, 205, 206):
             text = await response.text()
@@ -98,6 +116,39 @@ class AsyncHttpRequests(object):
         result = await cls.fetch("PUT", url, params, body, data, headers, timeout, **kwargs)
         return result
 
+    @classmethod
+    async def prewarm(cls, *args, **kwargs):
+        """ 预热连接，按照配置 HTTP.prewarm {url: 连接数} 并发发起HEAD请求，请求完成之后连接保留在连接池里，
+        之后的请求可以直接使用已经完成TCP和TLS握手的连接
+        """
+        prewarm = (config.http or {}).get("prewarm", {})
+        tasks = []
+        for url, count in prewarm.items():
+            session = cls._get_session(url)
+            for _ in range(count):
+                tasks.append(cls._prewarm_connection(session, url))
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    @classmethod
+    async def _prewarm_connection(cls, session, url):
+        """ 使用HEAD请求建立一个连接，连接释放之后保留在连接池里
+        """
+        try:
+            response = await session.head(url, proxy=config.proxy, timeout=10)
+            response.release()
+        except Exception as e:
+            logger.warn("prewarm connection error! url:", url, "error:", e, caller=cls)
+
+    @classmethod
+    async def close(cls):
+        """ 关闭所有session和连接池
+        """
+        sessions = list(cls._SESSIONS.values())
+        cls._SESSIONS.clear()
+        for session in sessions:
+            await session.close()
+
     @classmethod
     def _get_session(cls, url):
         """ 获取url对应的session连接
@@ -105,6 +156,21 @@ class AsyncHttpRequests(object):
         parsed_url = urlparse(url)
         key = parsed_url.netloc or parsed_url.hostname
         if key not in cls._SESSIONS:
-            session = aiohttp.ClientSession()
+            settings = cls._get_settings(key)
+            connector = aiohttp.TCPConnector(limit=settings["limit"], limit_per_host=settings["limit_per_host"],
+                                             keepalive_timeout=settings["keepalive_timeout"],
+                                             ttl_dns_cache=settings["ttl_dns_cache"])
+            session = aiohttp.ClientSession(connector=connector)
             cls._SESSIONS[key] = session
         return cls._SESSIONS[key]
+
+    @classmethod
+    def _get_settings(cls, key):
+        """ 获取域名对应的连接池配置，优先级 HTTP.hosts[key] > HTTP > DEFAULT_SETTINGS
+        """
+        http = config.http or {}
+        settings = {}
+        for name, value in cls.DEFAULT_SETTINGS.items():
+            settings[name] = http.get(name, value)
+        settings.update(http.get("hosts", {}).get(key, {}))
+        return settings
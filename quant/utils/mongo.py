@@ -8,27 +8,57 @@ Date:   2018/04/28
 Update: 2018/12/11  1. 取消初始化使用类变量 DB 和 COLLECTION，直接在 self.__init__ 函数传入 db 和 collection;
                     2. 修改名称 self.conn 到 self._conn;
                     3. 修改名称 self.cursor 到 self._cursor;
+        2019/06/22  1. 增加写缓冲MongoWriteBuffer，插入和更新操作可以缓存在内存里批量写入;
+                    2. insert 等待 insert_many 执行完成;
+                    3. 增加表索引声明 INDEXES，首次读写表的时候自动创建索引;
+                    4. 增加查询计划检查，查询使用全表扫描时打印警告日志;
+        2019/06/23  1. 增加 iter_list、iter_batches、iter_arrays，按照批次流式读取查询结果;
+        2019/06/25  1. 增加 export_npz、import_npz，按天导出、导入列式存储的 .npz 文件;
+        2019/06/29  1. 写缓冲限制最大缓存操作数，超出时等待写入或者丢弃；写入失败(非数据错误)时重试;
+                    2. 检查查询计划之前等待表的索引创建完成，避免误报全表扫描;
+                    3. 索引创建成功之后才标记为已经创建，创建失败时下一次读写表的时候重试;
 """
 
+import os
 import copy
+import asyncio
+import datetime
+import itertools
 
 import motor.motor_asyncio
 from bson.objectid import ObjectId
 from urllib.parse import quote_plus
+from pymongo import InsertOne, UpdateOne, UpdateMany, IndexModel, ASCENDING
+from pymongo.errors import BulkWriteError
 
 from quant.utils import tools
 from quant.utils import logger
+from quant.tasks import LoopRunTask, SingleTask
 
 
-__all__ = ("initMongodb", "MongoDBBase", )
+__all__ = ("initMongodb", "closeMongodb", "MongoDBBase", "MongoWriteBuffer", "MongoBatchIterator",
+           "MongoItemIterator", )
 
 
 MONGO_CONN = None
+WRITE_BUFFER = None  # 写缓冲
+CHECK_QUERY_PLAN = False  # 是否检查查询计划
 DELETE_FLAG = "delete"  # True 已经删除，False 或者没有该字段表示没有删除
 
+INDEXED_COLLECTIONS = set()  # 已经成功创建索引的表 {collection_full_name}
+INDEXING_TASKS = {}  # 最近一次创建索引的协程 {collection_full_name: task}
+CHECKED_QUERIES = set()  # 已经检查过查询计划的查询 {(collection_full_name, spec_keys, sort_keys)}
 
-def initMongodb(host="127.0.0.1", port=27017, username="", password="", dbname="admin"):
+
+def initMongodb(host="127.0.0.1", port=27017, username="", password="", dbname="admin", batch_size=1000,
+                flush_interval=1, max_pending=100000, overflow_policy="await", max_retries=3, check_query_plan=False):
     """ 初始化mongodb连接
+    @param batch_size 写缓冲里每张表缓存的操作数达到batch_size时立即写入
+    @param flush_interval 写缓冲定时写入的时间间隔(秒)，必须是整秒
+    @param max_pending 写缓冲里最多缓存的操作数(包括正在写入的)
+    @param overflow_policy 写缓冲已满时的策略 await 等待写入完成 / drop 丢弃新的写操作
+    @param max_retries 写入失败(网络错误、超时等)时的重试次数，数据错误(如重复的_id)不重试
+    @param check_query_plan 是否检查查询计划，每种查询第一次执行时使用explain检查，使用全表扫描(COLLSCAN)时打印警告日志
     """
     if username and password:
         uri = "mongodb://{username}:{password}@{host}:{port}/{dbname}".format(username=quote_plus(username),
@@ -39,15 +69,164 @@ def initMongodb(host="127.0.0.1", port=27017, username="", password="", dbname="
     else:
         uri = "mongodb://{host}:{port}/{dbname}".format(host=host, port=port, dbname=dbname)
     mongo_client = motor.motor_asyncio.AsyncIOMotorClient(uri)
-    global MONGO_CONN
+    global MONGO_CONN, WRITE_BUFFER, CHECK_QUERY_PLAN
     MONGO_CONN = mongo_client
+    WRITE_BUFFER = MongoWriteBuffer(batch_size, flush_interval, max_pending, overflow_policy, max_retries)
+    CHECK_QUERY_PLAN = check_query_plan
     logger.info("create mongodb connection pool.")
 
 
+async def closeMongodb():
+    """ 将写缓冲里的数据全部写入数据库，并关闭mongodb连接
+    """
+    global MONGO_CONN
+    if WRITE_BUFFER:
+        await WRITE_BUFFER.flush()
+    if MONGO_CONN:
+        MONGO_CONN.close()
+        MONGO_CONN = None
+    logger.info("close mongodb connection pool.")
+
+
+class MongoWriteBuffer:
+    """ 写缓冲(write-behind)
+    插入和更新操作按照表缓存在内存里，每张表缓存的操作数达到batch_size，或者每隔flush_interval秒，使用 bulk_write 批量写入；
+    同一张表同时只有一个写入任务，连续的插入操作和连续的更新操作分别批量写入(unordered)，插入之后的更新不会先于插入执行；
+    缓存的操作数(包括正在写入的)达到max_pending时，按照overflow_policy等待写入完成或者丢弃新的写操作；写入失败时按照
+    1、2、4...秒的间隔重试max_retries次，重试期间这张表新缓存的操作等待本次写入完成之后再写入；
+    """
+
+    def __init__(self, batch_size=1000, flush_interval=1, max_pending=100000, overflow_policy="await", max_retries=3):
+        """ 初始化
+        @param batch_size 每张表缓存的操作数达到batch_size时立即写入
+        @param flush_interval 定时写入的时间间隔(秒)
+        @param max_pending 最多缓存的操作数(包括正在写入的)
+        @param overflow_policy 缓存已满时的策略 await 等待写入完成 / drop 丢弃新的写操作
+        @param max_retries 写入失败时的重试次数
+        """
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._overflow_policy = overflow_policy
+        self._max_retries = max_retries
+        self._pending = {}  # 等待写入的操作 {collection_full_name: (cursor, [request, ...])}
+        self._writing = {}  # 正在执行的写入任务 {collection_full_name: task}
+        self._pending_count = 0  # 缓存的操作数(包括正在写入的)
+        self._written_count = 0  # 写入成功的操作数
+        self._failed_count = 0  # 写入失败的操作数
+        self._dropped_count = 0  # 缓存已满被丢弃的操作数
+        self._retried_count = 0  # 重试写入的次数
+
+        LoopRunTask.register(self.flush, flush_interval)
+
+    @property
+    def pending_count(self):
+        return self._pending_count
+
+    @property
+    def dropped_count(self):
+        return self._dropped_count
+
+    @property
+    def retried_count(self):
+        return self._retried_count
+
+    @property
+    def written_count(self):
+        return self._written_count
+
+    @property
+    def failed_count(self):
+        return self._failed_count
+
+    async def add(self, cursor, request):
+        """ 缓存一个写操作，缓存已满时按照overflow_policy等待写入完成或者丢弃
+        @param cursor 表游标
+        @param request 写操作 InsertOne / UpdateOne / UpdateMany
+        @return True 缓存成功，False 缓存已满被丢弃
+        """
+        while self._pending_count >= self._max_pending:
+            if self._overflow_policy == "drop":
+                self._dropped_count += 1
+                if self._dropped_count % 1000 == 1:  # 避免缓存已满时大量打印日志
+                    logger.warn("write buffer is full, drop request! pending:", self._pending_count, "dropped:",
+                                self._dropped_count, caller=self)
+                return False
+            await self.flush()
+        key = cursor.full_name
+        item = self._pending.get(key)
+        if not item:
+            item = self._pending[key] = (cursor, [])
+        item[1].append(request)
+        self._pending_count += 1
+        if len(item[1]) >= self._batch_size:
+            self._start(key)
+        return True
+
+    async def flush(self, *args, **kwargs):
+        """ 写入所有缓存的操作，并等待写入完成
+        """
+        for key in list(self._pending):
+            self._start(key)
+        if self._writing:
+            await asyncio.wait(list(self._writing.values()))
+
+    def _start(self, key):
+        """ 启动表的写入任务，已经有写入任务在执行时不重复启动
+        """
+        if key not in self._writing:
+            self._writing[key] = asyncio.get_event_loop().create_task(self._write(key))
+
+    async def _write(self, key):
+        """ 写入一张表缓存的操作，写入期间新缓存的操作在本次写入完成之后继续写入
+        """
+        try:
+            while key in self._pending:
+                cursor, requests = self._pending.pop(key)
+                for _, group in itertools.groupby(requests, lambda r: isinstance(r, InsertOne)):
+                    await self._bulk_write(cursor, list(group))
+        finally:
+            del self._writing[key]
+
+    async def _bulk_write(self, cursor, requests):
+        """ 批量写入，网络错误、超时等失败时重试，数据错误(如重复的_id)的操作打印错误日志，不重试
+        """
+        try:
+            for retry in range(self._max_retries + 1):
+                try:
+                    await cursor.bulk_write(requests, ordered=False)
+                    self._written_count += len(requests)
+                    return
+                except BulkWriteError as e:
+                    errors = e.details.get("writeErrors", [])
+                    self._written_count += len(requests) - len(errors)
+                    self._failed_count += len(errors)
+                    logger.error("bulk write error! collection:", cursor.full_name, "total:", len(requests),
+                                 "failed:", len(errors), "first error:",
+                                 errors[0].get("errmsg") if errors else e.details, caller=self)
+                    return
+                except Exception as e:
+                    if retry >= self._max_retries:
+                        self._failed_count += len(requests)
+                        logger.error("bulk write error! collection:", cursor.full_name, "total:", len(requests),
+                                     "error:", e, caller=self)
+                        return
+                    logger.warn("bulk write error, retry later! collection:", cursor.full_name, "retry:", retry + 1,
+                                "error:", e, caller=self)
+                    self._retried_count += 1
+                    await asyncio.sleep(2 ** retry)
+        finally:
+            self._pending_count -= len(requests)
+
+
 class MongoDBBase(object):
     """ mongodb 数据库操作接口
     """
 
+    # 表的索引列表 [[(key, direction), ...], ...]，第一次读写表的时候自动创建；
+    # 所有查询都带有条件 {DELETE_FLAG: {"$ne": True}}，partialFilterExpression 不支持 $ne，所以创建索引时在最后追加软删除字段
+    # DELETE_FLAG，查询在索引里过滤已经删除的数据
+    INDEXES = []
+
     def __init__(self, db, collection):
         """ 初始化
         @param db 数据库
@@ -68,17 +247,158 @@ class MongoDBBase(object):
         @param cursor 查询游标，如不指定默认使用self._cursor
         * NOTE: 必须传入limit，否则默认返回数据条数可能因为pymongo的默认值而改变
         """
+        datas = []
+        result = self._find(spec, fields, sort, skip, limit, cursor)
+        async for item in result:
+            item["_id"] = str(item["_id"])
+            datas.append(item)
+        return datas
+
+    def iter_list(self, spec={}, fields=None, sort=[], skip=0, limit=0, batch_size=1000, cursor=None):
+        """ 流式获取数据，返回异步迭代器，按照批次从数据库读取，每次迭代返回一条数据，不在内存里保存整个查询结果
+        @param spec 查询条件
+        @param fields 返回数据的字段，只返回需要的字段可以减少传输的数据量
+        @param sort 排序规则
+        @param skip 查询起点
+        @param limit 返回数据条数，0为不限制
+        @param batch_size 每批从数据库读取的数据条数
+        @param cursor 查询游标，如不指定默认使用self._cursor
+        @return MongoItemIterator 使用方式 async for item in self.iter_list(spec): ...
+        """
+        return MongoItemIterator(self.iter_batches(spec, fields, sort, skip, limit, batch_size, cursor))
+
+    def iter_batches(self, spec={}, fields=None, sort=[], skip=0, limit=0, batch_size=1000, cursor=None):
+        """ 流式获取数据，返回异步迭代器，每次迭代返回一批数据(list)，除最后一批之外每批数据条数都为batch_size
+        @param 参数同 iter_list
+        @return MongoBatchIterator 使用方式 async for items in self.iter_batches(spec): ...
+        """
+        result = self._find(spec, fields, sort, skip, limit, cursor)
+        return MongoBatchIterator(result, batch_size, _convert_ids)
+
+    def iter_arrays(self, spec={}, fields=None, sort=[], skip=0, limit=0, batch_size=10000, dtype="float64",
+                    cursor=None):
+        """ 流式获取数值字段，返回异步迭代器，每次迭代返回一批数据的numpy数组 {field: numpy.ndarray}，需要安装numpy
+        @param spec 查询条件
+        @param fields 数值字段列表，如 ["t", "o", "h", "l", "c"]，只从数据库读取这些字段；字符串类型的数值将被转换，
+            缺失的字段为nan
+        @param sort 排序规则
+        @param skip 查询起点
+        @param limit 返回数据条数，0为不限制
+        @param batch_size 每批数据条数，除最后一批之外每批数组长度都为batch_size
+        @param dtype 数组的数据类型
+        @param cursor 查询游标，如不指定默认使用self._cursor
+        @return MongoBatchIterator 使用方式 async for arrays in self.iter_arrays(spec, ["t", "c"]): arrays["c"].mean()
+        """
+        import numpy as np
+
+        fields = list(fields)
+        projection = {field: 1 for field in fields}
+        projection["_id"] = 0
+
+        def convert(items):
+            return {field: np.array([item.get(field) for item in items], dtype=dtype) for field in fields}
+
+        result = self._find(spec, projection, sort, skip, limit, cursor)
+        return MongoBatchIterator(result, batch_size, convert)
+
+    async def export_npz(self, path, name, fields, start_ts, end_ts, ts_field="t", concurrency=4, batch_size=10000,
+                         cursor=None):
+        """ 按照UTC日期分区，将时间范围内的数据导出为列式存储的 .npz 压缩文件，每天一个文件 {path}/{name}_{YYYYMMDD}.npz；
+        每个分区使用独立的查询游标并发读取，文件压缩和写入在线程池里执行，需要安装numpy
+        @param path 导出目录
+        @param name 文件名前缀
+        @param fields 导出的数值字段列表，文件里每个字段保存为一个float64数组，另外保存数据的创建时间 create_time
+        @param start_ts 开始时间戳(秒)
+        @param end_ts 结束时间戳(秒)
+        @param ts_field 时间戳字段，按照此字段分区和排序
+        @param concurrency 同时读取的分区数量
+        @param batch_size 每批从数据库读取的数据条数
+        @param cursor 查询游标，如不指定默认使用self._cursor
+        @return filenames 导出的文件列表，没有数据的日期不生成文件
+        """
+        import numpy as np
+
         if not cursor:
             cursor = self._cursor
+        columns = list(fields)
+        if "create_time" not in columns:
+            columns.append("create_time")
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def export_day(day_start):
+            spec = {
+                ts_field: {
+                    "$gte": max(start_ts, day_start),
+                    "$lte": min(end_ts, day_start + 86400 - 1)
+                }
+            }
+            async with semaphore:
+                chunks = []
+                async for arrays in self.iter_arrays(spec, columns, [(ts_field, 1)], batch_size=batch_size,
+                                                     cursor=cursor):
+                    chunks.append(arrays)
+            if not chunks:
+                return None
+            arrays = {column: np.concatenate([chunk[column] for chunk in chunks]) for column in columns}
+            date = datetime.datetime.utcfromtimestamp(day_start).strftime("%Y%m%d")
+            filename = os.path.join(path, "{name}_{date}.npz".format(name=name, date=date))
+            await asyncio.get_event_loop().run_in_executor(None, _save_npz, filename, arrays)
+            logger.info("export success. collection:", cursor.full_name, "file:", filename, "count:",
+                        len(arrays[ts_field]), caller=self)
+            return filename
+
+        os.makedirs(path, exist_ok=True)
+        days = range(int(start_ts - start_ts % 86400), int(end_ts) + 1, 86400)
+        filenames = await asyncio.gather(*[export_day(day_start) for day_start in days])
+        return [filename for filename in filenames if filename]
+
+    async def import_npz(self, filename, ts_fields=("t", ), batch_size=10000, cursor=None):
+        """ 将 export_npz 导出的 .npz 文件批量导入数据库，每批数据使用一次 insert_many(unordered) 写入，需要安装numpy
+        @param filename 文件名
+        @param ts_fields 时间戳字段列表，整数值的时间戳导入为int类型，其它字段导入为float类型，nan为缺失字段不导入
+        @param batch_size 每批写入的数据条数
+        @param cursor 查询游标，如不指定默认使用self._cursor
+        @return count 导入的数据条数
+        * NOTE: 导入的数据使用新的_id，create_time 和 update_time 使用文件里保存的创建时间
+        """
+        if not cursor:
+            cursor = self._cursor
+        self._ensure_indexes_later(cursor)
+        arrays = await asyncio.get_event_loop().run_in_executor(None, _load_npz, filename)
+        int_fields = set(ts_fields) | {"create_time"}
+        columns = [(column, values.tolist(), column in int_fields) for column, values in arrays.items()]
+        count = len(columns[0][1]) if columns else 0
+        now = tools.get_cur_timestamp()
+        for start in range(0, count, batch_size):
+            docs = []
+            for index in range(start, min(start + batch_size, count)):
+                doc = {}
+                for column, values, is_int in columns:
+                    value = values[index]
+                    if value != value:  # nan
+                        continue
+                    doc[column] = int(value) if is_int and isinstance(value, float) and value.is_integer() else value
+                doc["_id"] = ObjectId()
+                doc["create_time"] = doc.get("create_time", now)
+                doc["update_time"] = doc["create_time"]
+                docs.append(doc)
+            await cursor.insert_many(docs, ordered=False)
+        logger.info("import success. collection:", cursor.full_name, "file:", filename, "count:", count, caller=self)
+        return count
+
+    def _find(self, spec, fields, sort, skip, limit, cursor):
+        """ 创建查询游标，增加软删除查询条件
+        """
+        if not cursor:
+            cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         if "_id" in spec:
             spec["_id"] = self._convert_id_object(spec["_id"])
         spec[DELETE_FLAG] = {"$ne": True}
-        datas = []
+        if CHECK_QUERY_PLAN:
+            self._check_query_plan_later(cursor, spec, sort)
         result = cursor.find(spec, fields, sort=sort, skip=skip, limit=limit)
-        async for item in result:
-            item["_id"] = str(item["_id"])
-            datas.append(item)
-        return datas
+        return result
 
     async def find_one(self, spec={}, fields=None, sort=[], cursor=None):
         """ 查找单条数据
@@ -103,47 +423,59 @@ class MongoDBBase(object):
         """
         if not cursor:
             cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         spec[DELETE_FLAG] = {"$ne": True}
         n = await cursor.count(spec)
         return n
 
-    async def insert(self, docs_data, cursor=None):
+    async def insert(self, docs_data, cursor=None, buffered=False):
         """ 插入数据
         @param docs_data 插入数据 dict或list
         @param ret_ids 插入数据的id列表
         @param cursor 查询游标，如不指定默认使用self._cursor
+        @param buffered 是否使用写缓冲，数据先缓存在内存里批量写入，返回的id在写入之前就可以使用；
+            * NOTE: 使用写缓冲时只拷贝数据的第一层字段，写入之前不能修改数据里嵌套的dict或list
         """
         if not cursor:
             cursor = self._cursor
-        docs = copy.deepcopy(docs_data)
+        self._ensure_indexes_later(cursor)
+        is_one = not isinstance(docs_data, list)
+        docs = [docs_data] if is_one else docs_data
+        if buffered:
+            docs = [copy.copy(doc) for doc in docs]
+        else:
+            docs = copy.deepcopy(docs)
         ret_ids = []
-        is_one = False
         create_time = tools.get_cur_timestamp()
-        if not isinstance(docs, list):
-            docs = [docs]
-            is_one = True
         for doc in docs:
             doc["_id"] = ObjectId()
             doc["create_time"] = create_time
             doc["update_time"] = create_time
             ret_ids.append(str(doc["_id"]))
-        cursor.insert_many(docs)
+        if buffered:
+            for doc in docs:
+                await WRITE_BUFFER.add(cursor, InsertOne(doc))
+        else:
+            await cursor.insert_many(docs)
         if is_one:
             return ret_ids[0]
         else:
             return ret_ids
 
-    async def update(self, spec, update_fields, upsert=False, multi=False, cursor=None):
+    async def update(self, spec, update_fields, upsert=False, multi=False, cursor=None, buffered=False):
         """ 更新
         @param spec 更新条件
         @param update_fields 更新字段
         @param upsert 如果不满足条件，是否插入新数据
         @param multi 是否批量更新
-        @return modified_count 更新数据条数
+        @return modified_count 更新数据条数，使用写缓冲时返回None
         @param cursor 查询游标，如不指定默认使用self._cursor
+        @param buffered 是否使用写缓冲，更新操作先缓存在内存里批量写入；
+            * NOTE: 同一批次里的更新操作不保证执行顺序，同一条数据的多次更新如果依赖顺序，不要使用写缓冲
         """
         if not cursor:
             cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         update_fields = copy.deepcopy(update_fields)
         spec[DELETE_FLAG] = {"$ne": True}
         if "_id" in spec:
@@ -151,6 +483,11 @@ class MongoDBBase(object):
         set_fields = update_fields.get("$set", {})
         set_fields["update_time"] = tools.get_cur_timestamp()
         update_fields["$set"] = set_fields
+        if buffered:
+            request = UpdateMany(spec, update_fields, upsert=upsert) if multi else UpdateOne(spec, update_fields,
+                                                                                             upsert=upsert)
+            await WRITE_BUFFER.add(cursor, request)
+            return None
         if not multi:
             result = await cursor.update_one(spec, update_fields, upsert=upsert)
             return result.modified_count
@@ -182,6 +519,7 @@ class MongoDBBase(object):
         """
         if not cursor:
             cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         if not multi:
             result = await cursor.delete_one(spec)
             return result.deleted_count
@@ -198,6 +536,7 @@ class MongoDBBase(object):
         """
         if not cursor:
             cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         spec[DELETE_FLAG] = {"$ne": True}
         if "_id" in spec:
             spec["_id"] = self._convert_id_object(spec["_id"])
@@ -216,6 +555,7 @@ class MongoDBBase(object):
         """
         if not cursor:
             cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         spec[DELETE_FLAG] = {"$ne": True}
         if "_id" in spec:
             spec["_id"] = self._convert_id_object(spec["_id"])
@@ -237,6 +577,7 @@ class MongoDBBase(object):
         """
         if not cursor:
             cursor = self._cursor
+        self._ensure_indexes_later(cursor)
         spec[DELETE_FLAG] = {"$ne": True}
         if "_id" in spec:
             spec["_id"] = self._convert_id_object(spec["_id"])
@@ -245,6 +586,59 @@ class MongoDBBase(object):
             result["_id"] = str(result["_id"])
         return result
 
+    async def ensure_indexes(self, cursor=None):
+        """ 创建表的索引 INDEXES，索引已经存在时不会重复创建
+        @param cursor 查询游标，如不指定默认使用self._cursor
+        """
+        if not cursor:
+            cursor = self._cursor
+        models = []
+        for keys in self.INDEXES:
+            keys = list(keys)
+            if DELETE_FLAG not in [key for key, _ in keys]:
+                keys.append((DELETE_FLAG, ASCENDING))
+            models.append(IndexModel(keys))
+        try:
+            names = await cursor.create_indexes(models)
+            INDEXED_COLLECTIONS.add(cursor.full_name)
+            logger.info("ensure indexes success. collection:", cursor.full_name, "indexes:", names, caller=self)
+        except Exception as e:
+            logger.error("ensure indexes error! collection:", cursor.full_name, "error:", e, caller=self)
+
+    def _ensure_indexes_later(self, cursor):
+        """ 第一次读写表的时候，在独立协程里创建索引；创建失败时，下一次读写表的时候重试
+        """
+        if not self.INDEXES or cursor.full_name in INDEXED_COLLECTIONS:
+            return
+        task = INDEXING_TASKS.get(cursor.full_name)
+        if task and not task.done():  # 正在创建索引
+            return
+        INDEXING_TASKS[cursor.full_name] = asyncio.get_event_loop().create_task(self.ensure_indexes(cursor))
+
+    def _check_query_plan_later(self, cursor, spec, sort):
+        """ 每种查询(相同的表、查询字段、排序字段)第一次执行时，在独立协程里检查查询计划
+        """
+        key = (cursor.full_name, tuple(sorted(spec)), tuple([k for k, _ in sort or []]))
+        if key not in CHECKED_QUERIES:
+            CHECKED_QUERIES.add(key)
+            SingleTask.run(self._check_query_plan, cursor, copy.deepcopy(spec), sort)
+
+    async def _check_query_plan(self, cursor, spec, sort):
+        """ 使用explain检查查询计划，使用全表扫描(COLLSCAN)时打印警告日志
+        * NOTE: 先等待表的索引创建完成，否则索引还没有创建时会误报全表扫描
+        """
+        task = INDEXING_TASKS.get(cursor.full_name)
+        if task:
+            await asyncio.shield(task)
+        try:
+            plan = await cursor.find(spec, sort=sort).explain()
+        except Exception as e:
+            logger.error("explain query error! collection:", cursor.full_name, "spec:", spec, "error:", e, caller=self)
+            return
+        if _find_plan_stage(plan.get("queryPlanner", {}).get("winningPlan"), "COLLSCAN"):
+            logger.warn("query uses collection scan! collection:", cursor.full_name, "spec:", spec, "sort:", sort,
+                        caller=self)
+
     def _convert_id_object(self, origin):
         """ 将字符串的_id转换成ObjectId类型
         """
@@ -256,3 +650,94 @@ class MongoDBBase(object):
             for key, value in origin.items():
                 origin[key] = self._convert_id_object(value)
         return origin
+
+
+class MongoBatchIterator:
+    """ 查询结果的异步迭代器，每次迭代从数据库读取一批数据
+    """
+
+    def __init__(self, result, batch_size=1000, convert=None):
+        """ 初始化
+        @param result 查询结果游标 cursor.find(...)
+        @param batch_size 每批数据条数
+        @param convert 每批数据的转换函数 convert(items)，返回值作为迭代结果
+        """
+        self._result = result.batch_size(batch_size)
+        self._batch_size = batch_size
+        self._convert = convert
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        items = await self._result.to_list(length=self._batch_size)
+        if not items:
+            raise StopAsyncIteration
+        return self._convert(items) if self._convert else items
+
+
+class MongoItemIterator:
+    """ 查询结果的异步迭代器，按照批次读取，每次迭代返回一条数据
+    """
+
+    def __init__(self, batches):
+        """ 初始化
+        @param batches 批次迭代器 MongoBatchIterator
+        """
+        self._batches = batches
+        self._items = []
+        self._index = 0
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._index >= len(self._items):
+            self._items = await self._batches.__anext__()
+            self._index = 0
+        item = self._items[self._index]
+        self._index += 1
+        return item
+
+
+def _save_npz(filename, arrays):
+    """ 保存 .npz 压缩文件，先写入临时文件再重命名，避免读到写了一半的文件
+    """
+    import numpy as np
+
+    tmp = filename + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp, filename)
+
+
+def _load_npz(filename):
+    """ 读取 .npz 文件里的所有数组
+    """
+    import numpy as np
+
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+def _convert_ids(items):
+    """ 将数据的_id转换成字符串
+    """
+    for item in items:
+        if "_id" in item:
+            item["_id"] = str(item["_id"])
+    return items
+
+
+def _find_plan_stage(plan, stage):
+    """ 查询计划里是否有指定的阶段
+    @param plan 查询计划 winningPlan
+    @param stage 阶段名称，如 COLLSCAN
+    """
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            return True
+        return any([_find_plan_stage(value, stage) for value in plan.values()])
+    if isinstance(plan, list):
+        return any([_find_plan_stage(item, stage) for item in plan])
+    return False
@@ -0,0 +1,194 @@
+# -*- coding:utf-8 -*-
+
+"""
+REST API 限频
+每个交易平台使用一个加权令牌桶，每个请求按照接口权重消耗令牌，令牌不足时按照优先级排队等待，下单、撤单优先于行情、账户、历史查询；
+根据交易平台返回的已使用权重(如 binance X-MBX-USED-WEIGHT)调整剩余令牌，收到 429 / 418 时暂停发送请求。
+
+Author: HuangTao
+Date:   2019/06/27
+"""
+
+import heapq
+import asyncio
+
+from quant import const
+from quant.utils import logger
+from quant.config import config
+
+
+__all__ = ("RateLimiter", "get_limiter", "PRIORITY_HIGH", "PRIORITY_NORMAL", "PRIORITY_LOW", )
+
+
+# 请求优先级，数值越小越优先
+PRIORITY_HIGH = 0  # 下单、撤单
+PRIORITY_NORMAL = 1  # 行情、订单状态查询
+PRIORITY_LOW = 2  # 账户、历史订单查询
+
+# 交易平台默认限频配置，可以被配置文件 RATE_LIMIT 里的配置覆盖
+DEFAULT_LIMITS = {
+    const.BINANCE: {
+        "capacity": 1200,  # 时间窗口内最大权重
+        "interval": 60,  # 时间窗口(秒)
+        "used_weight_headers": ["X-MBX-USED-WEIGHT-1M", "X-MBX-USED-WEIGHT"],  # 已使用权重的响应头
+        "weights": {  # 接口权重，按照uri前缀匹配，默认为1
+            "/api/v3/account": 5,
+            "/api/v3/allOrders": 5
+        }
+    },
+    const.OKEX: {
+        "capacity": 100,
+        "interval": 2,
+        "weights": {
+            "/api/spot/v3/accounts": 5,
+            "/api/spot/v3/orders_pending": 5,
+            "/api/spot/v3/cancel_batch_orders": 2,
+            "/api/spot/v3/batch_orders": 2
+        }
+    },
+    const.OKEX_FUTURE: {
+        "capacity": 100,
+        "interval": 2,
+        "weights": {
+            "/api/futures/v3/accounts": 20,
+            "/api/futures/v3/orders/": 5,
+            "/api/futures/v3/orders": 2,
+            "/api/futures/v3/cancel_batch_orders": 2
+        }
+    }
+}
+
+LIMITERS = {}  # 每个交易平台的限频器 {platform: RateLimiter}
+
+
+def get_limiter(platform):
+    """ 获取交易平台的限频器，没有配置限频的交易平台返回None
+    @param platform 交易平台
+    """
+    if platform not in LIMITERS:
+        settings = dict(DEFAULT_LIMITS.get(platform, {}))
+        settings.update((config.rate_limit or {}).get(platform, {}))
+        if settings.get("capacity") and settings.get("interval"):
+            LIMITERS[platform] = RateLimiter(platform, settings["capacity"], settings["interval"],
+                                             settings.get("weights"), settings.get("used_weight_headers"))
+        else:
+            LIMITERS[platform] = None
+    return LIMITERS[platform]
+
+
+class RateLimiter:
+    """ 加权令牌桶限频器
+    """
+
+    def __init__(self, name, capacity, interval, weights=None, used_weight_headers=None):
+        """ 初始化
+        @param name 名称
+        @param capacity 时间窗口内最大权重，也是令牌桶的容量
+        @param interval 时间窗口(秒)，令牌按照 capacity / interval 的速度补充
+        @param weights 接口权重 {uri前缀: 权重}
+        @param used_weight_headers 已使用权重的响应头列表
+        """
+        self._name = name
+        self._capacity = capacity
+        self._rate = capacity / interval  # 每秒补充的令牌数
+        self._weights = sorted((weights or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self._used_weight_headers = used_weight_headers or []
+        self._tokens = capacity  # 剩余令牌
+        self._updated_at = None  # 上一次补充令牌的时间
+        self._waiters = []  # 等待令牌的请求 [(priority, seq, weight, future), ...]
+        self._seq = 0  # 等待请求的序号，相同优先级先到先得
+        self._handle = None  # 唤醒等待请求的定时器
+        self._waited_count = 0  # 需要排队等待的请求数量
+        self._paused_count = 0  # 收到429/418的次数
+
+    @property
+    def tokens(self):
+        self._refill()
+        return self._tokens
+
+    @property
+    def waiting_count(self):
+        return len(self._waiters)
+
+    @property
+    def stats(self):
+        d = {
+            "tokens": self.tokens,
+            "waiting": self.waiting_count,
+            "waited": self._waited_count,
+            "paused": self._paused_count
+        }
+        return d
+
+    def get_weight(self, uri):
+        """ 接口权重，按照最长的uri前缀匹配，默认为1
+        @param uri 请求uri
+        """
+        for prefix, weight in self._weights:
+            if uri.startswith(prefix):
+                return weight
+        return 1
+
+    async def acquire(self, weight=1, priority=PRIORITY_NORMAL):
+        """ 获取令牌，令牌不足或者有更高优先级的请求在等待时排队
+        @param weight 请求权重
+        @param priority 请求优先级 PRIORITY_HIGH / PRIORITY_NORMAL / PRIORITY_LOW
+        """
+        weight = min(weight, self._capacity)
+        self._refill()
+        if not self._waiters and self._tokens >= weight:
+            self._tokens -= weight
+            return
+        future = asyncio.get_event_loop().create_future()
+        self._seq += 1
+        heapq.heappush(self._waiters, (priority, self._seq, weight, future))
+        self._waited_count += 1
+        self._schedule()
+        await future
+
+    def update(self, code, headers):
+        """ 根据响应调整剩余令牌
+        @param code HTTP状态码
+        @param headers 响应头
+        """
+        self._refill()
+        for name in self._used_weight_headers:
+            used = headers.get(name)
+            if used is not None:
+                self._tokens = min(self._tokens, self._capacity - float(used))
+                break
+        if code in (418, 429):  # 请求过多，暂停发送请求
+            retry_after = headers.get("Retry-After")
+            seconds = float(retry_after) if retry_after else self._capacity / self._rate
+            self._tokens = min(self._tokens, -self._rate * seconds)
+            self._paused_count += 1
+            logger.warn("rate limited! name:", self._name, "code:", code, "pause seconds:", seconds, caller=self)
+        self._schedule()
+
+    def _refill(self):
+        """ 按照经过的时间补充令牌
+        """
+        now = asyncio.get_event_loop().time()
+        if self._updated_at is not None:
+            self._tokens = min(self._capacity, self._tokens + (now - self._updated_at) * self._rate)
+        self._updated_at = now
+
+    def _schedule(self):
+        """ 令牌足够时唤醒等待的请求，否则在令牌补充足够的时候再唤醒
+        """
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        self._refill()
+        while self._waiters:
+            _, _, weight, future = self._waiters[0]
+            if future.done():  # 等待的请求已经取消
+                heapq.heappop(self._waiters)
+                continue
+            if self._tokens < weight:
+                delay = (weight - self._tokens) / self._rate
+                self._handle = asyncio.get_event_loop().call_later(delay, self._schedule)
+                break
+            heapq.heappop(self._waiters)
+            self._tokens -= weight
+            future.set_result(None)
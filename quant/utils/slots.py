@@ -0,0 +1,44 @@
+# -*- coding:utf-8 -*-
+
+"""
+使用__slots__的数据对象基类
+子类在 __slots__ 里声明所有的公开属性，对象没有 __dict__，内存占用更小，创建更快；
+支持按照字典的方式读取属性，如 orderbook["asks"]、dict(orderbook)，不需要先构造dict。
+
+Author: HuangTao
+Date:   2019/06/21
+"""
+
+__all__ = ("SlotsData", )
+
+
+class SlotsData:
+    """ 使用__slots__的数据对象基类
+    """
+
+    __slots__ = ()
+
+    def keys(self):
+        """ 所有的属性名，顺序与 __slots__ 一致
+        """
+        return self.__slots__
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        """ 读取属性，属性不存在时返回default
+        """
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    @property
+    def data(self):
+        """ 所有属性的字典，子类可以覆盖为字典字面量的实现，速度更快
+        """
+        return {key: getattr(self, key) for key in self.__slots__}
@@ -0,0 +1,102 @@
+# -*- coding:utf-8 -*-
+
+"""
+Topic路由匹配，规则与RabbitMQ topic交换机一致
+1. routing_key由 `.` 分隔成多个单词；
+2. `*` 匹配一个单词；
+3. `#` 匹配零个或多个单词；
+
+Author: HuangTao
+Date:   2019/06/07
+"""
+
+import sys
+
+
+__all__ = ("TopicTrie", )
+
+
+class _TrieNode:
+    """ 前缀树节点
+    """
+
+    __slots__ = ("children", "values")
+
+    def __init__(self):
+        self.children = {}  # 子节点 {"word": node}
+        self.values = []  # 匹配到此节点的值
+
+
+class TopicTrie:
+    """ Topic路由前缀树，按照 `.` 分隔的单词建立索引，支持 `*` 和 `#` 通配符
+    * NOTE: 匹配结果按照routing_key缓存，重复匹配相同的routing_key时直接返回缓存的结果，不会创建新的对象
+    """
+
+    def __init__(self):
+        self._root = _TrieNode()
+        self._cache = {}  # 匹配结果缓存 {"routing_key": (value, ...)}
+
+    def add(self, pattern, value):
+        """ 增加一条路由规则
+        @param pattern 路由规则，如 `binance.BTC/USDT` 或 `binance.*` 或 `#`
+        @param value 匹配到的值
+        """
+        node = self._root
+        for word in pattern.split("."):
+            word = sys.intern(word)
+            child = node.children.get(word)
+            if not child:
+                child = _TrieNode()
+                node.children[word] = child
+            node = child
+        node.values.append(value)
+        self._cache.clear()
+
+    def remove(self, pattern, value):
+        """ 删除一条路由规则
+        @param pattern 路由规则
+        @param value 匹配到的值
+        """
+        node = self._root
+        for word in pattern.split("."):
+            node = node.children.get(word)
+            if not node:
+                return
+        if value in node.values:
+            node.values.remove(value)
+            self._cache.clear()
+
+    def match(self, routing_key):
+        """ 匹配routing_key
+        @param routing_key 路由
+        @return 匹配到的值元组，相同的值只返回一次
+        """
+        result = self._cache.get(routing_key)
+        if result is None:
+            values = []
+            self._match(self._root, routing_key.split("."), 0, values)
+            result = tuple(dict.fromkeys(values))
+            self._cache[sys.intern(routing_key)] = result
+        return result
+
+    def _match(self, node, words, index, values):
+        """ 递归匹配
+        @param node 当前节点
+        @param words routing_key分隔后的单词列表
+        @param index 当前匹配的单词位置
+        @param values 匹配到的值
+        """
+        # `#` 匹配零个或多个单词
+        child = node.children.get("#")
+        if child:
+            for i in range(index, len(words) + 1):
+                self._match(child, words, i, values)
+        if index == len(words):
+            values.extend(node.values)
+            return
+        child = node.children.get(words[index])
+        if child:
+            self._match(child, words, index + 1, values)
+        child = node.children.get("*")
+        if child:
+            self._match(child, words, index + 1, values)
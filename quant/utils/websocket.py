@@ -5,6 +5,12 @@ websocket接口封装
 
 Author: HuangTao
 Date:   2018/06/29
+Update: 2019/06/28  1. 接收消息改为处理管道：读取消息之后放入有界队列，按照消息通道分配给处理协程，同一通道的消息顺序处理，
+                       不同通道的消息并发处理，处理慢不会阻塞读取消息；
+                    2. 支持使用 orjson 解析json消息；
+                    3. 增加队列长度、处理延迟统计 pipeline_stats；
+                    4. 空闲的消息通道自动回收，重新连接时清理所有消息通道；binary消息可以先解码再按照通道分发；
+        2019/06/29  1. 处理协程只在队列为空时等待超时，json解析失败时不再重复解析，直接分发原始字符串；
 """
 
 import json
@@ -16,6 +22,19 @@ from quant.config import config
 from quant.heartbeat import heartbeat
 
 
+def get_json_loads():
+    """ 获取json解析函数，配置 WEBSOCKET.json_decoder 为 orjson 并且已经安装 orjson 时使用 orjson，否则使用标准库json
+    """
+    decoder = (config.websocket or {}).get("json_decoder", "json")
+    if decoder == "orjson":
+        try:
+            import orjson
+            return orjson.loads
+        except ImportError:
+            logger.warn("orjson not installed, use json instead!")
+    return json.loads
+
+
 class Websocket:
     """ websocket接口封装
     """
@@ -32,6 +51,20 @@ class Websocket:
         self._send_hb_interval = send_hb_interval
         self.heartbeat_msg = None  # 心跳消息
 
+        # 消息处理管道
+        self._queue_size = (config.websocket or {}).get("queue_size", 10000)  # 等待处理的消息数量上限
+        self._json_loads = get_json_loads()
+        self._slots = asyncio.Semaphore(self._queue_size)  # 队列剩余空间
+        self._channel_idle_timeout = (config.websocket or {}).get("channel_idle_timeout", 60)  # 通道空闲回收时间(秒)
+        self._channels = {}  # 每个通道的消息队列 {channel: asyncio.Queue}
+        self._workers = {}  # 每个通道的处理协程 {channel: asyncio.Task}
+        self._pending_count = 0  # 等待处理的消息数量
+        self._max_pending_count = 0  # 等待处理的消息数量最大值
+        self._full_count = 0  # 队列满的次数
+        self._processed_count = 0  # 已经处理的消息数量
+        self._latency_total = 0  # 消息从放入队列到处理完成的总耗时(秒)
+        self._latency_max = 0  # 消息从放入队列到处理完成的最大耗时(秒)
+
     def initialize(self):
         """ 初始化
         """
@@ -58,6 +91,7 @@ class Websocket:
         """ 重新建立websocket连接
         """
         logger.warn("reconnecting websocket right now!", caller=self)
+        self._clear_channels()
         await self._connect()
 
     async def connected_callback(self):
@@ -66,18 +100,33 @@ class Websocket:
         """
         pass
 
+    @property
+    def pipeline_stats(self):
+        """ 消息处理管道统计
+        """
+        d = {
+            "pending": self._pending_count,
+            "max_pending": self._max_pending_count,
+            "full": self._full_count,
+            "processed": self._processed_count,
+            "channels": len(self._channels),
+            "avg_latency": self._latency_total / self._processed_count if self._processed_count else 0,
+            "max_latency": self._latency_max
+        }
+        return d
+
     async def receive(self):
-        """ 接收消息
+        """ 接收消息，解析之后放入消息处理管道
         """
         async for msg in self.ws:
             if msg.type == aiohttp.WSMsgType.TEXT:
-                try:
-                    data = json.loads(msg.data)
-                except:
-                    data = msg.data
-                await asyncio.get_event_loop().create_task(self.process(data))
+                await self._dispatch(self.process, self._loads(msg.data))
             elif msg.type == aiohttp.WSMsgType.BINARY:
-                await asyncio.get_event_loop().create_task(self.process_binary(msg.data))
+                data = self.decode_binary(msg.data)
+                if data is None:
+                    await self._dispatch(self.process_binary, msg.data)
+                    continue
+                await self._dispatch(self.process, self._loads(data))
             elif msg.type == aiohttp.WSMsgType.CLOSED:
                 logger.warn("receive event CLOSED:", msg, caller=self)
                 await asyncio.get_event_loop().create_task(self._reconnect())
@@ -87,6 +136,100 @@ class Websocket:
             else:
                 logger.warn("unhandled msg:", msg, caller=self)
 
+    def _loads(self, data):
+        """ 解析json消息，不是json格式(如心跳回复 "pong")时返回原始数据
+        @param data 消息字符串
+        """
+        try:
+            return self._json_loads(data)
+        except:
+            return data
+
+    def decode_binary(self, raw):
+        """ 将binary消息解码成字符串，解码之后的消息和text消息一样解析json、按照通道分发给 process 处理
+        @param raw binary原始数据
+        @return 解码之后的字符串，返回None表示不解码，原始数据分发给 process_binary 处理
+        * NOTE: 子类继承实现，如解压缩数据
+        """
+        return None
+
+    def get_channel(self, msg):
+        """ 消息通道，同一通道的消息按照接收顺序处理，不同通道的消息并发处理
+        @param msg 接收到的消息，text 类型为解析之后的数据，binary 类型为原始数据
+        * NOTE: 默认所有消息在同一通道，子类可以继承实现，如按照交易对划分通道
+        """
+        return None
+
+    def _clear_channels(self):
+        """ 取消所有通道的处理协程，丢弃还没有处理的消息
+        """
+        for task in self._workers.values():
+            task.cancel()
+        if self._pending_count:
+            logger.warn("drop pending messages:", self._pending_count, caller=self)
+        self._workers = {}
+        self._channels = {}
+        # 唤醒等待队列空间的读取协程，读取协程发现队列已经被替换之后丢弃消息
+        for _ in range(self._pending_count):
+            self._slots.release()
+        self._pending_count = 0
+        self._slots = asyncio.Semaphore(self._queue_size)
+
+    async def _dispatch(self, func, msg):
+        """ 将消息放入对应通道的队列，队列满时等待
+        @param func 消息处理函数 process / process_binary
+        @param msg 消息
+        """
+        if self._slots.locked():
+            self._full_count += 1
+            if self._full_count % 1000 == 1:  # 避免队列满时大量打印日志
+                logger.warn("message queue is full! pending:", self._pending_count, "full count:", self._full_count,
+                            caller=self)
+        slots = self._slots
+        await slots.acquire()
+        if slots is not self._slots:  # 等待期间通道已经被清理
+            return
+        channel = self.get_channel(msg)
+        queue = self._channels.get(channel)
+        if queue is None:
+            queue = asyncio.Queue()
+            self._channels[channel] = queue
+            self._workers[channel] = asyncio.get_event_loop().create_task(self._work(channel, queue))
+        queue.put_nowait((func, msg, asyncio.get_event_loop().time()))
+        self._pending_count += 1
+        self._max_pending_count = max(self._max_pending_count, self._pending_count)
+
+    async def _work(self, channel, queue):
+        """ 按照顺序处理一个通道的消息，通道空闲超过 channel_idle_timeout 秒之后回收
+        @param channel 通道
+        @param queue 通道的消息队列
+        """
+        while True:
+            if not queue.empty():  # 队列里有消息时直接读取，不创建超时等待
+                func, msg, ts = queue.get_nowait()
+            else:
+                try:
+                    func, msg, ts = await asyncio.wait_for(queue.get(), self._channel_idle_timeout)
+                except asyncio.TimeoutError:
+                    if not queue.empty():
+                        continue
+                    if self._channels.get(channel) is queue:
+                        self._channels.pop(channel)
+                        self._workers.pop(channel)
+                    return
+            try:
+                await func(msg)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("process message error:", e, caller=self)
+            latency = asyncio.get_event_loop().time() - ts
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+            self._processed_count += 1
+            self._pending_count -= 1
+            self._slots.release()
+
     async def process(self, msg):
         """ 处理websocket上接收到的消息 text 类型
         * NOTE: 子类继承实现